@@ -0,0 +1,209 @@
+# Admission control in front of warehouse queries.
+# Per-user token buckets reject question floods up front; a per-warehouse concurrency budget with
+# two-level (channel, user) start-time fair queuing decides whose SQL runs next when the warehouse is busy.
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import tracing
+from metrics import REGISTRY
+
+WAREHOUSE_CONCURRENCY = int(os.getenv("WAREHOUSE_CONCURRENCY", "4"))
+# Bot processes sharing the warehouse budget; workers.py and gunicorn.conf.py default it to their worker
+# count. Set it to the total across hosts when several hosts use the same warehouse
+WAREHOUSE_PROCESSES = max(1, int(os.getenv("WAREHOUSE_PROCESSES", "1")))
+# Seconds between sweeps of idle per-user and per-channel state
+SCHEDULER_PRUNE_INTERVAL = float(os.getenv("SCHEDULER_PRUNE_INTERVAL", "60"))
+# Sustained questions per minute per user, and how many may be asked back to back
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "6"))
+USER_BURST = float(os.getenv("USER_BURST", "3"))
+# JSON map of user or channel ID to scheduling weight, e.g. {"C0123": 2, "U0456": 0.5}
+SCHEDULER_WEIGHTS = json.loads(os.getenv("SCHEDULER_WEIGHTS", "{}") or "{}")
+
+QUEUE_DEPTH = REGISTRY.gauge("gboagent_warehouse_queue_depth", "Queries waiting for a warehouse slot.", ("warehouse",))
+RUNNING = REGISTRY.gauge("gboagent_warehouse_running", "Queries holding a warehouse slot.", ("warehouse",))
+QUEUE_WAIT = REGISTRY.histogram("gboagent_warehouse_queue_wait_seconds", "Time spent waiting for a warehouse slot.", ("warehouse",))
+RATE_LIMITED = REGISTRY.counter("gboagent_rate_limited_total", "Questions rejected by the per-user rate limit.")
+
+logger = logging.getLogger(__name__)
+
+
+def process_concurrency(concurrency: int = WAREHOUSE_CONCURRENCY, processes: int = WAREHOUSE_PROCESSES) -> int:
+    """This process's share of the warehouse budget; every process gets at least one slot."""
+    if processes > concurrency:
+        logger.warning("%d processes share a warehouse budget of %d; each still gets one slot", processes, concurrency)
+    return max(1, concurrency // processes)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount: float = 1.0) -> float:
+        """Take amount tokens. Returns 0 on success, else seconds until enough tokens accrue."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class _Waiter:
+    __slots__ = ("event", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.cancelled = False
+
+
+class WarehouseScheduler:
+    """Concurrency budget and fair queue for one warehouse."""
+
+    def __init__(self, warehouse: str, concurrency: int = None, rate_per_minute: float = USER_RATE_PER_MINUTE,
+                 burst: float = USER_BURST, weights: dict = None):
+        self.warehouse = warehouse or "default"
+        self.concurrency = process_concurrency() if concurrency is None else concurrency
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self.weights = SCHEDULER_WEIGHTS if weights is None else weights
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._queue = []  # heap of (start_tag, seq, waiter)
+        self._seq = itertools.count()
+        self._running = 0
+        self._virtual_time = 0.0
+        self._channel_finish = {}
+        self._user_finish = {}
+        self._pruned_at = time.monotonic()
+        QUEUE_DEPTH.set_function(self.queue_depth, warehouse=self.warehouse)
+        RUNNING.set_function(lambda: self._running, warehouse=self.warehouse)
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, w in self._queue if not w.cancelled)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"warehouse": self.warehouse, "running": self._running, "queued": self.queue_depth(),
+                    "concurrency": self.concurrency, "virtual_time": self._virtual_time}
+
+    def admit(self, user: str):
+        """Charge one question to user's token bucket; raises RateLimited when the user is going too fast."""
+        if not user or self.rate_per_second <= 0:
+            return
+        with self._lock:
+            self._prune()
+            bucket = self._buckets.get(user)
+            if bucket is None:
+                bucket = self._buckets[user] = TokenBucket(self.rate_per_second, self.burst)
+            retry_after = bucket.take()
+        if retry_after:
+            RATE_LIMITED.inc()
+            raise RateLimited(retry_after)
+
+    def _prune(self):
+        """
+        Forget idle users and channels, at most every SCHEDULER_PRUNE_INTERVAL. A refilled bucket, a finish tag
+        the virtual clock has passed and any finish tag while the warehouse is idle all behave like missing ones.
+        Caller holds the lock.
+        """
+        now = time.monotonic()
+        if now - self._pruned_at < SCHEDULER_PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        for user in [u for u, b in self._buckets.items() if b.tokens + (now - b.updated) * b.rate >= b.capacity]:
+            del self._buckets[user]
+        if not self._queue and not self._running:
+            # Idle: nobody has a share to catch up on
+            self._channel_finish.clear()
+            self._user_finish.clear()
+            return
+        for finish in (self._channel_finish, self._user_finish):
+            for key in [k for k, tag in finish.items() if tag <= self._virtual_time]:
+                del finish[key]
+
+    def _start_tag(self, user: str, channel: str) -> float:
+        # Start-time fair queuing on two levels: a request may not start before its channel's or its
+        # user's previous request has "finished" in virtual time, scaled by their weights.
+        start = max(self._virtual_time, self._channel_finish.get(channel, 0.0), self._user_finish.get(user, 0.0))
+        self._channel_finish[channel] = start + 1.0 / self.weights.get(channel, 1.0)
+        self._user_finish[user] = start + 1.0 / self.weights.get(user, 1.0)
+        return start
+
+    def _dispatch(self):
+        """Hand free slots to the queued waiters with the smallest start tags. Caller holds the lock."""
+        while self._queue and self._running < self.concurrency:
+            start, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            self._virtual_time = max(self._virtual_time, start)
+            self._running += 1
+            waiter.event.set()
+
+    @contextmanager
+    def slot(self, user: str = None, channel: str = None, deadline=None, on_queued=None):
+        """Hold one of the warehouse's concurrency slots for the duration of the block."""
+        queued_at = time.monotonic()
+        waiter = _Waiter()
+        with self._lock:
+            self._prune()
+            start = self._start_tag(user or "", channel or "")
+            if self._running < self.concurrency and not self._queue:
+                self._virtual_time = max(self._virtual_time, start)
+                self._running += 1
+                waiter.event.set()
+            else:
+                heapq.heappush(self._queue, (start, next(self._seq), waiter))
+                position = sum(1 for s, _, w in self._queue if s <= start and not w.cancelled)
+        if not waiter.event.is_set():
+            if on_queued:
+                on_queued(position)
+            try:
+                while not waiter.event.wait(0.25):
+                    if deadline is not None:
+                        deadline.check()
+            except BaseException:
+                with self._lock:
+                    waiter.cancelled = True
+                    if waiter.event.is_set():
+                        # Lost the race: the slot was granted while we were giving up
+                        self._running -= 1
+                        self._dispatch()
+                raise
+        waited = time.monotonic() - queued_at
+        QUEUE_WAIT.observe(waited, warehouse=self.warehouse)
+        tracing.record("sql.queue", waited, warehouse=self.warehouse)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._dispatch()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(warehouse: str) -> WarehouseScheduler:
+    """One shared scheduler per warehouse name."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(warehouse)
+        if scheduler is None:
+            scheduler = _schedulers[warehouse] = WarehouseScheduler(warehouse)
+        return scheduler
@@ -13,13 +13,32 @@ import time
 import requests
 import re
 import json
+import logging
 from datetime import datetime
 import io
 
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.backends import default_backend
 
+import admission
 import cortex_chat
+import cortex_search
+import exports
+import history_store
+import idempotency
+import load_shedding
+import log_setup
+import pipeline
+import reports
+import result_store
+import slack_gateway
+import sql_guard
+import table_render
+import telemetry
+import view_publisher
+from deadline import InFlightRegistry
+from log_setup import payload
+from shared_state import shared_backend
 ##This alternate option for the app has more fucntionality but is incredibly bloated so its more interesting than usefull
 matplotlib.use('Agg')
 plt.style.use('seaborn-v0_8-darkgrid')
@@ -43,33 +62,55 @@ SEMANTIC_MODEL = os.getenv("SEMANTIC_MODEL")
 RSA_PRIVATE_KEY_PATH = os.getenv("RSA_PRIVATE_KEY_PATH")
 RSA_PRIVATE_KEY_PASSWORD = os.getenv("RSA_PRIVATE_KEY_PASSWORD")
 MODEL = os.getenv("MODEL")
+# Longest the charts may take to render before they are given up on
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "30"))
 
 app = App(token=SLACK_BOT_TOKEN)
+logger = logging.getLogger(__name__)
+# Set by init() in __main__, or by workers.py in its processes
+CONN = CORTEX_APP = None
 
-# In-memory storage for chat history (in production, use a database)
-chat_history = {}
+# Persistent chat history: compact entries in SQLite, recent entries of active users cached in memory
+HISTORY = history_store.open_history_store()
 
-def get_user_history(user_id):
-    """Get chat history for a specific user."""
-    return chat_history.get(user_id, [])
+# Query results on disk, by content handle; history entries and export buttons refer to them
+RESULTS = result_store.get_result_store()
+
+# Saved and popular questions, answered off-peak and served from their last run
+REPORTS = reports.get_report_store()
+
+# One in-flight question per user: a new message aborts the previous one
+IN_FLIGHT = InFlightRegistry(backend=shared_backend())
+
+# Event IDs already accepted, so Slack's redeliveries are dropped before any work starts
+SEEN_EVENTS = idempotency.SeenEvents()
+
+# Answers and feedback, bulk-loaded in the background (TELEMETRY_BACKEND)
+TELEMETRY = telemetry.open_sink(lambda: CONN)
+
+# App Home publishing: skips views a user already has and paces bursts under the rate limit
+HOME_VIEWS = view_publisher.ViewPublisher()
+
+def get_user_history(user_id, limit=10):
+    """Get the most recent history entries for a specific user, newest first."""
+    return HISTORY.recent(user_id, limit)
 
 def add_to_history(user_id, query, response):
-    """Add a query and response to user's chat history."""
-    if user_id not in chat_history:
-        chat_history[user_id] = []
-    
-    chat_history[user_id].append({
-        'timestamp': datetime.now().isoformat(),
-        'query': query,
-        'response': response
-    })
-    
-    # Keep only last 50 conversations per user
-    if len(chat_history[user_id]) > 50:
-        chat_history[user_id] = chat_history[user_id][-50:]
+    """Add a compact record of a query and its response to user's chat history."""
+    HISTORY.add(user_id, query, response)
+
+def load_result(content):
+    """
+    The response's result DataFrame: the one the answer carries, else the result store's; None if neither
+    has it. The SQL is never run again here, where the cost guard, scheduler and deadline don't apply.
+    """
+    df = content.get('dataframe')
+    if df is None:
+        df = RESULTS.frame(content.get('result_handle'))
+    return df
 
 def build_home_tab():
-    """Build the home tab view with navigation."""
+    """Build the home tab view with navigation. It never changes, so it is built once as HOME_VIEW."""
     return {
         "type": "home",
         "blocks": [
@@ -148,110 +189,103 @@ def build_home_tab():
         ]
     }
 
-def build_history_tab(user_id):
-    """Build the history tab view."""
-    history = get_user_history(user_id)
-    
-    blocks = [
+HOME_VIEW = build_home_tab()
+
+# Static parts of the history tab, built once; only the entry sections vary per user
+HISTORY_HEADER = {
+    "type": "header",
+    "text": {
+        "type": "plain_text",
+        "text": "📊 Query History"
+    }
+}
+
+BACK_TO_HOME_BUTTON = {
+    "type": "button",
+    "text": {
+        "type": "plain_text",
+        "text": "🏠 Back to Home"
+    },
+    "action_id": "back_to_home"
+}
+
+EMPTY_HISTORY_BLOCKS = [
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "No queries yet! Start a conversation to see your history here."
+        }
+    },
+    {
+        "type": "actions",
+        "elements": [BACK_TO_HOME_BUTTON]
+    }
+]
+
+HISTORY_ACTIONS = {
+    "type": "actions",
+    "elements": [
         {
-            "type": "header",
+            "type": "button",
             "text": {
                 "type": "plain_text",
-                "text": "📊 Query History"
-            }
-        }
+                "text": "🗑️ Clear History"
+            },
+            "style": "danger",
+            "action_id": "clear_history"
+        },
+        BACK_TO_HOME_BUTTON
     ]
+}
+
+DIVIDER = {"type": "divider"}
+
+def history_entry_block(entry):
+    """Section for one history entry, with a button to rerun its query."""
+    timestamp = datetime.fromisoformat(entry['timestamp']).strftime("%m/%d %H:%M")
+    query_preview = entry['query'][:100] + "..." if len(entry['query']) > 100 else entry['query']
+    return {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"*{timestamp}*\n{query_preview}"
+        },
+        "accessory": {
+            "type": "button",
+            "text": {
+                "type": "plain_text",
+                "text": "Rerun"
+            },
+            "value": entry['query'],
+            "action_id": f"rerun_query_{entry['id']}"
+        }
+    }
+
+def build_history_tab(user_id):
+    """Build the history tab view."""
+    history = get_user_history(user_id)
+    
+    blocks = [HISTORY_HEADER]
     
     if not history:
-        blocks.extend([
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": "No queries yet! Start a conversation to see your history here."
-                }
-            },
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "🏠 Back to Home"
-                        },
-                        "action_id": "back_to_home"
-                    }
-                ]
-            }
-        ])
+        blocks.extend(EMPTY_HISTORY_BLOCKS)
     else:
-        # Show recent queries (last 10)
-        recent_history = history[-10:]
-        
-        for i, entry in enumerate(reversed(recent_history)):
-            timestamp = datetime.fromisoformat(entry['timestamp']).strftime("%m/%d %H:%M")
-            query_preview = entry['query'][:100] + "..." if len(entry['query']) > 100 else entry['query']
-            
-            blocks.extend([
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*{timestamp}*\n{query_preview}"
-                    },
-                    "accessory": {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Rerun"
-                        },
-                        "value": entry['query'],
-                        "action_id": f"rerun_query_{len(recent_history)-i-1}"
-                    }
-                }
-            ])
-            
-            if i < len(recent_history) - 1:
-                blocks.append({"type": "divider"})
-        
-        blocks.extend([
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "🗑️ Clear History"
-                        },
-                        "style": "danger",
-                        "action_id": "clear_history"
-                    },
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "🏠 Back to Home"
-                        },
-                        "action_id": "back_to_home"
-                    }
-                ]
-            }
-        ])
+        # Show recent queries (last 10, newest first), separated by dividers
+        for i, entry in enumerate(history):
+            if i:
+                blocks.append(DIVIDER)
+            blocks.append(history_entry_block(entry))
+        blocks.append(HISTORY_ACTIONS)
     
     return {"type": "home", "blocks": blocks}
 
 @app.event("app_home_opened")
 def update_home_tab(client, event, logger):
     """Handle app home tab opening."""
-    try:
-        client.views_publish(
-            user_id=event["user"],
-            view=build_home_tab()
-        )
-    except Exception as e:
-        logger.error(f"Error publishing App Home: {e}")
+    # Also fired when the Messages tab is opened, which has no view to publish
+    if event.get("tab", "home") == "home":
+        HOME_VIEWS.publish(client, event["user"], HOME_VIEW)
 
 @app.action("start_chat")
 def handle_start_chat(ack, body, client):
@@ -261,15 +295,15 @@ def handle_start_chat(ack, body, client):
     
     try:
         # Open a DM with the user
-        dm_response = client.conversations_open(users=user_id)
+        dm_response = slack_gateway.call(client, "conversations_open", users=user_id)
         channel_id = dm_response["channel"]["id"]
         
-        client.chat_postMessage(
+        slack_gateway.call(client, "chat_postMessage",
             channel=channel_id,
             text="Hi there! 👋 I'm ready to help you with your data questions. What would you like to know?"
         )
     except Exception as e:
-        print(f"Error starting chat: {e}")
+        logger.error("Error starting chat: %s", e)
 
 @app.action("view_history")
 def handle_view_history(ack, body, client):
@@ -277,13 +311,7 @@ def handle_view_history(ack, body, client):
     ack()
     user_id = body["user"]["id"]
     
-    try:
-        client.views_publish(
-            user_id=user_id,
-            view=build_history_tab(user_id)
-        )
-    except Exception as e:
-        print(f"Error viewing history: {e}")
+    HOME_VIEWS.publish(client, user_id, build_history_tab(user_id))
 
 @app.action("back_to_home")
 def handle_back_to_home(ack, body, client):
@@ -291,13 +319,7 @@ def handle_back_to_home(ack, body, client):
     ack()
     user_id = body["user"]["id"]
     
-    try:
-        client.views_publish(
-            user_id=user_id,
-            view=build_home_tab()
-        )
-    except Exception as e:
-        print(f"Error going back to home: {e}")
+    HOME_VIEWS.publish(client, user_id, HOME_VIEW)
 
 @app.action("clear_history")
 def handle_clear_history(ack, body, client):
@@ -305,59 +327,81 @@ def handle_clear_history(ack, body, client):
     ack()
     user_id = body["user"]["id"]
     
-    if user_id in chat_history:
-        del chat_history[user_id]
-    
-    try:
-        client.views_publish(
-            user_id=user_id,
-            view=build_history_tab(user_id)
-        )
-    except Exception as e:
-        print(f"Error clearing history: {e}")
+    HISTORY.clear(user_id)
+    HOME_VIEWS.publish(client, user_id, build_history_tab(user_id))
 
 @app.action(re.compile("rerun_query_.*"))
 def handle_rerun_query(ack, body, client):
-    """Handle rerun query button."""
+    """Handle rerun query button: show the stored result if it is still kept, otherwise ask again."""
     ack()
     user_id = body["user"]["id"]
     query = body["actions"][0]["value"]
+    entry_id = int(body["actions"][0]["action_id"].removeprefix("rerun_query_"))
     
     try:
         # Open a DM and send the query
-        dm_response = client.conversations_open(users=user_id)
+        dm_response = slack_gateway.call(client, "conversations_open", users=user_id)
         channel_id = dm_response["channel"]["id"]
+        say = lambda **kwargs: slack_gateway.call(client, "chat_postMessage", slack_gateway.FINAL, **kwargs)
+
+        entry = HISTORY.get(user_id, entry_id)
+        if entry and entry.get('sql') and RESULTS.info(entry.get('result_handle')):
+            timestamp = datetime.fromisoformat(entry['timestamp']).strftime("%m/%d %H:%M")
+            slack_gateway.call(client, "chat_postEphemeral",
+                channel=channel_id,
+                user=user_id,
+                text=f":floppy_disk: Showing the stored result from {timestamp}. Ask again for fresh numbers."
+            )
+            display_agent_response(channel_id, {'text': entry['summary'], 'sql': entry['sql'], 'result_handle': entry['result_handle']}, say)
+            return
         
         # Process the query as if it was a new message
-        client.chat_postEphemeral(
+        slack_gateway.call(client, "chat_postEphemeral",
             channel=channel_id, 
             user=user_id, 
             text=":snowflake: Re-running your query... Looking up the answer for you."
         )
         
-        response = CORTEX_APP.chat(query)
-        display_agent_response(channel_id, response, lambda **kwargs: client.chat_postMessage(**kwargs))
+        deadline = IN_FLIGHT.start(user_id)
+        try:
+            response = CORTEX_APP.chat(query, CONN, deadline=deadline, requester=(user_id, channel_id))
+            display_agent_response(channel_id, response, say)
+        finally:
+            IN_FLIGHT.finish(user_id, deadline)
         
         # Add to history
         add_to_history(user_id, query, response)
         
     except Exception as e:
-        print(f"Error rerunning query: {e}")
+        logger.error("Error rerunning query: %s", e)
 
 @app.event("message")
-def handle_message_events(ack, body, say, client):
+def handle_message_events(ack, body, client):
     """Handle incoming messages."""
     ack()
+    # Answers and errors go through the Slack gateway ahead of lower-priority calls
+    say = lambda **kwargs: slack_gateway.call(client, "chat_postMessage", slack_gateway.FINAL, **kwargs)
     if 'bot_id' in body['event']:
         return
+    if idempotency.is_retry(SEEN_EVENTS, body):
+        logger.info("Dropping redelivered event %s", body.get('event_id'))
+        return
     
     user_id = body['event']['user']
     channel_id = body['event']['channel']
     prompt = body['event']['text']
     
-    print(f"\n--- Received DM: '{prompt}' from User: {user_id} ---")
+    logger.info("Received DM: %s from User: %s", payload(prompt), user_id)
     
     try:
+        # A question matching a scheduled report is answered from its last run
+        report = REPORTS.ask(prompt)
+        if report is not None:
+            response = display_report(channel_id, report, say)
+            TELEMETRY.record_answer(response, prompt, user_id=user_id, channel_id=channel_id)
+            add_to_history(user_id, prompt, response)
+            return
+
         # Show thinking message with rotating messages
         thinking_messages = [
             ":snowflake: Thinking... I'm analyzing your question.",
@@ -368,23 +412,32 @@ def handle_message_events(ack, body, say, client):
         import random
         thinking_msg = random.choice(thinking_messages)
         
-        client.chat_postEphemeral(channel=channel_id, user=user_id, text=thinking_msg)
-        print("--- Posted ephemeral 'thinking' message ---")
-        
-        print("--- Calling Cortex Agent... ---")
-        response = CORTEX_APP.chat(prompt)
-        print(f"--- Cortex Agent Response: {response} ---")
+        slack_gateway.call(client, "chat_postEphemeral", channel=channel_id, user=user_id, text=thinking_msg)
+        logger.debug("Posted ephemeral 'thinking' message")
         
-        display_agent_response(channel_id, response, say)
+        logger.debug("Calling Cortex Agent...")
+        started = time.perf_counter()
+        # Starting a new question cancels this user's previous one, if it is still running
+        deadline = IN_FLIGHT.start(user_id)
+        try:
+            response = CORTEX_APP.chat(prompt, CONN, deadline=deadline, requester=(user_id, channel_id))
+            TELEMETRY.record_answer(response, prompt, {"answer": time.perf_counter() - started},
+                                    user_id=user_id, channel_id=channel_id)
+            logger.debug("Cortex Agent Response: %s", payload(response))
+
+            display_agent_response(channel_id, response, say, exports.requested_format(prompt))
+        finally:
+            IN_FLIGHT.finish(user_id, deadline)
         
         # Add to user's history
         add_to_history(user_id, prompt, response)
         
-        print("--- Successfully displayed agent response in Slack ---")
+        logger.debug("Successfully displayed agent response in Slack")
         
     except Exception as e:
         error_info = f"{type(e).__name__} at line {e.__traceback__.tb_lineno} of {__file__}: {e}"
-        print(f"--- ERROR in handle_message_events: {error_info} ---")
+        logger.error("ERROR in handle_message_events: %s", error_info)
+        TELEMETRY.record("answer", question=prompt, outcome="error", error=error_info, user_id=user_id, channel_id=channel_id)
         say(channel=channel_id, text=f"I encountered an error processing your request: {error_info}")
 
 @app.action(re.compile("feedback_(helpful|not_helpful)"))
@@ -395,11 +448,13 @@ def handle_feedback(ack, body, client, logger):
     action_id = body['actions'][0]['action_id'] 
     
     feedback_type = "helpful" if "helpful" in action_id else "not helpful"
-    print(f"--- Received feedback from User {user}: '{feedback_type}' ---")
+    logger.info("Received feedback from User %s: '%s'", user, feedback_type)
+    TELEMETRY.record("feedback", user_id=user, channel_id=body['channel']['id'],
+                     message_ts=body.get('message', {}).get('ts'), feedback=action_id.removeprefix("feedback_"))
     
     # Update the message to show feedback was received
     try:
-        client.chat_postMessage(
+        slack_gateway.call(client, "chat_postMessage",
             channel=body['channel']['id'],
             text=f"✅ Thank you for your feedback! Your input helps me improve.",
             thread_ts=body.get('message', {}).get('ts')
@@ -413,9 +468,14 @@ def handle_excel_download(ack, body, client):
     ack()
     
     try:
-        # Get the SQL query from the button value
-        sql_query = body['actions'][0]['value']
-        df = pd.read_sql(sql_query, CONN)
+        # The button carries the result's handle; the stored result is reused instead of re-running the query
+        df = RESULTS.frame(body['actions'][0]['value'])
+        if df is None:
+            slack_gateway.call(client, "chat_postMessage",
+                channel=body['channel']['id'],
+                text="⌛ That result is no longer stored. Please ask the question again to export it."
+            )
+            return
         
         # Create Excel file in memory
         excel_buffer = io.BytesIO()
@@ -439,7 +499,7 @@ def handle_excel_download(ack, body, client):
         excel_buffer.seek(0)
         
         # Upload to Slack
-        client.files_upload_v2(
+        slack_gateway.call(client, "files_upload_v2",
             channel=body['channel']['id'],
             file=excel_buffer.read(),
             filename=f"data_export_{int(time.time())}.xlsx",
@@ -448,70 +508,82 @@ def handle_excel_download(ack, body, client):
         )
         
     except Exception as e:
-        print(f"Error creating Excel file: {e}")
-        client.chat_postMessage(
+        logger.error("Error creating Excel file: %s", e)
+        slack_gateway.call(client, "chat_postMessage",
             channel=body['channel']['id'],
             text="❌ Sorry, I couldn't generate the Excel file. Please try again."
         )
 
-def display_agent_response(channel_id, content, say):
+@app.action(re.compile("export_(csv|csv_gz|csv_zst|parquet)"))
+def handle_export(ack, body, client):
+    """Handle CSV / compressed CSV / Parquet export buttons."""
+    ack()
+    table = RESULTS.get(body['actions'][0]['value'])
+    if table is None:
+        slack_gateway.call(client, "chat_postMessage",
+            channel=body['channel']['id'],
+            text="⌛ That result is no longer stored. Please ask the question again to export it."
+        )
+        return
+    try:
+        exports.send(client, table, exports.format_for_action(body['actions'][0]['action_id']), body['channel']['id'],
+                     sink=TELEMETRY, user_id=body['user']['id'])
+    except Exception as e:
+        logger.error("Error creating export: %s", e)
+        slack_gateway.call(client, "chat_postMessage",
+            channel=body['channel']['id'],
+            text="❌ Sorry, I couldn't generate the export. Please try again."
+        )
+
+def response_blocks(content, df=None):
     """
-    Enhanced display function with improved visuals and Excel export.
+    Enhanced answer blocks with improved visuals and Excel export; df is the loaded result of a SQL answer.
+    Returns the notification text and the blocks.
     """
     blocks = []
     fallback_text = "Here is the response from your Data Intelligence Assistant."
     
-    if not content:
-        print("--- WARNING: display_agent_response received empty content. ---")
-        say(channel=channel_id, text="I'm sorry, I couldn't generate a response.")
-        return
-
-    print(content)
-    
     # Handle SQL responses
-    if content.get('sql'):
-        sql = content['sql']
-        df = pd.read_sql(sql, CONN)
-        
-        # Format the data display
-        if len(df) > 10:
-            preview_df = df.head(10)
-            data_preview = f"*Answer (showing first 10 of {len(df)} rows):*\n```{preview_df.to_string(index=False)}```\n_... and {len(df) - 10} more rows_"
-        else:
-            data_preview = f"*Answer:*\n```{df.to_string(index=False)}```"
+    if df is not None:
+        # Format the data display: only the first rows that fit are formatted
+        preview = table_render.render_table(df, title="*Answer:*", max_rows=CORTEX_APP.shedder.preview_rows(10))
+        blocks.extend(preview.blocks)
+        if preview.overflow:
+            blocks.append({
+                "type": "context",
+                "elements": [{"type": "mrkdwn", "text": f"_{preview.note}_"}]
+            })
         
-        fallback_text = f"Query Result: {df.to_string()}"
+        # Notification text only; the formatted preview lives in the blocks
+        fallback_text = f"Query Result: {len(df)} rows"
         
-        blocks.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": data_preview
-            }
-        })
-        
-        # Add Excel download button for SQL results
-        blocks.append({
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "📊 *Export Options*"
-            },
-            "accessory": {
-                "type": "button",
+        # The export buttons need the stored result
+        if content.get('result_handle'):
+            # Add Excel download button for SQL results
+            blocks.append({
+                "type": "section",
                 "text": {
-                    "type": "plain_text",
-                    "text": "📥 Download Excel"
+                    "type": "mrkdwn",
+                    "text": "📊 *Export Options*"
                 },
-                "style": "primary",
-                "value": sql,
-                "action_id": "download_excel"
-            }
-        })
+                "accessory": {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "📥 Download Excel"
+                    },
+                    "style": "primary",
+                    "value": content['result_handle'],
+                    "action_id": "download_excel"
+                }
+            })
+            # Compressed CSV and Parquet, for loading into notebooks
+            blocks.append(exports.export_actions(content['result_handle']))
         
     # Handle text-only responses
     else:
-        answer_text = content.get('text', 'No text content found.')
+        # Errors (e.g. a refusal under load) have no text; show the message itself
+        answer_text = content.get('text') or content.get('error') or 'No text content found.'
         fallback_text = f"Answer: {answer_text}"
         blocks.append({
             "type": "section",
@@ -558,24 +630,143 @@ def display_agent_response(channel_id, content, say):
         }
     ])
     
+    return fallback_text, blocks
+
+def upload_charts(channel_id, chart_files):
+    for chart_file in chart_files:
+        if chart_file:
+            try:
+                slack_gateway.call(app.client, "files_upload_v2",
+                    channel=channel_id,
+                    file=chart_file['path'],
+                    title=chart_file['title'],
+                    initial_comment=chart_file['comment'],
+                )
+                logger.debug("Uploaded %s to channel %s", chart_file['title'], channel_id)
+            finally:
+                os.remove(chart_file['path'])
+
+def discard_charts(chart_files):
+    """Removes the PNGs of charts that timed out or were never uploaded"""
+    for chart_file in chart_files or ():
+        if chart_file and os.path.exists(chart_file['path']):
+            os.remove(chart_file['path'])
+
+def confirm_actions(token):
+    """Run anyway / Don't run buttons for a query the SQL cost guard is holding"""
+    return {"type": "actions", "elements": [
+        {"type": "button", "text": {"type": "plain_text", "text": "Run anyway"}, "style": "primary", "action_id": "sql_guard_confirm", "value": token},
+        {"type": "button", "text": {"type": "plain_text", "text": "Don't run"}, "action_id": "sql_guard_dismiss", "value": token}
+    ]}
+
+@app.action("sql_guard_confirm")
+def handle_sql_guard_confirm(ack, body, client):
+    """Runs a query the SQL cost guard held, once the user who asked approves it"""
+    ack()
+    user_id, channel_id = body['user']['id'], body['channel']['id']
+    say = lambda **kwargs: slack_gateway.call(client, "chat_postMessage", slack_gateway.FINAL, **kwargs)
+    deadline = IN_FLIGHT.start(user_id)
+    try:
+        response = CORTEX_APP.confirm(body['actions'][0]['value'], CONN, deadline=deadline, user_id=user_id)
+        display_agent_response(channel_id, response, say)
+    except Exception as e:
+        logger.error("Error running confirmed query: %s", e)
+        say(channel=channel_id, text=f"I encountered an error running the query: {e}")
+    finally:
+        IN_FLIGHT.finish(user_id, deadline)
+
+@app.action("sql_guard_dismiss")
+def handle_sql_guard_dismiss(ack, body, client):
+    """Drops a query the SQL cost guard held"""
+    ack()
+    if CORTEX_APP.confirmations.pop(body['actions'][0]['value'], body['user']['id']) is None:
+        return
+    slack_gateway.call(client, "chat_update", channel=body['channel']['id'], ts=body['message']['ts'], text="Query not run.",
+                       blocks=[{"type": "section", "text": {"type": "mrkdwn", "text": ":no_entry_sign: *Query not run.* Try a narrower question."}}])
+
+def display_agent_response(channel_id, content, say, export_format=None):
+    """
+    Posts an answer. For SQL answers the message, the charts and any requested export are pipeline
+    stages that run side by side once the result is loaded, each posted as soon as it is ready.
+    """
+    if not content:
+        logger.warning("display_agent_response received empty content.")
+        say(channel=channel_id, text="I'm sorry, I couldn't generate a response.")
+        return
+
+    logger.debug("Displaying agent response: %s", payload(content))
+
+    if content.get('confirm'):
+        # The cost guard is holding the query until the asker approves it
+        say(channel=channel_id, text=content['text'], blocks=[
+            {"type": "section", "text": {"type": "mrkdwn", "text": content['text']}},
+            {"type": "section", "text": {"type": "mrkdwn", "text": f"*SQL:*\n```{content['sql']}```"}},
+            confirm_actions(content['confirm']),
+        ])
+        return
+
+    # Errors carry the failed SQL; it must not be run again to load a result
+    if content.get('error') or not content.get('sql'):
+        fallback_text, blocks = response_blocks(content)
+        say(channel=channel_id, text=fallback_text, blocks=blocks)
+        return
+
+    def post_message(inputs):
+        fallback_text, blocks = response_blocks(content, inputs["load"])
+        if inputs["load"] is None:
+            blocks.insert(1, {"type": "context", "elements": [{"type": "mrkdwn", "text": "_The query result is unavailable; ask again to re-run it._"}]})
+        say(channel=channel_id, text=fallback_text, blocks=blocks)
+
+    def render_charts(inputs):
+        # Enhanced chart generation for SQL results
+        df = inputs["load"]
+        if df is None or not (len(df.columns) >= 2 and len(df) > 0) or CORTEX_APP.shedder.sheds(load_shedding.NO_CHARTS, "chart"):
+            return []
+        return create_enhanced_charts(df)
+
+    def send_export(inputs):
+        # "... as parquet", "gzip" etc. in the question: attach the result in that format
+        if export_format and inputs["load"] is not None:
+            table = RESULTS.get(content['result_handle'])
+            if table is None:
+                table = exports.to_table(inputs["load"])
+            exports.send(app.client, table, export_format, channel_id, sink=TELEMETRY)
+
+    results = (pipeline.Pipeline("display")
+               .add("load", lambda _: load_result(content))
+               .add("message", post_message, after=("load",))
+               .add("charts", render_charts, after=("load",), timeout=CHART_TIMEOUT, cleanup=discard_charts)
+               .add("chart_upload", lambda inputs: upload_charts(channel_id, inputs["charts"]), after=("charts",))
+               .add("export", send_export, after=("load",))
+               .run())
+    # The answer itself must get out; charts and exports are best effort
+    for stage in ("load", "message"):
+        if results[stage].error is not None:
+            raise results[stage].error
+
+def display_report(channel_id, report, say):
+    """Posts a stored report: its summary with the computed-at time, table preview, exports and chart."""
+    content = {'text': report.text(), 'sql': report.sql, 'result_handle': report.result_handle, 'report': report.computed_at}
+    fallback_text, blocks = response_blocks(content)
+    extra = list(report.preview)
+    if report.note:
+        extra.append({"type": "context", "elements": [{"type": "mrkdwn", "text": f"_{report.note}_"}]})
+    # Exports need the result itself, which may have been evicted since the report ran
+    if report.result_handle and RESULTS.info(report.result_handle):
+        extra.append(exports.export_actions(report.result_handle))
+    blocks[1:1] = extra
     say(channel=channel_id, text=fallback_text, blocks=blocks)
+    if report.chart:
+        slack_gateway.call(app.client, "files_upload_v2", channel=channel_id, content=report.chart, filename="chart.png",
+                           title="Data Chart", initial_comment="Here is a visual representation:")
+    return content
 
-    # Enhanced chart generation for SQL results
-    if content.get('sql'):
-        df = pd.read_sql(content['sql'], CONN)
-        if len(df.columns) >= 2 and len(df) > 0:
-            chart_files = create_enhanced_charts(df)
-            
-            for chart_file in chart_files:
-                if chart_file:
-                    app.client.files_upload_v2(
-                        channel=channel_id,
-                        file=chart_file['path'],
-                        title=chart_file['title'],
-                        initial_comment=chart_file['comment'],
-                    )
-                    print(f"--- Uploaded {chart_file['title']} to channel {channel_id} ---")
-                    os.remove(chart_file['path'])
+def report_chart(df):
+    """First enhanced chart for a scheduled report; the others are discarded."""
+    charts = create_enhanced_charts(df)
+    for chart in charts[1:]:
+        os.remove(chart['path'])
+    return charts[0]['path'] if charts else None
 
 def create_enhanced_charts(df):
     """Create multiple enhanced chart types based on data characteristics."""
@@ -720,7 +911,7 @@ def create_enhanced_charts(df):
                 })
     
     except Exception as e:
-        print(f"--- ERROR creating enhanced charts: {e} ---")
+        logger.error("ERROR creating enhanced charts: %s", e)
         
         # Fallback to simple chart
         try:
@@ -744,40 +935,58 @@ def create_enhanced_charts(df):
                     'comment': '📊 Your data visualization'
                 })
         except Exception as fallback_error:
-            print(f"--- ERROR in fallback chart creation: {fallback_error} ---")
+            logger.error("ERROR in fallback chart creation: %s", fallback_error)
     
     return charts
 
+def record_guard_decision(decision, sql):
+    """Keeps every SQL cost guard decision in telemetry, for tuning the budgets"""
+    estimate = decision.estimate
+    TELEMETRY.record("sql_guard", sql_text=sql, outcome=decision.action, error=decision.reason,
+                     estimated_bytes=estimate.bytes_assigned if estimate else None,
+                     estimated_partitions=estimate.partitions_assigned if estimate else None)
+
 def init():
-    """Initialize connections - unchanged from original."""
-    print(f">>>>>>>>>> Connecting with ROLE: {ROLE} and USER: {USER}")
-    print(">>>>>>>>>> Manually decrypting private key for database connection...")
+    """Initialize the Snowflake connection and the CortexChat client."""
+    logger.info("Connecting with ROLE: %s and USER: %s", ROLE, USER)
+    logger.info("Manually decrypting private key for database connection...")
     with open(RSA_PRIVATE_KEY_PATH, "rb") as pem_in:
         pemlines = pem_in.read()
     private_key_obj = load_pem_private_key(pemlines, password=RSA_PRIVATE_KEY_PASSWORD.encode(), backend=default_backend())
-    print(">>>>>>>>>> Private key decrypted successfully.")
-    print(">>>>>>>>>> Connecting to Snowflake database using private key object...")
+    logger.info("Private key decrypted successfully.")
+    logger.info("Connecting to Snowflake database using private key object...")
     conn = snowflake.connector.connect(user=USER, account=ACCOUNT, private_key=private_key_obj, warehouse=WAREHOUSE, role=ROLE, host=HOST, database=DATABASE, schema=SCHEMA)
     if conn:
-        print(">>>>>>>>>> Snowflake database connection successful!")
+        logger.info("Snowflake database connection successful!")
     else:
-        print(">>>>>>>>>> Snowflake database connection FAILED!"); exit()
+        logger.critical("Snowflake database connection FAILED!"); exit()
     
-    # Simplified initialization without search service
+    # Same tools as app.py: Cortex Analyst over the semantic model, plus Cortex Search when configured
+    tools_config = [{"tool_spec": {"type": "cortex_analyst_text_to_sql", "name": "semantic_model_tool"}}]
+    tool_resources_config = {"semantic_model_tool": {"semantic_model_file": SEMANTIC_MODEL}}
+    if cortex_search.CORTEX_SEARCH_SERVICE:
+        search_tool, search_resources = cortex_search.search_tool()
+        tools_config.append(search_tool)
+        tool_resources_config.update(search_resources)
     cortex_app = cortex_chat.CortexChat(
         agent_url=AGENT_ENDPOINT, 
-        semantic_model=SEMANTIC_MODEL, 
         model=MODEL, 
         account=ACCOUNT, 
         user=USER, 
         private_key_path=RSA_PRIVATE_KEY_PATH, 
-        private_key_password=RSA_PRIVATE_KEY_PASSWORD
+        private_key_password=RSA_PRIVATE_KEY_PASSWORD,
+        tools=tools_config,
+        tool_resources=tool_resources_config,
+        scheduler=admission.get_scheduler(WAREHOUSE),
+        guard=sql_guard.SqlGuard(recorder=record_guard_decision)
     )
-    print(">>>>>>>>>> Init complete")
+    logger.info("Init complete")
     return conn, cortex_app
 
 if __name__ == "__main__":
+    log_setup.configure_logging()
     CONN, CORTEX_APP = init()
+    reports.ReportScheduler(lambda question: CORTEX_APP.chat(question, CONN), render_chart=report_chart).start()
     handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-    print("🚀 Enhanced Slack Data Intelligence Assistant is running!")
+    logger.info("🚀 Enhanced Slack Data Intelligence Assistant is running!")
     handler.start()
\ No newline at end of file
@@ -1,7 +1,10 @@
 # Standard library imports
+import math
 import os
 import re
+import threading
 import time
+import logging
 import traceback
 import pandas as pd
 import snowflake.connector
@@ -14,6 +17,25 @@ from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.backends import default_backend
 # Import custom module for Cortex Chat functionality
 import cortex_chat
+import cortex_search
+import admission
+import exports
+from deadline import InFlightRegistry
+from shared_state import shared_backend
+import idempotency
+import load_shedding
+import log_setup
+import metrics
+import pipeline
+import profiler
+import reports
+import result_store
+import slack_gateway
+import sql_guard
+import table_render
+import telemetry
+import tracing
+import view_publisher
 
 # Set matplotlib backend to non-GUI mode for server environments
 matplotlib.use('Agg')
@@ -24,133 +46,325 @@ load_dotenv(override=True)
 # Extract configuration from environment variables
 ACCOUNT, HOST, USER, DATABASE, SCHEMA, ROLE, WAREHOUSE = (os.getenv(k) for k in ["ACCOUNT", "HOST", "USER", "DATABASE", "SCHEMA", "ROLE", "WAREHOUSE"])
 SLACK_APP_TOKEN, SLACK_BOT_TOKEN = os.getenv("SLACK_APP_TOKEN"), os.getenv("SLACK_BOT_TOKEN")
+# Only used by the HTTP entry point (http_app.py) to verify that requests come from Slack
+SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET")
+# Longest a chart may take to render before the answer goes out without it
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "30"))
 AGENT_ENDPOINT, SEMANTIC_MODEL, RSA_PRIVATE_KEY_PATH, RSA_PRIVATE_KEY_PASSWORD, MODEL = (os.getenv(k) for k in ["AGENT_ENDPOINT", "SEMANTIC_MODEL", "RSA_PRIVATE_KEY_PATH", "RSA_PRIVATE_KEY_PASSWORD", "MODEL"])
 
 # Initialize the Slack app
-app = App(token=SLACK_BOT_TOKEN)
+app = App(token=SLACK_BOT_TOKEN, signing_secret=SLACK_SIGNING_SECRET)
+logger = logging.getLogger(__name__)
+# Set by init() in __main__, or by workers.py / http_app.py in their processes
+CONN = CORTEX_APP = None
+
+# Answers, timings and feedback, bulk-loaded in the background (TELEMETRY_BACKEND)
+TELEMETRY = telemetry.open_sink(lambda: CONN)
+
+# Event IDs already accepted, so Slack's redeliveries are dropped before any work starts
+SEEN_EVENTS = idempotency.SeenEvents()
+
+# One in-flight question per user: a new message or the Cancel button aborts the previous one, on any worker
+# when SHARED_STATE_URL is set
+IN_FLIGHT = InFlightRegistry(backend=shared_backend())
+CANCEL_ACTIONS = {"type": "actions", "elements": [
+    {"type": "button", "text": {"type": "plain_text", "text": "Cancel"}, "style": "danger", "action_id": "cancel_question"}
+]}
+# Attribution and feedback buttons under every final answer
+ANSWER_FOOTER = [
+    {"type": "context", "elements": [{"type": "mrkdwn", "text": "This content was generated by an AI assistant. Please review carefully."}]},
+    {"type": "actions", "elements": [
+        {"type": "button", "text": {"type": "plain_text", "text": "👍"}, "action_id": "feedback_helpful"}, 
+        {"type": "button", "text": {"type": "plain_text", "text": "👎"}, "action_id": "feedback_not_helpful"}
+    ]}
+]
+
+# Saved and popular questions, answered off-peak and served from their last run
+REPORTS = reports.get_report_store()
+
+def confirm_actions(token):
+    """Run anyway / Don't run buttons for a query the SQL cost guard is holding"""
+    return {"type": "actions", "elements": [
+        {"type": "button", "text": {"type": "plain_text", "text": "Run anyway"}, "style": "primary", "action_id": "sql_guard_confirm", "value": token},
+        {"type": "button", "text": {"type": "plain_text", "text": "Don't run"}, "action_id": "sql_guard_dismiss", "value": token}
+    ]}
+
+def slack_call(client, method, priority=slack_gateway.INTERACTIVE, **kwargs):
+    """Calls a Slack Web API method through the rate-limit gateway; progress updates may be dropped (None)."""
+    return slack_gateway.call(client, method, priority, **kwargs)
 
 @app.event("message")
-def handle_message_events(body, say, client):
+def handle_message_events(body, client):
     """
     Processes incoming Slack messages and generates responses using Cortex agent.
     Handles special cases, formats responses, and displays data visualizations.
     """
     # Ignore messages from bots to prevent infinite loops
     if 'bot_id' in body['event']: return
-    
+    # Slack redelivers events that take a while to handle; answer each one only once
+    if idempotency.is_retry(SEEN_EVENTS, body): return
+
+    # Tag every span produced while answering this event with its event_id
+    with tracing.correlation(body.get('event_id')), tracing.collect_timings() as timings:
+        with tracing.span("answer"):
+            answered = _answer_message(body, client)
+        if answered is not None:
+            result, message_ts = answered
+            TELEMETRY.record_answer(result, body['event']['text'], timings, user_id=body['event']['user'],
+                                    channel_id=body['event']['channel'], message_ts=message_ts)
+
+def make_update_callback(client, channel_id, thread_ts, message_ts, deadline, export_format=None):
+    """
+    Builds the callback that keeps the answer message at message_ts up to date as processing happens.
+    export_format, when the question asked for one, is uploaded with the answer whatever the result's size.
+    """
+    artifacts = None
+
+    def start_artifacts(df, result_handle):
+        """
+        Preview, export and chart stages for a result. They start as soon as the rows arrive, so they run
+        alongside the agent's summary call, and each upload is posted when it is ready.
+        """
+        def render_preview(_):
+            # Fewer rows under heavy load; the rest goes out with the export as usual
+            return table_render.render_table(df, title="*Data:*", max_rows=CORTEX_APP.shedder.preview_rows(table_render.TABLE_MAX_ROWS))
+
+        def write_export(inputs):
+            # Attach the complete result when it didn't fit, or in the format the question asked for
+            if not (inputs["preview"].overflow or export_format):
+                return None
+            table = result_store.get_result_store().get(result_handle)
+            if table is None:
+                table = exports.to_table(df)
+            return exports.write_export(table, export_format or exports.EXPORT_DEFAULT_FORMAT)
+
+        def upload_export(inputs):
+            if inputs["export"] is not None:
+                exports.upload(client, inputs["export"], channel_id, thread_ts, sink=TELEMETRY, message_ts=message_ts)
+
+        def render_chart(inputs):
+            if not (inputs["preview"].overflow and len(df.columns) > 1):
+                return None
+            return None if CORTEX_APP.shedder.sheds(load_shedding.NO_CHARTS, "chart") else plot_chart(df)
+
+        def upload_chart(inputs):
+            chart_file = inputs["chart"]
+            if chart_file:
+                try:
+                    slack_call(client, "files_upload_v2",
+                        channel=channel_id,
+                        thread_ts=thread_ts,
+                        file=chart_file,
+                        title="Data Chart",
+                        initial_comment="Here is a visual representation:"
+                    )
+                finally:
+                    os.remove(chart_file)
+
+        def discard_chart(chart_file):
+            # A chart that timed out or wasn't uploaded still left its PNG behind
+            if chart_file:
+                os.remove(chart_file)
+
+        return (pipeline.Pipeline("artifacts")
+                .add("preview", render_preview)
+                .add("export", write_export, after=("preview",))
+                .add("export_upload", upload_export, after=("export",))
+                .add("chart", render_chart, after=("preview",), timeout=CHART_TIMEOUT, cleanup=discard_chart)
+                .add("chart_upload", upload_chart, after=("chart",))
+                .start(deadline))
+
+    def update_message_callback(text=None, is_final=False, df=None, sql=None, error=None, confirm=None, result_handle=None):
+        """
+        Updates the Slack message with progress, results, or errors.
+        Large datasets and charts are uploaded by the artifacts pipeline.
+        """
+        nonlocal artifacts
+        blocks = []
+
+        if df is not None and not df.empty and artifacts is None and not error:
+            artifacts = start_artifacts(df, result_handle)
+        
+        if error:
+            # Error handling - show error details and SQL if available
+            blocks = [
+                {"type": "section", "text": {"type": "mrkdwn", "text": f":x: *I encountered an error.*"}},
+            ]
+            if sql:
+                blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": f"*Attempted SQL:*\n```{sql}```"}})
+            blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": f"*Error Details:*\n`{error}`"}})
+        else:
+            # Normal response flow
+            if text:
+                message_text = "*Answer:*\n" + text
+                blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": message_text}})
+            
+            if is_final:
+                # For final updates, include data if available
+                preview = artifacts.result("preview", deadline.remaining()) if artifacts is not None else None
+                if preview is not None and preview.ok:
+                    # Only the rows that fit in the message; the rest goes out as a file
+                    blocks.extend(preview.value.blocks)
+                    if preview.value.overflow:
+                        blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": f"{preview.value.note}. The complete data set is being attached as a file."}]})
+                    if result_handle:
+                        blocks.append(exports.export_actions(result_handle))
+                
+                if confirm:
+                    # The cost guard is holding the query until the asker approves it
+                    blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": f"*SQL:*\n```{sql}```"}})
+                    blocks.append(confirm_actions(confirm))
+                else:
+                    # Add attribution and feedback buttons on final message
+                    blocks.extend(ANSWER_FOOTER)
+            else:
+                blocks.append(CANCEL_ACTIONS)
+        
+        # Update the message; final answers and errors jump the queue, progress updates give way
+        slack_call(client, "chat_update", slack_gateway.FINAL if is_final or error else slack_gateway.PROGRESS,
+            channel=channel_id,
+            ts=message_ts,
+            text=text if text else "Processing your request...",
+            blocks=blocks
+        )
+
+        # The answer is done once its uploads are; they have been running since the rows arrived
+        if (is_final or error) and artifacts is not None:
+            artifacts.wait(deadline.remaining())
+    return update_message_callback
+
+def _answer_message(body, client):
+    """
+    Answers a single user message; split out so the whole answer runs under one correlation ID.
+    Returns the chat result and the answer message's ts, or None if the message needed no answer.
+    """
     # Extract key information from the message event
     user_id, channel_id, prompt = body['event']['user'], body['event']['channel'], body['event']['text']
+    # Replies inside a thread continue that thread's conversation; a top-level message starts a new one
+    thread_ts = body['event'].get('thread_ts')
+    thread_key = (channel_id, thread_ts or body['event'].get('ts'))
     
     # Special case handling for a specific question
     if prompt.lower() == "whoose your daddy":
-        say(channel=channel_id, text="Dylan Plut")
-        return
-        
+        slack_call(client, "chat_postMessage", slack_gateway.FINAL, channel=channel_id, text="Dylan Plut")
+        return None
+
+    # A new question matching a scheduled report is answered from its last run
+    if thread_ts is None:
+        report = REPORTS.ask(prompt)
+        if report is not None:
+            return post_report(client, channel_id, report)
+
+    # Starting a new question cancels this user's previous one, if it is still running
+    deadline = IN_FLIGHT.start(user_id)
+    result, message_ts = None, None
     try:
         # Post initial "thinking" message and get its timestamp for future updates
-        initial_response = client.chat_postMessage(
+        initial_response = slack_call(client, "chat_postMessage",
             channel=channel_id, 
+            thread_ts=thread_ts,
             text=":snowflake: Thinking...",
             blocks=[{
                 "type": "section", 
                 "text": {"type": "mrkdwn", "text": ":snowflake: *Processing your request...*"}
-            }]
+            }, CANCEL_ACTIONS]
         )
         message_ts = initial_response['ts']
         
-        # Define callback function to update the message as processing happens
-        def update_message_callback(text=None, is_final=False, df=None, sql=None, error=None):
-            """
-            Updates the Slack message with progress, results, or errors.
-            Handles file uploads for large datasets and charts.
-            """
-            blocks = []
-            
-            if error:
-                # Error handling - show error details and SQL if available
-                blocks = [
-                    {"type": "section", "text": {"type": "mrkdwn", "text": f":x: *I encountered an error.*"}},
-                ]
-                if sql:
-                    blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": f"*Attempted SQL:*\n```{sql}```"}})
-                blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": f"*Error Details:*\n`{error}`"}})
-            else:
-                # Normal response flow
-                if text:
-                    message_text = "*Answer:*\n" + text
-                    blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": message_text}})
-                
-                if is_final:
-                    # For final updates, include data if available
-                    if df is not None and not df.empty:
-                        # Handle dataframe rendering
-                        df_string = df.to_string()
-                        if len(df_string) < 2800:
-                            # Display data directly if it's small enough
-                            blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": f"*Data:*\n```{df_string}```"}})
-                        else:
-                            # For large datasets, prepare as a file
-                            blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": "*Data is being prepared as a file (too large to display directly)*"}})
-                    
-                    # Add attribution and feedback buttons on final message
-                    blocks.extend([
-                        {"type": "context", "elements": [{"type": "mrkdwn", "text": "This content was generated by an AI assistant. Please review carefully."}]},
-                        {"type": "actions", "elements": [
-                            {"type": "button", "text": {"type": "plain_text", "text": "👍"}, "action_id": "feedback_helpful"}, 
-                            {"type": "button", "text": {"type": "plain_text", "text": "👎"}, "action_id": "feedback_not_helpful"}
-                        ]}
-                    ])
-            
-            # Update the message
-            client.chat_update(
-                channel=channel_id,
-                ts=message_ts,
-                text=text if text else "Processing your request...",
-                blocks=blocks
-            )
-            
-            # For final update with large data, handle file uploads separately
-            if is_final and df is not None and not df.empty and len(df.to_string()) >= 2800:
-                file_path = f'data_{int(time.time())}.csv'
-                df.to_csv(file_path, index=False)
-                client.files_upload_v2(
-                    channel=channel_id,
-                    file=file_path,
-                    title="Requested Data",
-                    initial_comment="Here is the complete data set:"
-                )
-                os.remove(file_path)
-                
-                # Generate chart if possible
-                if len(df.columns) > 1:
-                    chart_file = plot_chart(df)
-                    if chart_file:
-                        client.files_upload_v2(
-                            channel=channel_id, 
-                            file=chart_file, 
-                            title="Data Chart", 
-                            initial_comment="Here is a visual representation:"
-                        )
-                        os.remove(chart_file)
-        
+        update_message_callback = make_update_callback(client, channel_id, thread_ts, message_ts, deadline,
+                                                       exports.requested_format(prompt))
+
         # Call the chat method with the callback
-        CORTEX_APP.chat(prompt, CONN, update_message_callback)
+        result = CORTEX_APP.chat(prompt, CONN, update_message_callback, deadline=deadline, thread_key=thread_key,
+                                 requester=(user_id, channel_id))
         
     except Exception as e:
         # Detailed error handling with traceback information
         tb = traceback.extract_tb(e.__traceback__)
         last_call = tb[-1]
         error_info = f"{type(e).__name__} in {os.path.basename(last_call.filename)} at line {last_call.lineno}: {e}"
-        print(f"--- FATAL ERROR: {error_info} ---")
+        logger.error("FATAL ERROR: %s", error_info, exc_info=e)
+        result = {"error": error_info}
         try:
-            client.chat_update(
+            slack_call(client, "chat_update", slack_gateway.FINAL,
                 channel=channel_id,
                 ts=message_ts,
                 text="A critical error occurred. Please check the logs.",
                 blocks=[{"type": "section", "text": {"type": "mrkdwn", "text": ":warning: *A critical error occurred. Please check the logs.*"}}]
             )
         except:
-            say(channel=channel_id, text="A critical error occurred. Please check the logs.")
+            slack_call(client, "chat_postMessage", slack_gateway.FINAL, channel=channel_id, text="A critical error occurred. Please check the logs.")
+    finally:
+        IN_FLIGHT.finish(user_id, deadline)
+    return result, message_ts
+
+def post_report(client, channel_id, report):
+    """Posts a stored report as the answer; returns the result for telemetry and the message ts."""
+    text = report.text()
+    blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": "*Answer:*\n" + text}}]
+    blocks.extend(report.preview)
+    # The export buttons need the result itself, which may have been evicted since the report ran
+    exportable = bool(report.result_handle) and result_store.get_result_store().info(report.result_handle) is not None
+    if report.note:
+        note = f"{report.note}. Use the buttons below for the complete data set." if exportable else f"{report.note}."
+        blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": note}]})
+    if exportable:
+        blocks.append(exports.export_actions(report.result_handle))
+    blocks.extend(ANSWER_FOOTER)
+    response = slack_call(client, "chat_postMessage", slack_gateway.FINAL, channel=channel_id, text=text, blocks=blocks)
+    if report.chart:
+        slack_call(client, "files_upload_v2", channel=channel_id, content=report.chart, filename="chart.png",
+                   title="Data Chart", initial_comment="Here is a visual representation:")
+    result = {"text": text, "dataframe": None, "sql": report.sql, "result_handle": report.result_handle, "report": report.computed_at}
+    return result, response['ts']
+
+@app.action("cancel_question")
+def handle_cancel_question(ack, body):
+    """Cancels the clicking user's in-flight question, including its warehouse query"""
+    ack()
+    IN_FLIGHT.cancel(body['user']['id'])
+
+@app.action("sql_guard_confirm")
+def handle_sql_guard_confirm(ack, body, client):
+    """Runs a query the SQL cost guard held, once the user who asked approves it"""
+    ack()
+    user_id, channel_id, message = body['user']['id'], body['channel']['id'], body['message']
+    with tracing.correlation(), tracing.collect_timings() as timings:
+        deadline = IN_FLIGHT.start(user_id)
+        try:
+            callback = make_update_callback(client, channel_id, message.get('thread_ts'), message['ts'], deadline)
+            with tracing.span("answer"):
+                result = CORTEX_APP.confirm(body['actions'][0]['value'], CONN, callback, deadline=deadline, user_id=user_id)
+        finally:
+            IN_FLIGHT.finish(user_id, deadline)
+        TELEMETRY.record_answer(result, None, timings, user_id=user_id, channel_id=channel_id, message_ts=message['ts'])
+
+@app.action("sql_guard_dismiss")
+def handle_sql_guard_dismiss(ack, body, client):
+    """Drops a query the SQL cost guard held"""
+    ack()
+    if CORTEX_APP.confirmations.pop(body['actions'][0]['value'], body['user']['id']) is None:
+        return
+    slack_call(client, "chat_update", channel=body['channel']['id'], ts=body['message']['ts'], text="Query not run.",
+               blocks=[{"type": "section", "text": {"type": "mrkdwn", "text": ":no_entry_sign: *Query not run.* Try a narrower question."}}])
+
+@app.action(re.compile("export_(csv|csv_gz|csv_zst|parquet)"))
+def handle_export(ack, body, client):
+    """Uploads a stored result in the format of the clicked export button"""
+    ack()
+    action, channel_id, message = body['actions'][0], body['channel']['id'], body['message']
+    table = result_store.get_result_store().get(action['value'])
+    if table is None:
+        slack_call(client, "chat_postEphemeral", channel=channel_id, user=body['user']['id'],
+                   text="That result is no longer stored. Please ask the question again to export it.")
+        return
+    try:
+        exports.send(client, table, exports.format_for_action(action['action_id']), channel_id,
+                     message.get('thread_ts') or message['ts'], sink=TELEMETRY, user_id=body['user']['id'], message_ts=message['ts'])
+    except Exception as e:
+        logger.error("Error creating export: %s", e, exc_info=True)
+        slack_call(client, "chat_postEphemeral", channel=channel_id, user=body['user']['id'],
+                   text="Sorry, I couldn't generate the export. Please try again.")
 
 def plot_chart(df: pd.DataFrame) -> str | None:
     """
@@ -168,7 +382,7 @@ def plot_chart(df: pd.DataFrame) -> str | None:
         
         # If we don't have at least one numeric column, we can't chart
         if not numeric_cols:
-            print("--- No numeric columns available for charting ---")
+            logger.debug("No numeric columns available for charting")
             return None
         
         # Detect date columns or string columns that might contain dates
@@ -184,7 +398,7 @@ def plot_chart(df: pd.DataFrame) -> str | None:
         if len(df.columns) >= 2:
             if potential_date_cols and numeric_cols:
                 # Time series or categorical data - use bar chart
-                print(f"--- Creating bar chart with x={potential_date_cols[0]}, y={numeric_cols[0]} ---")
+                logger.debug("Creating bar chart with x=%s, y=%s", potential_date_cols[0], numeric_cols[0])
                 x_col = potential_date_cols[0]
                 y_col = numeric_cols[0]
                 
@@ -202,7 +416,7 @@ def plot_chart(df: pd.DataFrame) -> str | None:
                 
             elif len(numeric_cols) >= 2:
                 # Multiple numeric columns - scatter plot
-                print(f"--- Creating scatter plot with x={numeric_cols[0]}, y={numeric_cols[1]} ---")
+                logger.debug("Creating scatter plot with x=%s, y=%s", numeric_cols[0], numeric_cols[1])
                 plt.scatter(plot_df[numeric_cols[0]], plot_df[numeric_cols[1]])
                 plt.xlabel(numeric_cols[0])
                 plt.ylabel(numeric_cols[1])
@@ -210,11 +424,11 @@ def plot_chart(df: pd.DataFrame) -> str | None:
                 
             else:
                 # Single numeric column with categories - pie chart
-                print(f"--- Creating pie chart ---")
+                logger.debug("Creating pie chart")
                 # Filter out non-numeric values in the numeric column
                 valid_data = plot_df[~plot_df[numeric_cols[0]].isna()]
                 if len(valid_data) < 2:
-                    print("--- Not enough valid data points for a pie chart ---")
+                    logger.debug("Not enough valid data points for a pie chart")
                     return None
                     
                 # Use the first non-numeric column as labels if available
@@ -230,12 +444,12 @@ def plot_chart(df: pd.DataFrame) -> str | None:
                 
         else:
             # Single column - create a simple bar chart
-            print("--- Creating simple bar chart with single column ---")
+            logger.debug("Creating simple bar chart with single column")
             if numeric_cols:
                 plt.bar(range(len(plot_df)), plot_df[numeric_cols[0]])
                 plt.title(numeric_cols[0])
             else:
-                print("--- Cannot create chart without numeric data ---")
+                logger.debug("Cannot create chart without numeric data")
                 return None
         
         # Save and return file path
@@ -246,10 +460,17 @@ def plot_chart(df: pd.DataFrame) -> str | None:
         return file_path
         
     except Exception as e:
-        print(f"--- ERROR creating chart: {e} ---")
-        traceback.print_exc()  # Print full stack trace for better debugging
+        # exc_info keeps the full stack trace for debugging
+        logger.error("ERROR creating chart: %s", e, exc_info=True)
         return None
 
+def record_guard_decision(decision, sql):
+    """Keeps every SQL cost guard decision in telemetry, for tuning the budgets"""
+    estimate = decision.estimate
+    TELEMETRY.record("sql_guard", sql_text=sql, outcome=decision.action, error=decision.reason,
+                     estimated_bytes=estimate.bytes_assigned if estimate else None,
+                     estimated_partitions=estimate.partitions_assigned if estimate else None)
+
 def init():
     """
     Initializes the application by:
@@ -257,32 +478,77 @@ def init():
     2. Creating a CortexChat client with appropriate configuration
     Returns the connection and chat client objects
     """
-    print("Initializing application...")
+    logger.info("Initializing application...")
     with open(RSA_PRIVATE_KEY_PATH, "rb") as pem_in:
         private_key_obj = load_pem_private_key(pem_in.read(), password=RSA_PRIVATE_KEY_PASSWORD.encode(), backend=default_backend())
     conn = snowflake.connector.connect(user=USER, account=ACCOUNT, private_key=private_key_obj, warehouse=WAREHOUSE, role=ROLE, host=HOST, database=DATABASE, schema=SCHEMA)
-    print("Snowflake connection successful.")
+    logger.info("Snowflake connection successful.")
     tools_config = [{"tool_spec": {"type": "cortex_analyst_text_to_sql", "name": "semantic_model_tool"}}]
     tool_resources_config = {"semantic_model_tool": {"semantic_model_file": SEMANTIC_MODEL}}
-    cortex_app = cortex_chat.CortexChat(agent_url=AGENT_ENDPOINT, model=MODEL, account=ACCOUNT, user=USER, private_key_path=RSA_PRIVATE_KEY_PATH, private_key_password=RSA_PRIVATE_KEY_PASSWORD, tools=tools_config, tool_resources=tool_resources_config)
-    print("CortexChat client initialized.")
+    # Document questions go to the Cortex Search service from cortex_search_service.sql (CORTEX_SEARCH_SERVICE)
+    if cortex_search.CORTEX_SEARCH_SERVICE:
+        search_tool, search_resources = cortex_search.search_tool()
+        tools_config.append(search_tool)
+        tool_resources_config.update(search_resources)
+    guard = sql_guard.SqlGuard(recorder=record_guard_decision)
+    cortex_app = cortex_chat.CortexChat(agent_url=AGENT_ENDPOINT, model=MODEL, account=ACCOUNT, user=USER, private_key_path=RSA_PRIVATE_KEY_PATH, private_key_password=RSA_PRIVATE_KEY_PASSWORD, tools=tools_config, tool_resources=tool_resources_config, scheduler=admission.get_scheduler(WAREHOUSE), guard=guard)
+    logger.info("CortexChat client initialized.")
     return conn, cortex_app
 
+# The App Home view never changes, so it is built once; the publisher skips users who already have it
+HOME_VIEW = {"type": "home", "blocks": [{"type": "header", "text": {"type": "plain_text", "text": "Welcome! ❄️"}}, {"type": "section", "text": {"type": "mrkdwn", "text": "You can ask me questions about our data directly in our 1-on-1 chat."}}, {"type": "section", "text": {"type": "mrkdwn", "text": "*Examples:*\n• `What are the top 10 movie theatres this week?`\n• `Show me a breakdown of customer support tickets by service type.`"}}]}
+HOME_VIEWS = view_publisher.ViewPublisher()
+
 @app.event("app_home_opened")
 def update_home_tab(client, event, logger):
     """Updates the Slack App Home tab with welcome message and examples when opened"""
-    try:
-        client.views_publish(user_id=event["user"], view={"type": "home", "blocks": [{"type": "header", "text": {"type": "plain_text", "text": "Welcome! ❄️"}}, {"type": "section", "text": {"type": "mrkdwn", "text": "You can ask me questions about our data directly in our 1-on-1 chat."}}, {"type": "section", "text": {"type": "mrkdwn", "text": "*Examples:*\n• `What are the top 10 movie theatres this week?`\n• `Show me a breakdown of customer support tickets by service type.`"}}]} )
-    except Exception as e: logger.error(f"Error publishing App Home: {e}")
+    # Also fired when the Messages tab is opened, which has no view to publish
+    if event.get("tab", "home") == "home":
+        HOME_VIEWS.publish(client, event["user"], HOME_VIEW)
 
 @app.action(re.compile("feedback_(helpful|not_helpful)"))
-def handle_feedback(ack, body, say):
+def handle_feedback(ack, body, client):
     """Handles user feedback buttons (thumbs up/down)"""
     ack()
-    say(text="Thank you for your feedback!", channel=body['channel']['id'])
+    TELEMETRY.record("feedback", user_id=body['user']['id'], channel_id=body['channel']['id'],
+                     message_ts=body.get('message', {}).get('ts'), feedback=body['actions'][0]['action_id'].removeprefix("feedback_"))
+    slack_call(client, "chat_postMessage", text="Thank you for your feedback!", channel=body['channel']['id'])
+
+@app.command(profiler.PROFILE_COMMAND)
+def handle_profile_command(ack, command, client):
+    """Admin only: profiles this process for a window (seconds, optional) and posts the results as files"""
+    if not profiler.is_admin(command['user_id']):
+        ack("Only bot admins can run this command.")
+        return
+    try:
+        seconds = float(command.get('text') or profiler.PROFILE_SECONDS)
+    except ValueError:
+        seconds = None
+    # nan, inf, zero or negative would hang the capture or end it at once
+    if seconds is None or not math.isfinite(seconds) or not 0 < seconds <= profiler.PROFILE_MAX_SECONDS:
+        ack(f"Usage: {profiler.PROFILE_COMMAND} [seconds], up to {profiler.PROFILE_MAX_SECONDS:g}")
+        return
+    ack(f"Profiling worker {os.getpid()} for {seconds:.0f}s; CPU, memory and thread dumps will follow.")
+    threading.Thread(target=post_profile, args=(client, command['channel_id'], command['user_id'], seconds),
+                     name="profiler", daemon=True).start()
+
+def post_profile(client, channel_id, user_id, seconds):
+    try:
+        files = profiler.capture(seconds)
+    except profiler.CaptureBusy as e:
+        slack_call(client, "chat_postEphemeral", channel=channel_id, user=user_id, text=str(e))
+        return
+    slack_call(client, "files_upload_v2", channel=channel_id, initial_comment=f"Profile of worker {os.getpid()} over {seconds:.0f}s",
+               file_uploads=[{"content": text, "filename": name, "title": name} for name, text in files.items()])
 
 if __name__ == "__main__":
+    log_setup.configure_logging()
+    profiler.install_signal_handler()
     CONN, CORTEX_APP = init()
+    # One process computes the reports; any process sharing REPORTS_DB_PATH serves them
+    reports.ReportScheduler(lambda question: CORTEX_APP.chat(question, CONN), render_chart=plot_chart).start()
+    if metrics.start_http_server():
+        logger.info("Metrics endpoint listening on port %s.", os.getenv('METRICS_PORT'))
     handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-    print("Bolt app is running!")
+    logger.info("Bolt app is running!")
     handler.start()
\ No newline at end of file
@@ -0,0 +1,149 @@
+# Per-thread conversation memory for multi-turn questions.
+# Turns are stored compactly and rendered into agent messages under a byte budget: only the newest
+# turns keep their tool_use/tool_results parts, older turns collapse to question + answer + SQL text,
+# and the oldest or idle turns are dropped. With a shared_state backend the turns are stored there, so
+# follow-ups work whichever worker process receives them.
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CONVERSATION_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", "65536"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "10"))
+# Turns rendered with their full tool parts; older ones are summarised
+CONVERSATION_FULL_TURNS = int(os.getenv("CONVERSATION_FULL_TURNS", "1"))
+CONVERSATION_RESULT_ROWS = int(os.getenv("CONVERSATION_RESULT_ROWS", "20"))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "3600"))
+CONVERSATION_MAX_THREADS = int(os.getenv("CONVERSATION_MAX_THREADS", "1000"))
+
+
+def payload_size(obj) -> int:
+    return len(json.dumps(obj, separators=(",", ":")))
+
+
+def summarize_result(df, max_rows: int = CONVERSATION_RESULT_ROWS) -> str:
+    """A small stand-in for a full tool_results payload: shape, columns and the first rows."""
+    if df is None:
+        return ""
+    head = df.head(max_rows).to_json(orient='records')
+    more = f" (first {max_rows} shown)" if len(df) > max_rows else ""
+    return f"Result: {len(df)} rows, columns {list(df.columns)}{more}: {head}"
+
+
+def _text(role: str, text: str) -> dict:
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+class Turn:
+    __slots__ = ("question", "assistant_parts", "tool_name", "sql", "result_summary", "answer", "created_at")
+
+    def __init__(self, question: str, answer: str, assistant_parts: list = None, tool_name: str = None,
+                 sql: str = None, result_summary: str = ""):
+        self.question = question
+        self.answer = answer or ""
+        self.assistant_parts = assistant_parts or []
+        self.tool_name = tool_name
+        self.sql = sql
+        self.result_summary = result_summary
+        self.created_at = time.time()
+
+    def full_messages(self) -> list:
+        """The turn as the agent saw it, with the bulky SQL result replaced by its summary."""
+        if not self.assistant_parts:
+            return self.compact_messages()
+        messages = [_text("user", self.question)]
+        messages.append({"role": "assistant", "content": self.assistant_parts})
+        if self.sql:
+            messages.append({"role": "user", "content": [{"type": "tool_results", "tool_results": {
+                "tool_name": self.tool_name, "content": [{"type": "text", "text": self.result_summary}]}}]})
+            if self.answer:
+                messages.append(_text("assistant", self.answer))
+        return messages
+
+    def to_json(self) -> str:
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+    @classmethod
+    def from_json(cls, data: str) -> "Turn":
+        fields = json.loads(data)
+        turn = cls(fields['question'], fields['answer'], fields['assistant_parts'], fields['tool_name'],
+                   fields['sql'], fields['result_summary'])
+        turn.created_at = fields['created_at']
+        return turn
+
+    def compact_messages(self) -> list:
+        answer = self.answer or "(no answer)"
+        if self.sql:
+            answer += f"\n\nSQL used:\n{self.sql}"
+        return [_text("user", self.question), _text("assistant", answer)]
+
+
+class ConversationMemory:
+    """Conversation turns keyed by Slack thread, bounded in turns, bytes, idle time and thread count."""
+
+    def __init__(self, max_bytes: int = CONVERSATION_MAX_BYTES, max_turns: int = CONVERSATION_MAX_TURNS,
+                 full_turns: int = CONVERSATION_FULL_TURNS, ttl: float = CONVERSATION_TTL,
+                 max_threads: int = CONVERSATION_MAX_THREADS, backend=None):
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.full_turns = full_turns
+        self.ttl = ttl
+        self.max_threads = max_threads
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._threads = OrderedDict()  # thread key -> list of Turn, oldest first
+
+    @staticmethod
+    def _backend_key(key) -> str:
+        return "conversation:" + (":".join(map(str, key)) if isinstance(key, tuple) else str(key))
+
+    def _turns(self, key) -> list:
+        now = time.time()
+        if self.backend is not None:
+            stored = self.backend.range(self._backend_key(key), self.max_turns)
+            return [t for t in map(Turn.from_json, reversed(stored)) if now - t.created_at < self.ttl]
+        turns = [t for t in self._threads.get(key, []) if now - t.created_at < self.ttl]
+        if turns:
+            self._threads[key] = turns
+            self._threads.move_to_end(key)
+        else:
+            self._threads.pop(key, None)
+        return turns
+
+    def messages(self, key) -> list:
+        """Prior turns of the thread rendered as agent messages that fit within max_bytes."""
+        if key is None:
+            return []
+        with self._lock:
+            turns = list(self._turns(key))
+        while turns:
+            messages = []
+            for i, turn in enumerate(turns):
+                full = i >= len(turns) - self.full_turns
+                messages.extend(turn.full_messages() if full else turn.compact_messages())
+            if payload_size(messages) <= self.max_bytes:
+                return messages
+            # Over budget: drop the oldest turn and try again
+            turns.pop(0)
+        return []
+
+    def record(self, key, turn: Turn):
+        if key is None:
+            return
+        if self.backend is not None:
+            self.backend.push(self._backend_key(key), turn.to_json(), self.max_turns, self.ttl)
+            return
+        with self._lock:
+            turns = self._turns(key)
+            turns.append(turn)
+            self._threads[key] = turns[-self.max_turns:]
+            self._threads.move_to_end(key)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    def forget(self, key):
+        if self.backend is not None:
+            self.backend.delete(self._backend_key(key))
+        with self._lock:
+            self._threads.pop(key, None)
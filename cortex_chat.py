@@ -1,63 +1,389 @@
 import requests
 import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
 import pandas as pd
+import tracing
+from admission import RateLimited, WarehouseScheduler
+from conversation_memory import ConversationMemory, Turn, summarize_result
+from cortex_search import SearchCache, render_answer, search_results, search_tool_names
+from shared_state import shared_backend
+from deadline import Deadline, DeadlineExceeded, QuestionCancelled
+from log_setup import payload
+from metrics import REGISTRY
+from model_router import FAILOVER_SECONDS, MODEL_FAILOVER_TIMEOUT, ModelRouter, routes_from_env
+from result_store import ResultStore, get_result_store
+from query_poller import QueryPoller, describe, get_poller
+from single_flight import SingleFlight, flight_key
+from sql_guard import CONFIRM, REJECT, PendingConfirmations, SqlGuard
 from generate_jwt import JWTGenerator
+from load_shedding import NO_SUMMARY, REFUSAL_MESSAGE, REFUSE, LoadShedder
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_BYTES = REGISTRY.histogram("gboagent_agent_payload_bytes", "Size of the JSON request body sent to the agent API.", ("stage",),
+                                   buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+
+AGENT_CONNECT_TIMEOUT = float(os.getenv("AGENT_CONNECT_TIMEOUT", "10"))
+# Longest gap allowed between bytes of the agent's SSE stream; the question deadline bounds the total
+AGENT_READ_TIMEOUT = float(os.getenv("AGENT_READ_TIMEOUT", "60"))
+
+
+def _within(post, seconds: float) -> requests.Response:
+    """post() if its response headers arrive within seconds, else requests' Timeout."""
+    outcome, done = {}, threading.Event()
+    lock = threading.Lock()
+
+    def run():
+        try:
+            response = post()
+        except Exception as e:
+            outcome["error"] = e
+        else:
+            with lock:
+                if "abandoned" in outcome:
+                    # The caller has failed over already; nobody will read this stream
+                    response.close()
+                outcome["response"] = response
+        done.set()
+
+    threading.Thread(target=run, name="agent-headers", daemon=True).start()
+    if not done.wait(seconds):
+        with lock:
+            if "response" not in outcome:
+                outcome["abandoned"] = True
+                raise requests.exceptions.Timeout(f"no response headers within {seconds:g}s")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["response"]
+
+
+class SqlStep(NamedTuple):
+    """Everything needed to run a question's SQL and summarise it, so the step can wait for confirmation."""
+    query: str
+    thread_key: tuple
+    requester: tuple
+    messages: list
+    assistant_parts: list
+    tool_results: dict
+    sql: str
+    interpretation: str
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict())
+
+    @classmethod
+    def from_json(cls, data: str) -> "SqlStep":
+        fields = json.loads(data)
+        # JSON has no tuples; the keys are used for dict lookups
+        for name in ("thread_key", "requester"):
+            if fields[name] is not None:
+                fields[name] = tuple(fields[name])
+        return cls(**fields)
+
 
 class CortexChat:
     def __init__(self, agent_url: str, model: str, account: str, user: str, private_key_path: str,
                  tools: list, tool_resources: dict, response_instruction: str = "You are a helpful assistant.",
-                 private_key_password: str = None):
+                 private_key_password: str = None, memory: ConversationMemory = None,
+                 scheduler: WarehouseScheduler = None, guard: SqlGuard = None, poller: QueryPoller = None,
+                 results: ResultStore = None, router: ModelRouter = None, shedder: LoadShedder = None):
         self.agent_url = agent_url
         self.model = model
+        # Models per stage (SQL generation, summary) with failover; MODEL is the default for both
+        self.router = router or ModelRouter(routes_from_env(model))
         self.response_instruction = response_instruction
         self.tools = tools
         self.tool_resources = tool_resources
         self.jwt_generator = JWTGenerator(account, user, private_key_path, private_key_password)
-        self.jwt = self.jwt_generator.get_token()
-        self.history = []
+        self.jwt = self._get_jwt()
+        # Prior turns per Slack thread; each question builds its own message list from it
+        # Kept in the shared backend when there is one, so follow-ups work on any worker process
+        self.memory = memory or ConversationMemory(backend=shared_backend())
+        # Concurrent identical questions (same text and thread context) share one execution
+        self.single_flight = SingleFlight()
+        # Per-user rate limits and the warehouse concurrency budget / fair queue for SQL execution
+        self.scheduler = scheduler or WarehouseScheduler("default")
+        # Degraded mode: drops charts, then the summary call, then preview rows, then new questions as load rises
+        self.shedder = shedder or LoadShedder(self.scheduler)
+        # One status-polling thread pool for every in-flight warehouse query in the process
+        self.poller = poller or get_poller()
+        # Results are written once to disk; responses and history carry the handle for charts, exports and reruns
+        self.results = results or get_result_store()
+        # EXPLAIN-based budgets and row caps for agent SQL; expensive queries wait for the asker's approval
+        self.guard = guard or SqlGuard()
+        # In the shared backend when there is one, so Run anyway works whichever worker receives the click
+        self.confirmations = PendingConfirmations(backend=shared_backend(), item_type=SqlStep)
+        # Answers grounded only in cortex_search results are reused until the search index can have changed
+        self.search_tools = search_tool_names(tools)
+        self.search_cache = SearchCache({name: tool_resources.get(name) for name in sorted(self.search_tools)}) if self.search_tools else None
+
+    def _get_jwt(self) -> str:
+        with tracing.span("jwt.fetch"):
+            return self.jwt_generator.get_token()
+
+    def _post(self, headers: dict, body: bytes, deadline: Deadline, headers_timeout: float = None) -> requests.Response:
+        """
+        POST with a streamed response. headers_timeout bounds only the wait for the response headers; the
+        body's reads keep AGENT_READ_TIMEOUT, since a streaming answer may pause between events.
+        """
+        deadline.check()
+        post = lambda: requests.post(self.agent_url, headers=headers, data=body, stream=True,
+                                     timeout=(deadline.timeout(AGENT_CONNECT_TIMEOUT), deadline.timeout(AGENT_READ_TIMEOUT)))
+        try:
+            if headers_timeout is None:
+                return post()
+            return _within(post, deadline.timeout(headers_timeout))
+        except requests.exceptions.RequestException:
+            # A timeout or reset caused by our own deadline should surface as a cancellation
+            deadline.check()
+            raise
 
-    def _send_request(self) -> requests.Response:
+    def _send_request(self, messages: list, stage: str = "agent", deadline: Deadline = None) -> requests.Response:
+        """
+        POST to the agent with the stage's best model, failing over to the next one on a timeout, connection
+        error, 5xx or 429. Only the last candidate's failure reaches the caller.
+        """
+        # The "connect" span covers request start to response headers; streaming is timed by _iter_sse_parts.
+        deadline = deadline or Deadline.unbounded()
+        models = self.router.candidates(stage)
+        failed_seconds = 0.0
+        for attempt, model in enumerate(models):
+            last = attempt == len(models) - 1
+            started = time.perf_counter()
+            try:
+                response = self._send_to_model(model, messages, stage, deadline, None if last else MODEL_FAILOVER_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                seconds = time.perf_counter() - started
+                self.router.record(stage, model, seconds, False, "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection")
+                if last:
+                    raise
+                logger.warning("%s: %s failed after %.1fs (%s), trying %s", stage, model, seconds, e, models[attempt + 1])
+                failed_seconds += seconds
+                continue
+            seconds = time.perf_counter() - started
+            if response.status_code >= 500 or response.status_code == 429:
+                self.router.record(stage, model, seconds, False, f"http_{response.status_code}")
+                if last:
+                    return response
+                logger.warning("%s: %s returned %d, trying %s", stage, model, response.status_code, models[attempt + 1])
+                response.close()
+                failed_seconds += seconds
+                continue
+            self.router.record(stage, model, seconds, True)
+            self.router.routed(stage, model, attempt)
+            if attempt:
+                FAILOVER_SECONDS.observe(failed_seconds, stage=stage)
+            return response
+
+    def _send_to_model(self, model: str, messages: list, stage: str, deadline: Deadline, headers_timeout: float = None) -> requests.Response:
         headers = {'X-Snowflake-Authorization-Token-Type': 'KEYPAIR_JWT', 'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': f"Bearer {self.jwt}"}
-        data = {"model": self.model, "response_instruction": self.response_instruction, "messages": self.history, "tools": self.tools, "tool_resources": self.tool_resources}
-        response = requests.post(self.agent_url, headers=headers, json=data, stream=True)
+        data = {"model": model, "response_instruction": self.response_instruction, "messages": messages, "tools": self.tools, "tool_resources": self.tool_resources}
+        # Serialise once so the payload size can be reported without encoding twice
+        body = json.dumps(data).encode('utf-8')
+        PAYLOAD_BYTES.observe(len(body), stage=stage)
+        logger.debug("%s request to %s: %d messages, %d bytes", stage, model, len(messages), len(body))
+        with tracing.span(f"{stage}.connect", model=model, payload_bytes=len(body)) as span:
+            response = self._post(headers, body, deadline, headers_timeout)
+            span.set(http_status=response.status_code)
         if response.status_code == 401:
-            self.jwt = self.jwt_generator.get_token()
+            self.jwt = self._get_jwt()
             headers['Authorization'] = f"Bearer {self.jwt}"
-            response = requests.post(self.agent_url, headers=headers, json=data, stream=True)
+            with tracing.span(f"{stage}.connect", model=model, retry=True) as span:
+                response = self._post(headers, body, deadline, headers_timeout)
+                span.set(http_status=response.status_code)
         return response
 
+    def _iter_sse_parts(self, response: requests.Response, stage: str = "agent", deadline: Deadline = None):
+        """
+        Yield content parts from message.delta events, recording TTFB and stream duration for the stage.
+        Cancelling the deadline closes the response, which unblocks the read and raises QuestionCancelled here.
+        """
+        deadline = deadline or Deadline.unbounded()
+        start = time.perf_counter()
+        first_byte_at = None
+        parts = 0
+        try:
+            with deadline.on_cancel(response.close):
+                for line in response.iter_lines():
+                    deadline.check()
+                    if first_byte_at is None:
+                        first_byte_at = time.perf_counter()
+                        tracing.record(f"{stage}.ttfb", first_byte_at - start)
+                    if not line: continue
+                    decoded_line = line.decode('utf-8')
+                    if not decoded_line.startswith('data: '): continue
+                    try:
+                        json_str = decoded_line[6:].strip()
+                        if json_str == '[DONE]': break
+                        data = json.loads(json_str)
+                        if isinstance(data, dict) and data.get('object') == 'message.delta':
+                            delta_content = data.get('delta', {}).get('content', [])
+                            if isinstance(delta_content, list):
+                                for part in delta_content:
+                                    parts += 1
+                                    yield part
+                    except json.JSONDecodeError:
+                        logger.warning("Failed to parse SSE line: %s", payload(decoded_line))
+        except QuestionCancelled:
+            raise
+        except Exception:
+            # Reading from a response closed by a cancel hook fails with a transport error
+            deadline.check()
+            raise
+        finally:
+            if first_byte_at is not None:
+                tracing.record(f"{stage}.stream", time.perf_counter() - first_byte_at, parts=parts)
+
     def _parse_sse_stream(self, response: requests.Response) -> list:
-        assistant_content_parts = []
-        for line in response.iter_lines():
-            if not line: continue
-            decoded_line = line.decode('utf-8')
-            if not decoded_line.startswith('data: '): continue
+        return list(self._iter_sse_parts(response))
+
+    def _cancel_query(self, conn, query_id: str):
+        """Ask the warehouse to stop a running query."""
+        logger.info("Cancelling warehouse query %s", query_id)
+        try:
+            cursor = conn.cursor()
             try:
-                json_str = decoded_line[6:].strip()
-                if json_str == '[DONE]': break
-                data = json.loads(json_str)
-                if isinstance(data, dict) and data.get('object') == 'message.delta':
-                    delta_content = data.get('delta', {}).get('content', [])
-                    if isinstance(delta_content, list): assistant_content_parts.extend(delta_content)
-            except json.JSONDecodeError:
-                print(f"Warning: Failed to parse SSE line: {decoded_line}")
-        return assistant_content_parts
-
-    def chat(self, query: str, conn, callback=None) -> dict:
-        print(f"--- Received query: {query} ---")
-        self.history = [{"role": "user", "content": [{"type": "text", "text": query}]}]
+                cursor.execute("SELECT SYSTEM$CANCEL_QUERY(%s)", (query_id,))
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.warning("Failed to cancel query %s: %s", query_id, e)
+
+    def _execute_sql(self, sql_query: str, conn, deadline: Deadline = None, on_progress=None) -> pd.DataFrame:
+        """
+        Run the query, timing warehouse execution and result fetch as separate spans.
+        The query is submitted asynchronously and its status polled by the shared poller, so a cancelled or
+        expired deadline can cancel it by query ID. on_progress(status, elapsed) reports long-running queries.
+        """
+        deadline = deadline or Deadline.unbounded()
+        deadline.check()
+        cursor = conn.cursor()
+        try:
+            with tracing.span("sql.execute") as span:
+                cursor.execute_async(sql_query)
+                query_id = cursor.sfqid
+                span.set(query_id=query_id)
+                with deadline.on_cancel(lambda: self._cancel_query(conn, query_id)):
+                    pending = self.poller.submit(conn, query_id)
+                    pending.wait(deadline, on_progress)
+                span.set(status=pending.status)
+                cursor.get_results_from_sfqid(query_id)
+            with tracing.span("sql.fetch") as span:
+                columns = [col[0] for col in cursor.description or []]
+                df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+                span.set(rows=len(df), columns=len(columns))
+            return df
+        finally:
+            cursor.close()
+
+    def _store_result(self, df: pd.DataFrame) -> str | None:
+        """Handle of df in the result store; None (logged) if it can't be stored, so the answer still goes out."""
+        try:
+            with tracing.span("result.store", rows=len(df)):
+                return self.results.put(df)
+        except Exception as e:
+            logger.warning("Failed to store result: %s", e)
+            return None
+
+    def chat(self, query: str, conn, callback=None, deadline: Deadline = None, thread_key=None, requester: tuple = None) -> dict:
+        """
+        Answers one question. The deadline (QUESTION_TIMEOUT by default) spans both agent calls and SQL
+        execution; callers that render results pass their own so rendering is covered too.
+        Passing a thread_key (e.g. (channel, thread_ts)) sends the thread's earlier turns as context.
+        Identical questions asked concurrently attach to the first one's execution and get its callbacks.
+        requester is (user_id, channel_id), used for rate limiting and fair queuing for the warehouse.
+        """
+        user_id, channel_id = requester or (None, None)
+        try:
+            self.scheduler.admit(user_id)
+        except RateLimited as e:
+            error_msg = f"You're asking questions faster than I can answer them. Please slow down and try again in {e.retry_after:.0f} seconds."
+            logger.info("Rate limited user %s for %.1fs", user_id, e.retry_after)
+            if callback:
+                callback(error=error_msg)
+            return {"error": error_msg, "rate_limited": True}
+        key = flight_key(query, self.memory.messages(thread_key))
+        cached = self.search_cache.get(key) if self.search_cache is not None else None
+        if cached is not None:
+            logger.info("Answered from the search cache")
+            self.memory.record(thread_key, Turn(query, cached['text']))
+            if callback:
+                callback(cached['text'], is_final=True)
+            return {"text": cached['text'], "dataframe": None, "sql": None, "citations": cached['citations'], "cached": True}
+        if self.shedder.sheds(REFUSE, "question"):
+            logger.warning("Refusing question under load: %s", self.shedder.pressure())
+            if callback:
+                callback(error=REFUSAL_MESSAGE)
+            return {"error": REFUSAL_MESSAGE, "shed": True}
+        owns_deadline = deadline is None
+        deadline = deadline or Deadline()
+        ran = []
+
+        def run(fanout_callback, flight_deadline):
+            ran.append(True)
+            return self._answer(query, conn, fanout_callback, flight_deadline, thread_key, requester)
+
+        try:
+            result = self.single_flight.do(key, run, callback, deadline)
+        except QuestionCancelled as e:
+            # This requester's own cancellation: the shared execution carries on for anyone else waiting
+            return self._cancelled(e, callback)
+        finally:
+            if owns_deadline:
+                deadline.close()
+        if result.get('guard') == CONFIRM:
+            return self._hold(result, callback, thread_key, requester)
+        if ran and result.get('citations') is not None and self.search_cache is not None:
+            self.search_cache.put(key, {"text": result['text'], "citations": result['citations']})
+        if not ran and thread_key is not None and not result.get('error'):
+            # Followers still need the answer in their own thread's memory
+            self.memory.record(thread_key, Turn(query, result.get('text'), sql=result.get('sql'),
+                                                result_summary=summarize_result(result.get('dataframe'))))
+        return result
+
+    def _cancelled(self, e: QuestionCancelled, callback) -> dict:
+        if isinstance(e, DeadlineExceeded):
+            error_msg = f"This question took too long and was stopped ({e})."
+        else:
+            error_msg = f"This question was stopped: {e.reason}."
+        logger.warning("%s", error_msg)
+        if callback:
+            callback(error=error_msg)
+        return {"error": error_msg, "cancelled": True}
+
+    def _answer(self, query: str, conn, callback, deadline: Deadline, thread_key=None, requester: tuple = None) -> dict:
+        try:
+            return self._chat(query, conn, callback, deadline, thread_key, requester)
+        except QuestionCancelled as e:
+            return self._cancelled(e, callback)
+
+    def _remember(self, thread_key, query: str, answer: str, assistant_parts: list, tool_results: dict = None,
+                  sql: str = None, df: pd.DataFrame = None):
+        if thread_key is None:
+            return
+        tool_name = (tool_results or {}).get('tool_name')
+        self.memory.record(thread_key, Turn(query, answer, assistant_parts, tool_name, sql, summarize_result(df)))
+
+    def _chat(self, query: str, conn, callback, deadline: Deadline, thread_key=None, requester: tuple = None) -> dict:
+        logger.info("Received query: %s", payload(query))
+        messages = self.memory.messages(thread_key)
+        messages.append({"role": "user", "content": [{"type": "text", "text": query}]})
         
         # First API call to get SQL and interpretation
-        print("--- Sending first API call to get SQL ---")
+        logger.debug("Sending first API call to get SQL")
         
         # Initial callback to show we're processing
         if callback:
             callback("I'm analyzing your question...")
         
-        response_one = self._send_request()
+        response_one = self._send_request(messages, "agent_1", deadline)
         if response_one.status_code != 200:
             error_msg = f"API Error on first call: Status {response_one.status_code}"
-            print(f"--- {error_msg} ---")
+            logger.error("%s", error_msg)
             if callback:
                 callback(error=error_msg)
             return {"error": error_msg}
@@ -66,42 +392,31 @@ class CortexChat:
         assistant_parts_one = []
         current_text = ""
         
-        for line in response_one.iter_lines():
-            if not line: continue
-            decoded_line = line.decode('utf-8')
-            if not decoded_line.startswith('data: '): continue
-            try:
-                json_str = decoded_line[6:].strip()
-                if json_str == '[DONE]': break
-                data = json.loads(json_str)
-                if isinstance(data, dict) and data.get('object') == 'message.delta':
-                    delta_content = data.get('delta', {}).get('content', [])
-                    if isinstance(delta_content, list):
-                        for part in delta_content:
-                            assistant_parts_one.append(part)
-                            # If text content, update the callback
-                            if part.get('type') == 'text' and callback:
-                                current_text += part.get('text', '')
-                                callback(current_text)
-            except json.JSONDecodeError:
-                print(f"Warning: Failed to parse SSE line: {decoded_line}")
+        for part in self._iter_sse_parts(response_one, "agent_1", deadline):
+            assistant_parts_one.append(part)
+            # If text content, update the callback
+            if part.get('type') == 'text' and callback:
+                current_text += part.get('text', '')
+                callback(current_text)
     
-        print(f"--- First API response parts: {json.dumps(assistant_parts_one, indent=2)} ---")
+        logger.debug("First API response parts: %s", payload(assistant_parts_one))
         
         if not assistant_parts_one: 
             error_msg = "Agent returned an empty response on first call."
-            print(f"--- {error_msg} ---")
+            logger.error("%s", error_msg)
             if callback:
                 callback(error=error_msg)
             return {"error": error_msg}
         
         # Extract text from regular text parts
         initial_interpretation = "".join(part.get('text', '') for part in assistant_parts_one if part.get('type') == 'text')
-        print(f"--- Initial text interpretation: {initial_interpretation} ---")
+        logger.debug("Initial text interpretation: %s", payload(initial_interpretation))
         
         # Extract interpretation from tool results
-        self.history.append({"role": "assistant", "content": assistant_parts_one})
-        sql_results_part = next((part for part in assistant_parts_one if part.get('type') == 'tool_results'), None)
+        messages.append({"role": "assistant", "content": assistant_parts_one})
+        results_parts = [part for part in assistant_parts_one if part.get('type') == 'tool_results']
+        search_parts = [part for part in results_parts if search_results(part) is not None]
+        sql_results_part = next((part for part in results_parts if search_results(part) is None), None)
         
         tool_interpretation = ""
         if sql_results_part:
@@ -111,63 +426,167 @@ class CortexChat:
             if content and len(content) > 0:
                 json_content = content[0].get('json', {})
                 tool_interpretation = json_content.get('text', '')
-                print(f"--- Tool interpretation: {tool_interpretation} ---")
+                logger.debug("Tool interpretation: %s", payload(tool_interpretation))
         
         # Use the tool interpretation if available, otherwise fall back to initial text
         final_interpretation = tool_interpretation if tool_interpretation else initial_interpretation
-        print(f"--- Final interpretation to use: {final_interpretation} ---")
+        logger.debug("Final interpretation to use: %s", payload(final_interpretation))
         
         if not sql_results_part:
-            print("--- No SQL generated, returning interpretation ---")
+            response = {"text": final_interpretation or "I couldn't interpret your request", "dataframe": None, "sql": None}
+            if search_parts:
+                # Answered from documents: number the citations and list their sources
+                citations = [result for part in search_parts for result in search_results(part)]
+                final_interpretation = response['text'] = render_answer(final_interpretation, citations)
+                response['citations'] = citations
+                logger.info("Answered from search with %d results", len(citations))
+            else:
+                logger.info("No SQL generated, returning interpretation")
+            self._remember(thread_key, query, final_interpretation, assistant_parts_one)
             if callback:
                 callback(final_interpretation, is_final=True)
-            return {"text": final_interpretation or "I couldn't interpret your request", "dataframe": None, "sql": None}
+            return response
 
         # Execute SQL
         tool_results = sql_results_part.get('tool_results', {})
         sql_query = tool_results.get('content', [{}])[0].get('json', {}).get('sql')
-        print(f"--- Tool results structure: {json.dumps(tool_results, indent=2)} ---")
+        logger.debug("Tool results structure: %s", payload(tool_results))
 
         if not isinstance(sql_query, str):
             error_msg = "Agent did not provide a valid SQL query."
-            print(f"--- {error_msg}: {sql_query} ---")
+            logger.error("%s: %s", error_msg, payload(sql_query))
             if callback:
                 callback(error=error_msg, sql=str(sql_query))
             return {"error": error_msg, "sql": str(sql_query)}
         
+        step = SqlStep(query, thread_key, requester, messages, assistant_parts_one, tool_results, sql_query, final_interpretation)
+        decision = self.guard.check(sql_query, conn)
+        if decision.action == REJECT:
+            error_msg = f"{decision.message}. Try a narrower question, e.g. a shorter date range or fewer columns."
+            if callback:
+                callback(error=error_msg, sql=sql_query)
+            return {"error": error_msg, "sql": sql_query, "guard": REJECT}
+        if decision.action == CONFIRM:
+            # chat() parks the step once per requester, so each asker gets a button only they can approve
+            text = f"{final_interpretation}\n\n:warning: {decision.message}. Run it anyway?"
+            return {"text": text, "dataframe": None, "sql": sql_query, "guard": CONFIRM, "step": step}
+        return self._run_sql_step(step, conn, callback, deadline, decision)
+
+    def _hold(self, result: dict, callback, thread_key, requester: tuple) -> dict:
+        """Park a CONFIRM result's step until this requester approves it (or the confirmation expires)."""
+        step = result['step']
+        # Each requester runs the step in their own thread and queue slot; _run_sql_step appends to messages
+        step = step._replace(thread_key=thread_key, requester=requester, messages=list(step.messages))
+        token = self.confirmations.add(step, (requester or (None,))[0])
+        if callback:
+            callback(result['text'], is_final=True, sql=result['sql'], confirm=token)
+        return {"text": result['text'], "dataframe": None, "sql": result['sql'], "guard": CONFIRM, "confirm": token}
+
+    def confirm(self, token: str, conn, callback=None, deadline: Deadline = None, user_id: str = None) -> dict:
+        """Run a query the guard held for confirmation. Only the user who asked the question may approve it."""
+        step = self.confirmations.pop(token, user_id)
+        if step is None:
+            error_msg = "This confirmation has expired or was already used. Please ask the question again."
+            if callback:
+                callback(error=error_msg)
+            return {"error": error_msg}
+        owns_deadline = deadline is None
+        deadline = deadline or Deadline()
+        try:
+            decision = self.guard.check(step.sql, conn, confirmed=True)
+            if decision.action == REJECT:
+                error_msg = f"{decision.message}."
+                if callback:
+                    callback(error=error_msg, sql=step.sql)
+                return {"error": error_msg, "sql": step.sql, "guard": REJECT}
+            return self._run_sql_step(step, conn, callback, deadline, decision)
+        except QuestionCancelled as e:
+            return self._cancelled(e, callback)
+        finally:
+            if owns_deadline:
+                deadline.close()
+
+    def _run_sql_step(self, step: "SqlStep", conn, callback, deadline: Deadline, decision) -> dict:
+        """Execute the approved SQL, then ask the agent to summarise the results."""
+        query, thread_key, requester, messages = step.query, step.thread_key, step.requester, step.messages
+        assistant_parts_one, tool_results, sql_query, final_interpretation = step.assistant_parts, step.tool_results, step.sql, step.interpretation
+
         # Update the user that we're executing SQL
         if callback:
             callback(f"{final_interpretation}\n\n_Executing SQL query..._")
     
-        print(f"--- Executing SQL: {sql_query} ---")
+        logger.info("Executing SQL: %s", payload(sql_query))
+        user_id, channel_id = requester or (None, None)
+
+        def on_queued(position):
+            if callback:
+                callback(f"{final_interpretation}\n\n_Waiting for a warehouse slot (position {position} in queue)..._")
+
+        def on_progress(status, elapsed):
+            if callback:
+                callback(f"{final_interpretation}\n\n_{describe(status)} ({elapsed:.0f}s elapsed)..._")
+
         try:
-            df = pd.read_sql(sql_query, conn)
-            print(f"--- SQL execution successful. Rows: {len(df)}, Columns: {list(df.columns)} ---")
+            with self.scheduler.slot(user_id, channel_id, deadline, on_queued):
+                started = time.monotonic()
+                try:
+                    df = self._execute_sql(decision.sql, conn, deadline, on_progress)
+                except DeadlineExceeded:
+                    # The slowest queries are the load signal; only user cancels and superseded questions are left out
+                    self.shedder.record(time.monotonic() - started, False, timed_out=True)
+                    raise
+                except QuestionCancelled:
+                    raise
+                except Exception:
+                    self.shedder.record(time.monotonic() - started, False)
+                    raise
+                self.shedder.record(time.monotonic() - started, True)
+            logger.info("SQL execution successful. Rows: %d, Columns: %s", len(df), payload(list(df.columns)))
+            cap_note = ""
+            if decision.row_cap is not None and len(df) > decision.row_cap:
+                # The capped query fetched one extra row to show it was cut short
+                df = df.iloc[:decision.row_cap]
+                cap_note = f"\n\n_Only the first {decision.row_cap:,} rows were fetched; ask a narrower question to see the rest._"
+                final_interpretation += cap_note
+        except QuestionCancelled:
+            raise
         except Exception as e:
             error_msg = str(e)
-            print(f"--- SQL execution error: {error_msg} ---")
+            logger.error("SQL execution error: %s", error_msg)
             if callback:
                 callback(error=error_msg, sql=sql_query)
             return {"error": error_msg, "sql": sql_query}
 
-        # Send data back for summary
+        result_handle = self._store_result(df)
+
+        if self.shedder.sheds(NO_SUMMARY, "summary"):
+            # Under load the agent's interpretation is the answer; the rows still go out with it
+            self._remember(thread_key, query, final_interpretation, assistant_parts_one, tool_results, sql_query, df)
+            if callback:
+                callback(final_interpretation, is_final=True, df=df, sql=sql_query, result_handle=result_handle)
+            return {"text": final_interpretation, "dataframe": df, "result_handle": result_handle, "sql": sql_query,
+                    "warning": "Summary skipped under load"}
+
+        # Send data back for summary; the rows go to the callback now so charts and exports can start alongside it
         if callback:
-            callback(f"{final_interpretation}\n\n_Processing results..._")
+            callback(f"{final_interpretation}\n\n_Processing results..._", df=df, result_handle=result_handle)
         
-        print("--- Sending second API call for summary ---")
+        logger.debug("Sending second API call for summary")
         tool_data = {"type": "text", "text": df.to_json(orient='records')}
-        self.history.append({"role": "user", "content": [{"type": "tool_results", "tool_results": {"tool_name": tool_results.get('tool_name'), "content": [tool_data]}}]})
+        messages.append({"role": "user", "content": [{"type": "tool_results", "tool_results": {"tool_name": tool_results.get('tool_name'), "content": [tool_data]}}]})
 
         # Second API call to get summary
-        response_two = self._send_request()
+        response_two = self._send_request(messages, "agent_2", deadline)
         if response_two.status_code != 200:
-            print(f"--- Error on second API call: {response_two.status_code} ---")
+            logger.warning("Error on second API call: %s", response_two.status_code)
+            self._remember(thread_key, query, final_interpretation, assistant_parts_one, tool_results, sql_query, df)
             # Return tool interpretation when second call fails
             if callback:
-                callback(final_interpretation, is_final=True, df=df, sql=sql_query)
+                callback(final_interpretation, is_final=True, df=df, sql=sql_query, result_handle=result_handle)
             return {
                 "text": final_interpretation,
                 "dataframe": df,
+                "result_handle": result_handle,
                 "sql": sql_query,
                 "warning": f"API Error on second call: Status {response_two.status_code}"
             }
@@ -176,60 +595,53 @@ class CortexChat:
         assistant_parts_two = []
         current_text = final_interpretation
         
-        for line in response_two.iter_lines():
-            if not line: continue
-            decoded_line = line.decode('utf-8')
-            if not decoded_line.startswith('data: '): continue
-            try:
-                json_str = decoded_line[6:].strip()
-                if json_str == '[DONE]': break
-                data = json.loads(json_str)
-                if isinstance(data, dict) and data.get('object') == 'message.delta':
-                    delta_content = data.get('delta', {}).get('content', [])
-                    if isinstance(delta_content, list):
-                        for part in delta_content:
-                            assistant_parts_two.append(part)
-                            # If text content, update the callback
-                            if part.get('type') == 'text' and callback:
-                                current_text = final_interpretation + "\n\n" + part.get('text', '')
-                                callback(current_text)
-            except json.JSONDecodeError:
-                print(f"Warning: Failed to parse SSE line: {decoded_line}")
+        for part in self._iter_sse_parts(response_two, "agent_2", deadline):
+            assistant_parts_two.append(part)
+            # If text content, update the callback
+            if part.get('type') == 'text' and callback:
+                current_text = final_interpretation + "\n\n" + part.get('text', '')
+                callback(current_text)
     
-        print(f"--- Second API response parts: {json.dumps(assistant_parts_two, indent=2)} ---")
+        logger.debug("Second API response parts: %s", payload(assistant_parts_two))
         
         # If the second response is empty, use the tool interpretation
         if not assistant_parts_two:
-            print("--- Empty response from second API call, using tool interpretation ---")
+            logger.warning("Empty response from second API call, using tool interpretation")
+            self._remember(thread_key, query, final_interpretation, assistant_parts_one, tool_results, sql_query, df)
             if callback:
-                callback(final_interpretation, is_final=True, df=df, sql=sql_query)
+                callback(final_interpretation, is_final=True, df=df, sql=sql_query, result_handle=result_handle)
             return {
                 "text": final_interpretation,
                 "dataframe": df,
+                "result_handle": result_handle,
                 "sql": sql_query,
                 "warning": "Summarization failed"
             }
 
-        self.history.append({"role": "assistant", "content": assistant_parts_two})
         final_text = "".join(part.get('text', '') for part in assistant_parts_two if part.get('type') == 'text')
-        print(f"--- Final summary text: {final_text} ---")
+        logger.debug("Final summary text: %s", payload(final_text))
         
         # If the agent returns text but it's empty, use tool interpretation
         if not final_text.strip():
-            print("--- Empty summary text, using tool interpretation ---")
+            logger.warning("Empty summary text, using tool interpretation")
+            self._remember(thread_key, query, final_interpretation, assistant_parts_one, tool_results, sql_query, df)
             if callback:
-                callback(final_interpretation, is_final=True, df=df, sql=sql_query)
+                callback(final_interpretation, is_final=True, df=df, sql=sql_query, result_handle=result_handle)
             return {
                 "text": final_interpretation,
                 "dataframe": df,
+                "result_handle": result_handle,
                 "sql": sql_query,
                 "warning": "Empty summary"
             }
 
+        final_text += cap_note
+        self._remember(thread_key, query, final_text, assistant_parts_one, tool_results, sql_query, df)
+
         # Final callback with complete results
         if callback:
             complete_text = final_text if final_text.strip() else final_interpretation
-            callback(complete_text, is_final=True, df=df, sql=sql_query)
+            callback(complete_text, is_final=True, df=df, sql=sql_query, result_handle=result_handle)
 
-        return {"text": final_text, "dataframe": df, "sql": sql_query}
+        return {"text": final_text, "dataframe": df, "result_handle": result_handle, "sql": sql_query}
 
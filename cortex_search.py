@@ -0,0 +1,114 @@
+# Cortex Search tool support: tool config, search-result / citation rendering, and a retrieval cache.
+# The agent runs the search service and answers from the chunks it finds; the answer comes back with
+# 【†n†】 citation markers and a tool_results part holding the search results. Answers grounded only in
+# search are cached by question, thread context and search scope for CORTEX_SEARCH_CACHE_TTL, which
+# matches the service's TARGET_LAG: the index can't change sooner than that, so neither can the results.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+from shared_state import shared_backend
+
+CORTEX_SEARCH_SERVICE = os.getenv("CORTEX_SEARCH_SERVICE", "DASH_DB.DASH_SCHEMA.VEHICLES_INFO")
+CORTEX_SEARCH_MAX_RESULTS = int(os.getenv("CORTEX_SEARCH_MAX_RESULTS", "4"))
+# TARGET_LAG = '1 hour' in cortex_search_service.sql
+CORTEX_SEARCH_CACHE_TTL = float(os.getenv("CORTEX_SEARCH_CACHE_TTL", "3600"))
+CORTEX_SEARCH_CACHE_SIZE = int(os.getenv("CORTEX_SEARCH_CACHE_SIZE", "1000"))
+
+SEARCH_CACHE = REGISTRY.counter("gboagent_search_cache_total", "Search-grounded answer cache lookups.", ("result",))
+
+_CITATION = re.compile(r"【†(\d+)†】")
+
+
+def search_tool(name: str = "search_service_tool", service: str = CORTEX_SEARCH_SERVICE, max_results: int = CORTEX_SEARCH_MAX_RESULTS,
+                title_column: str = "TITLE", id_column: str = "RELATIVE_PATH", filter: dict = None) -> tuple:
+    """The (tool, tool_resources) pair for a cortex_search tool over service."""
+    resources = {"name": service, "max_results": max_results, "title_column": title_column, "id_column": id_column}
+    if filter:
+        resources["filter"] = filter
+    return {"tool_spec": {"type": "cortex_search", "name": name}}, {name: resources}
+
+
+def search_tool_names(tools: list) -> set:
+    return {t["tool_spec"]["name"] for t in tools if t.get("tool_spec", {}).get("type") == "cortex_search"}
+
+
+def search_results(part: dict) -> list | None:
+    """The search results in a tool_results part, or None if the part isn't from a search tool."""
+    for content in part.get('tool_results', {}).get('content', []):
+        results = (content.get('json') or {}).get('searchResults')
+        if results is not None:
+            return results
+    return None
+
+
+def render_answer(text: str, results: list) -> str:
+    """Turn 【†n†】 markers into [n] and list the cited documents (or all of them if none are cited)."""
+    cited = []
+    def number(match):
+        index = int(match.group(1))
+        if index not in cited:
+            cited.append(index)
+        return f"[{index}]"
+    text = _CITATION.sub(number, text or "")
+    sources = []
+    for index in sorted(cited) or range(1, len(results) + 1):
+        if 1 <= index <= len(results):
+            result = results[index - 1]
+            title = result.get('doc_title') or result.get('title') or result.get('doc_id') or f"Result {index}"
+            source = result.get('source_id') or result.get('doc_id')
+            sources.append(f"[{index}] {title}" + (f" — `{source}`" if source and source != title else ""))
+    if sources:
+        text += "\n\n*Sources:*\n" + "\n".join(sources)
+    return text
+
+
+class SearchCache:
+    """TTL cache of search-grounded answers, in the shared state backend when there is one."""
+
+    def __init__(self, scope, ttl: float = CORTEX_SEARCH_CACHE_TTL, max_entries: int = CORTEX_SEARCH_CACHE_SIZE, backend=None):
+        # Services, filters and result limits: a change to any of them changes what search returns
+        self.scope = json.dumps(scope, sort_keys=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend or shared_backend()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, answer)
+
+    def key(self, question_key: str) -> str:
+        return "search:" + hashlib.sha256(f"{question_key}\0{self.scope}".encode('utf-8')).hexdigest()
+
+    def get(self, question_key: str) -> dict | None:
+        if self.ttl <= 0:
+            return None
+        key = self.key(question_key)
+        if self.backend is not None:
+            stored = self.backend.get(key)
+            answer = json.loads(stored) if stored else None
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and time.time() - entry[0] >= self.ttl:
+                    del self._entries[key]
+                    entry = None
+                answer = entry[1] if entry else None
+        SEARCH_CACHE.inc(result="hit" if answer is not None else "miss")
+        return answer
+
+    def put(self, question_key: str, answer: dict):
+        if self.ttl <= 0:
+            return
+        key = self.key(question_key)
+        if self.backend is not None:
+            self.backend.set(key, json.dumps(answer), self.ttl)
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
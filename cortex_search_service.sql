@@ -1,23 +1,32 @@
 USE DASH_DB.DASH_SCHEMA;
 USE WAREHOUSE DASH_S;
 
-create or replace table parse_pdfs as 
-select relative_path, SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@DASH_DB.DASH_SCHEMA.DASH_PDFS,relative_path,{'mode':'LAYOUT'}) as data
-    from directory(@DASH_DB.DASH_SCHEMA.DASH_PDFS);
+-- Chunks of the PDFs in @DASH_PDFS. Filled and kept up to date incrementally by ingest_pdfs.py, which
+-- parses only new or changed files (tracked in PDF_MANIFEST) instead of rebuilding everything.
+create table if not exists parsed_pdfs (
+    PAGE_CONTENT VARCHAR,
+    TITLE VARCHAR,
+    INPUT_STAGE VARCHAR,
+    RELATIVE_PATH VARCHAR,
+    CHUNK_INDEX NUMBER
+);
+-- Tables built by the old full rebuild lack CHUNK_INDEX; their rows are replaced on the first ingest run
+alter table parsed_pdfs add column if not exists CHUNK_INDEX NUMBER;
 
-create or replace table parsed_pdfs as (
-    with tmp_parsed as (select
-        relative_path,
-        SNOWFLAKE.CORTEX.SPLIT_TEXT_RECURSIVE_CHARACTER(TO_VARIANT(data):content, 'MARKDOWN', 1800, 300) AS chunks
-    from parse_pdfs where TO_VARIANT(data):content is not null)
-    select
-        TO_VARCHAR(c.value) as PAGE_CONTENT,
-        REGEXP_REPLACE(relative_path, '\\.pdf$', '') as TITLE,
-        'DASH_DB.DASH_SCHEMA.DASH_PDFS' as INPUT_STAGE,
-        RELATIVE_PATH as RELATIVE_PATH
-    from tmp_parsed p, lateral FLATTEN(INPUT => p.chunks) c
+-- What ingest_pdfs.py has processed: a file is re-ingested when its size or etag changes
+create table if not exists pdf_manifest (
+    RELATIVE_PATH VARCHAR PRIMARY KEY,
+    SIZE NUMBER,
+    ETAG VARCHAR,
+    CHUNKS NUMBER,
+    PROCESSED_AT TIMESTAMP_LTZ
 );
 
+-- The directory table must be enabled for ingest_pdfs.py to diff the stage
+alter stage DASH_DB.DASH_SCHEMA.DASH_PDFS set directory = (enable = true);
+
+-- Then run: python ingest_pdfs.py
+
 create or replace CORTEX SEARCH SERVICE DASH_DB.DASH_SCHEMA.VEHICLES_INFO
 ON PAGE_CONTENT
 WAREHOUSE = DASH_S
@@ -25,4 +34,4 @@ TARGET_LAG = '1 hour'
 AS (
     SELECT '' AS PAGE_URL, PAGE_CONTENT, TITLE, RELATIVE_PATH
     FROM parsed_pdfs
-);
\ No newline at end of file
+);
@@ -0,0 +1,193 @@
+# Per-question deadlines and cooperative cancellation.
+# A Deadline is shared by every stage of one answer (agent calls, SQL, rendering). Stages register
+# cancel hooks (close the HTTP stream, cancel the warehouse query) that fire on expiry or on cancel().
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+QUESTION_TIMEOUT = float(os.getenv("QUESTION_TIMEOUT", "180"))
+# How often a worker checks the shared backend for cancels of its questions published by other workers
+IN_FLIGHT_POLL_SECONDS = float(os.getenv("IN_FLIGHT_POLL_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionCancelled(Exception):
+    """Raised inside a stage once its question has been cancelled."""
+
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class DeadlineExceeded(QuestionCancelled):
+    """Raised inside a stage once its question ran past its deadline."""
+
+
+class Deadline:
+    """Time budget and cancellation token for a single question."""
+
+    def __init__(self, seconds: float = None):
+        self.seconds = QUESTION_TIMEOUT if seconds is None else seconds
+        self.expires_at = time.monotonic() + self.seconds
+        self.reason = None
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._event = threading.Event()
+        self._timer = None
+        if self.seconds != float("inf"):
+            # Fires cancel hooks even while a stage is blocked in I/O and not checking
+            self._timer = threading.Timer(self.seconds, self.cancel, args=("deadline",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @classmethod
+    def unbounded(cls) -> "Deadline":
+        """A deadline that never expires but can still be cancelled."""
+        return cls(float("inf"))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, cap: float = None, floor: float = 0.1) -> float:
+        """Seconds a blocking call may wait: the remaining budget, optionally capped."""
+        remaining = self.remaining()
+        if cap is not None:
+            remaining = min(remaining, cap)
+        return max(floor, remaining)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            hooks = list(self._hooks)
+        self._event.set()
+        self.close()
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                pass
+
+    def check(self):
+        """Raise if the question has been cancelled or has run out of time."""
+        if self.reason is None and time.monotonic() >= self.expires_at:
+            self.cancel("deadline")
+        if self.reason == "deadline":
+            raise DeadlineExceeded(f"Timed out after {self.seconds:.0f}s")
+        if self.reason is not None:
+            raise QuestionCancelled(self.reason)
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep up to seconds (never past the deadline), waking early on cancel. Returns True if cancelled."""
+        return self._event.wait(min(seconds, self.remaining()))
+
+    @contextmanager
+    def on_cancel(self, hook):
+        """Run hook() if the question is cancelled while the block is executing."""
+        with self._lock:
+            already = self.reason is not None
+            if not already:
+                self._hooks.append(hook)
+        if already:
+            hook()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if hook in self._hooks:
+                    self._hooks.remove(hook)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class InFlightRegistry:
+    """
+    Tracks the in-flight question per key (user) so a new message or Cancel button can abort it.
+    With a shared_state backend this works across worker processes: each question publishes a token under
+    in_flight:<key>, and a worker cancels its own question once another takes the key over (a newer
+    question) or a cancel:<token> is published (the Cancel button, clicked on any worker).
+    """
+
+    def __init__(self, backend=None, poll: float = IN_FLIGHT_POLL_SECONDS):
+        self.backend = backend
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._deadlines = {}  # key -> (deadline, token)
+        self._watcher = None
+
+    def start(self, key, seconds: float = None) -> Deadline:
+        deadline = Deadline(seconds)
+        token = uuid.uuid4().hex
+        with self._lock:
+            previous = self._deadlines.get(key)
+            self._deadlines[key] = (deadline, token)
+        if previous is not None:
+            previous[0].cancel("superseded by a newer question")
+        if self.backend is not None:
+            ttl = None if deadline.seconds == float("inf") else deadline.seconds + 60
+            self._shared(self.backend.set, f"in_flight:{key}", token, ttl)
+            self._watch()
+        return deadline
+
+    def cancel(self, key, reason: str = "cancelled by user") -> bool:
+        with self._lock:
+            entry = self._deadlines.pop(key, None)
+        if entry is not None:
+            entry[0].cancel(reason)
+        token = self._shared(self.backend.get, f"in_flight:{key}") if self.backend is not None else None
+        if token:
+            # Whichever worker runs the question sees this on its next poll
+            self._shared(self.backend.set, f"cancel:{token}", reason, QUESTION_TIMEOUT + 60)
+        return entry is not None or bool(token)
+
+    def finish(self, key, deadline: Deadline):
+        deadline.close()
+        with self._lock:
+            entry = self._deadlines.get(key)
+            if entry is not None and entry[0] is deadline:
+                del self._deadlines[key]
+            else:
+                entry = None
+        if entry is not None and self.backend is not None and self._shared(self.backend.get, f"in_flight:{key}") == entry[1]:
+            self._shared(self.backend.delete, f"in_flight:{key}")
+
+    def _shared(self, method, *args):
+        # The question still runs, and cancels locally, if the backend is unreachable
+        try:
+            return method(*args)
+        except Exception as e:
+            logger.warning("In-flight registry: shared state unavailable: %s", e)
+            return None
+
+    def _watch(self):
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._poll, name="in-flight-watcher", daemon=True)
+                self._watcher.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll)
+            with self._lock:
+                entries = list(self._deadlines.items())
+            for key, (deadline, token) in entries:
+                reason = self._shared(self.backend.get, f"cancel:{token}")
+                current = self._shared(self.backend.get, f"in_flight:{key}")
+                if not reason and current is not None and current != token:
+                    reason = "superseded by a newer question"
+                if reason:
+                    with self._lock:
+                        if self._deadlines.get(key, (None,))[0] is deadline:
+                            del self._deadlines[key]
+                    deadline.cancel(reason)
@@ -0,0 +1,123 @@
+# Result exports for analysts: CSV, gzip/zstd-compressed CSV and Parquet, written straight from the
+# (memory-mapped) Arrow result rather than through pandas. Picked with a button on the answer, or with a
+# keyword in the question ("... as parquet", "zstd"); the serialization time and upload size of every
+# export are recorded in metrics and telemetry.
+import os
+import re
+import tempfile
+import time
+from typing import NamedTuple
+
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet
+
+import slack_gateway
+import tracing
+from metrics import REGISTRY
+
+# Format used when a result is too big for the message and the question named none
+EXPORT_DEFAULT_FORMAT = os.getenv("EXPORT_DEFAULT_FORMAT", "csv")
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+EXPORT_BYTES = REGISTRY.histogram("gboagent_export_bytes", "Size of uploaded result exports.", ("format",),
+                                  buckets=(1e4, 1e5, 1e6, 1e7, 5e7, 1e8, 5e8, 1e9))
+EXPORT_SECONDS = REGISTRY.histogram("gboagent_export_serialize_seconds", "Time to serialize a result export.", ("format",))
+
+# format -> (file extension, button label, CSV compression codec)
+FORMATS = {
+    "csv": (".csv", "CSV", None),
+    "csv.gz": (".csv.gz", "CSV (gzip)", "gzip"),
+    "csv.zst": (".csv.zst", "CSV (zstd)", "zstd"),
+    "parquet": (".parquet", "Parquet", None),
+}
+
+# Checked in order, so "zstd csv" picks zstd rather than plain CSV
+_KEYWORDS = (
+    (re.compile(r"\bparquet\b", re.I), "parquet"),
+    (re.compile(r"\b(zstd|zst)\b", re.I), "csv.zst"),
+    (re.compile(r"\b(gzip|gzipped|gz)\b", re.I), "csv.gz"),
+    (re.compile(r"\b(as|in|to) csv\b", re.I), "csv"),
+)
+
+
+class Export(NamedTuple):
+    path: str
+    filename: str
+    format: str
+    rows: int
+    bytes: int
+    seconds: float
+
+
+def requested_format(text: str) -> str | None:
+    """Export format named in a question, if any."""
+    for pattern, fmt in _KEYWORDS:
+        if pattern.search(text or ""):
+            return fmt
+    return None
+
+
+def export_actions(result_handle: str) -> dict:
+    """A button per export format; each carries the result's handle."""
+    return {"type": "actions", "elements": [
+        {"type": "button", "text": {"type": "plain_text", "text": f"📥 {label}"}, "value": result_handle,
+         "action_id": f"export_{fmt.replace('.', '_')}"}
+        for fmt, (_, label, _) in FORMATS.items()
+    ]}
+
+
+def format_for_action(action_id: str) -> str:
+    return action_id.removeprefix("export_").replace("_", ".")
+
+
+def to_table(df) -> pa.Table:
+    return df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_export(table: pa.Table, fmt: str, directory: str = None) -> Export:
+    """Serialize table to a temporary file in fmt; the caller removes the file."""
+    extension, _, codec = FORMATS[fmt]
+    fd, path = tempfile.mkstemp(suffix=extension, dir=directory)
+    os.close(fd)
+    started = time.perf_counter()
+    try:
+        with tracing.span("export.serialize", format=fmt, rows=table.num_rows):
+            if fmt == "parquet":
+                pa.parquet.write_table(table, path, compression=EXPORT_PARQUET_COMPRESSION)
+            else:
+                with pa.OSFile(path, "wb") as raw:
+                    stream = pa.CompressedOutputStream(raw, codec) if codec else raw
+                    # Writes batch by batch; the whole CSV is never held in memory
+                    pa.csv.write_csv(table, stream)
+                    if codec:
+                        stream.close()
+    except BaseException:
+        os.remove(path)
+        raise
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(path)
+    EXPORT_SECONDS.observe(seconds, format=fmt)
+    EXPORT_BYTES.observe(size, format=fmt)
+    return Export(path, f"data_{int(time.time())}{extension}", fmt, table.num_rows, size, seconds)
+
+
+def upload(client, export: Export, channel_id: str, thread_ts: str = None, sink=None, **fields):
+    """Upload a written export to the channel (or thread), remove the file and record it in sink."""
+    try:
+        started = time.perf_counter()
+        slack_gateway.call(client, "files_upload_v2", channel=channel_id, thread_ts=thread_ts, file=export.path, filename=export.filename,
+                           title=f"Requested Data ({FORMATS[export.format][1]})", initial_comment="Here is the complete data set:")
+        upload_seconds = time.perf_counter() - started
+    finally:
+        os.remove(export.path)
+    if sink is not None:
+        sink.record("export", channel_id=channel_id, row_count=export.rows, export_format=export.format, export_bytes=export.bytes,
+                    export_seconds=export.seconds, total_seconds=export.seconds + upload_seconds, **fields)
+
+
+def send(client, table: pa.Table, fmt: str, channel_id: str, thread_ts: str = None, sink=None, **fields) -> Export:
+    """Serialize and upload an export in one go."""
+    export = write_export(table, fmt)
+    upload(client, export, channel_id, thread_ts, sink, **fields)
+    return export
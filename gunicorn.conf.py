@@ -0,0 +1,31 @@
+# gunicorn settings for http_app.py: gunicorn -c gunicorn.conf.py http_app:flask_app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '3000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+# Each worker takes its share of WAREHOUSE_CONCURRENCY (admission.py)
+os.environ.setdefault("WAREHOUSE_PROCESSES", str(workers))
+# Requests return as soon as Bolt acks, so a few threads per worker cover the HTTP side;
+# the answers themselves run on Bolt's listener threads
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))
+timeout = int(os.getenv("WEB_TIMEOUT", "30"))
+# Not preloaded: each worker runs init() itself rather than sharing a forked Snowflake connection
+preload_app = False
+
+
+def post_fork(server, worker):
+    # Workers can't share METRICS_PORT, so each takes the first free port above it
+    base_port = int(os.getenv("METRICS_PORT", "0") or 0)
+    if not base_port:
+        return
+    import metrics
+
+    for port in range(base_port + 1, base_port + 1 + workers * 2):
+        try:
+            metrics.start_http_server(port)
+            server.log.info("Worker %s serving metrics on port %d", worker.pid, port)
+            return
+        except OSError:
+            continue
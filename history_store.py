@@ -0,0 +1,139 @@
+# Bounded, persistent per-user query history.
+# SQLite holds compact entries (question, SQL, summary, result handle) indexed by (user_id, id);
+# a bounded LRU of per-user ring buffers keeps the most active users' recent entries in memory.
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from shared_state import shared_backend
+
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "history.sqlite3")
+HISTORY_PER_USER = int(os.getenv("HISTORY_PER_USER", "50"))
+HISTORY_CACHED_USERS = int(os.getenv("HISTORY_CACHED_USERS", "500"))
+HISTORY_SUMMARY_CHARS = int(os.getenv("HISTORY_SUMMARY_CHARS", "500"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    query TEXT NOT NULL,
+    sql TEXT,
+    summary TEXT,
+    result_handle TEXT
+);
+CREATE INDEX IF NOT EXISTS history_user_id ON history (user_id, id DESC);
+"""
+
+_COLUMNS = ("id", "timestamp", "query", "sql", "summary", "result_handle")
+
+
+class HistoryStore:
+    def __init__(self, db_path: str = HISTORY_DB_PATH, per_user: int = HISTORY_PER_USER, cached_users: int = HISTORY_CACHED_USERS):
+        self.per_user = per_user
+        self.cached_users = cached_users
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # user_id -> deque of entries, oldest first
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    @staticmethod
+    def compact(query: str, response: dict) -> dict:
+        """Reduce an agent response to what the history needs; DataFrames are never kept."""
+        response = response or {}
+        summary = response.get('text') or response.get('error') or ""
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'query': query,
+            'sql': response.get('sql'),
+            'summary': summary[:HISTORY_SUMMARY_CHARS],
+            'result_handle': response.get('result_handle'),
+        }
+
+    def _load(self, user_id: str) -> deque:
+        """Ring buffer for user_id, loaded via the (user_id, id) index on a miss. Caller holds the lock."""
+        entries = self._cache.get(user_id)
+        if entries is not None:
+            self._cache.move_to_end(user_id)
+            return entries
+        rows = self._db.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, self.per_user),
+        ).fetchall()
+        entries = deque((dict(zip(_COLUMNS, row)) for row in reversed(rows)), maxlen=self.per_user)
+        self._cache[user_id] = entries
+        while len(self._cache) > self.cached_users:
+            self._cache.popitem(last=False)
+        return entries
+
+    def add(self, user_id: str, query: str, response: dict) -> dict:
+        entry = self.compact(query, response)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO history (user_id, timestamp, query, sql, summary, result_handle) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, entry['timestamp'], entry['query'], entry['sql'], entry['summary'], entry['result_handle']),
+            )
+            entry['id'] = cursor.lastrowid
+            # Trim to the newest per_user rows; the index keeps this a range scan
+            self._db.execute(
+                "DELETE FROM history WHERE user_id = ? AND id <= "
+                "(SELECT id FROM history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (user_id, user_id, self.per_user),
+            )
+            self._db.commit()
+            entries = self._load(user_id)
+            if not entries or entries[-1]['id'] != entry['id']:
+                entries.append(entry)
+        return entry
+
+    def recent(self, user_id: str, limit: int = 10) -> list:
+        """Newest-first entries for user_id."""
+        with self._lock:
+            entries = self._load(user_id)
+            return [dict(e) for e in list(entries)[-limit:][::-1]]
+
+    def get(self, user_id: str, entry_id: int) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM history WHERE user_id = ? AND id = ?", (user_id, entry_id)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def clear(self, user_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
+            self._db.commit()
+            self._cache.pop(user_id, None)
+
+
+class SharedHistoryStore:
+    """The HistoryStore interface on a shared_state backend, for multi-worker deployments."""
+
+    def __init__(self, backend, per_user: int = HISTORY_PER_USER):
+        self.backend = backend
+        self.per_user = per_user
+
+    def add(self, user_id: str, query: str, response: dict) -> dict:
+        entry = HistoryStore.compact(query, response)
+        entry['id'] = self.backend.incr("history:seq")
+        self.backend.push(f"history:{user_id}", json.dumps(entry), self.per_user)
+        return entry
+
+    def recent(self, user_id: str, limit: int = 10) -> list:
+        return [json.loads(item) for item in self.backend.range(f"history:{user_id}", limit)]
+
+    def get(self, user_id: str, entry_id: int) -> dict | None:
+        return next((e for e in self.recent(user_id, self.per_user) if e['id'] == entry_id), None)
+
+    def clear(self, user_id: str):
+        self.backend.delete(f"history:{user_id}")
+
+
+def open_history_store():
+    """SharedHistoryStore when SHARED_STATE_URL is set, otherwise the local SQLite HistoryStore."""
+    backend = shared_backend()
+    return SharedHistoryStore(backend) if backend is not None else HistoryStore()
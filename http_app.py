@@ -0,0 +1,45 @@
+# HTTP entry point: serves app.py's handlers over Slack's Events API and Interactivity request URLs
+# instead of Socket Mode, so the bot can run as several worker processes behind a load balancer.
+# Point the request URLs in the Slack app config at this server (/slack/events, /slack/interactive and,
+# for the admin profile command, /slack/commands):
+#
+#   SLACK_SIGNING_SECRET=... SHARED_STATE_URL=redis://... gunicorn -c gunicorn.conf.py http_app:flask_app
+#
+# Bolt checks every request's X-Slack-Signature against SLACK_SIGNING_SECRET, acks with a 200 straight
+# away and runs the listener on its thread pool, so slow answers never trip Slack's 3 second timeout.
+# SHARED_STATE_URL is required with more than one worker: a user's messages and button clicks can land on
+# any worker, so held queries, history, dedupe and cancelling an in-flight question all go through it.
+import logging
+import sys
+
+from flask import Flask, request
+from slack_bolt.adapter.flask import SlackRequestHandler
+
+import app as bot
+import log_setup
+import profiler
+
+logger = logging.getLogger(__name__)
+
+if not bot.SLACK_SIGNING_SECRET:
+    sys.exit("Missing env var: SLACK_SIGNING_SECRET")
+
+log_setup.configure_logging()
+profiler.install_signal_handler()
+# Every server worker process imports this module, so each opens its own Snowflake connection
+bot.CONN, bot.CORTEX_APP = bot.init()
+
+handler = SlackRequestHandler(bot.app)
+flask_app = Flask(__name__)
+
+
+@flask_app.route("/slack/events", methods=["POST"])
+@flask_app.route("/slack/interactive", methods=["POST"])
+@flask_app.route("/slack/commands", methods=["POST"])
+def slack_events():
+    return handler.handle(request)
+
+
+@flask_app.route("/healthz", methods=["GET"])
+def healthz():
+    return {"status": "ok"}
@@ -0,0 +1,45 @@
+# Drops Slack event redeliveries before any expensive work starts.
+# Slack retries events it considers unacknowledged in time, reusing the same event_id (and the message's
+# client_msg_id). Seen keys are kept for a TTL in the shared state backend, or a local SQLite file when
+# none is configured, so neither a restart nor another worker re-answers a retry.
+import os
+
+from metrics import REGISTRY
+from shared_state import SQLiteStateBackend, shared_backend
+
+EVENT_DEDUPE_DB_PATH = os.getenv("EVENT_DEDUPE_DB_PATH", "seen_events.sqlite3")
+# Slack retries for up to about an hour, so keep keys a little longer than that
+EVENT_DEDUPE_TTL = float(os.getenv("EVENT_DEDUPE_TTL", "4200"))
+
+EVENTS_DROPPED = REGISTRY.counter("gboagent_slack_events_dropped_total", "Slack events dropped before processing.", ("reason",))
+
+
+class SeenEvents:
+    """TTL-bounded set of event keys on a shared_state backend."""
+
+    def __init__(self, backend=None, ttl: float = EVENT_DEDUPE_TTL):
+        self.ttl = ttl
+        self.backend = backend or shared_backend() or SQLiteStateBackend(EVENT_DEDUPE_DB_PATH)
+
+    def first_time(self, *keys) -> bool:
+        """Record keys as seen. Returns False if any of them was already seen within the TTL."""
+        first = True
+        for key in keys:
+            if key and not self.backend.add(f"seen:{key}", "1", self.ttl):
+                first = False
+        return first
+
+
+def event_keys(body: dict) -> tuple:
+    """Identity of a Slack event: its event_id and, for messages, the client_msg_id."""
+    event = body.get('event', {})
+    client_msg_id = event.get('client_msg_id')
+    return (body.get('event_id'), f"msg:{client_msg_id}" if client_msg_id else None)
+
+
+def is_retry(seen: SeenEvents, body: dict) -> bool:
+    """True (and counted) if this event was already accepted for processing."""
+    if seen.first_time(*event_keys(body)):
+        return False
+    EVENTS_DROPPED.inc(reason="duplicate")
+    return True
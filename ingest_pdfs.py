@@ -0,0 +1,214 @@
+# Incremental PDF ingestion for the Cortex Search service in cortex_search_service.sql.
+# Diffs the stage's directory table against PDF_MANIFEST (path, size, etag), then parses and chunks only
+# new or changed files, a batch at a time on several connections in parallel. Each batch MERGEs its
+# chunks into PARSED_PDFS, drops chunks the new version no longer has and records the files in the
+# manifest, in one transaction. Files gone from the stage have their chunks deleted. The search service
+# picks the changes up within its TARGET_LAG.
+#
+#   python ingest_pdfs.py [--dry-run] [--full] [--batch-size 10] [--parallelism 4]
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import snowflake.connector
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from dotenv import load_dotenv
+
+import log_setup
+
+load_dotenv(override=True)
+
+ACCOUNT, HOST, USER, ROLE, RSA_PRIVATE_KEY_PATH, RSA_PRIVATE_KEY_PASSWORD = (os.getenv(k) for k in ["ACCOUNT", "HOST", "USER", "ROLE", "RSA_PRIVATE_KEY_PATH", "RSA_PRIVATE_KEY_PASSWORD"])
+PDF_DATABASE = os.getenv("PDF_DATABASE", "DASH_DB")
+PDF_SCHEMA = os.getenv("PDF_SCHEMA", "DASH_SCHEMA")
+PDF_STAGE = os.getenv("PDF_STAGE", "DASH_DB.DASH_SCHEMA.DASH_PDFS")
+PDF_WAREHOUSE = os.getenv("PDF_WAREHOUSE", "DASH_S")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "10"))
+INGEST_PARALLELISM = int(os.getenv("INGEST_PARALLELISM", "4"))
+# SPLIT_TEXT_RECURSIVE_CHARACTER chunk size and overlap
+CHUNK_SIZE, CHUNK_OVERLAP = int(os.getenv("CHUNK_SIZE", "1800")), int(os.getenv("CHUNK_OVERLAP", "300"))
+
+logger = logging.getLogger(__name__)
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_$]*(\.[A-Za-z_][A-Za-z0-9_$]*){0,2}$")
+
+
+def connect():
+    with open(RSA_PRIVATE_KEY_PATH, "rb") as pem_in:
+        password = RSA_PRIVATE_KEY_PASSWORD.encode() if RSA_PRIVATE_KEY_PASSWORD else None
+        private_key_obj = load_pem_private_key(pem_in.read(), password=password, backend=default_backend())
+    return snowflake.connector.connect(user=USER, account=ACCOUNT, private_key=private_key_obj, warehouse=PDF_WAREHOUSE,
+                                       role=ROLE, host=HOST, database=PDF_DATABASE, schema=PDF_SCHEMA)
+
+
+def _placeholders(values) -> str:
+    return ", ".join(["%s"] * len(values))
+
+
+def list_stage(cursor, stage: str) -> dict:
+    """path -> (size, etag) for every file in the stage's directory table, refreshed first."""
+    cursor.execute(f"ALTER STAGE {stage} REFRESH")
+    cursor.execute(f"SELECT RELATIVE_PATH, SIZE, ETAG FROM DIRECTORY(@{stage}) WHERE RELATIVE_PATH ILIKE '%.pdf'")
+    return {path: (size, etag) for path, size, etag in cursor.fetchall()}
+
+
+def load_manifest(cursor) -> dict:
+    cursor.execute("SELECT RELATIVE_PATH, SIZE, ETAG FROM PDF_MANIFEST")
+    return {path: (size, etag) for path, size, etag in cursor.fetchall()}
+
+
+def diff(stage_files: dict, manifest: dict, full: bool = False) -> tuple:
+    """(new_or_changed, removed) paths. A file is changed when its size or etag differ from the manifest."""
+    changed = sorted(path for path, meta in stage_files.items() if full or manifest.get(path) != meta)
+    removed = sorted(path for path in manifest if path not in stage_files)
+    return changed, removed
+
+
+def delete_removed(cursor, paths: list):
+    for start in range(0, len(paths), 1000):
+        batch = paths[start:start + 1000]
+        cursor.execute("BEGIN")
+        cursor.execute(f"DELETE FROM PARSED_PDFS WHERE RELATIVE_PATH IN ({_placeholders(batch)})", batch)
+        cursor.execute(f"DELETE FROM PDF_MANIFEST WHERE RELATIVE_PATH IN ({_placeholders(batch)})", batch)
+        cursor.execute("COMMIT")
+
+
+def ingest_batch(conn, stage: str, batch: list, stage_files: dict) -> int:
+    """Parse, chunk and merge one batch of files. Returns the number of chunks written."""
+    cursor = conn.cursor()
+    try:
+        # Parse once into a session temp table; the MERGE, stale-chunk DELETE and manifest update all read it
+        cursor.execute(
+            f"""CREATE OR REPLACE TEMPORARY TABLE PDF_BATCH_CHUNKS AS
+            WITH parsed AS (
+                SELECT RELATIVE_PATH, SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@{stage}, RELATIVE_PATH, {{'mode': 'LAYOUT'}}) AS DATA
+                FROM DIRECTORY(@{stage}) WHERE RELATIVE_PATH IN ({_placeholders(batch)})
+            )
+            SELECT
+                p.RELATIVE_PATH,
+                c.INDEX AS CHUNK_INDEX,
+                TO_VARCHAR(c.VALUE) AS PAGE_CONTENT,
+                REGEXP_REPLACE(p.RELATIVE_PATH, '\\\\.pdf$', '') AS TITLE,
+                '{stage}' AS INPUT_STAGE
+            FROM parsed p,
+                LATERAL FLATTEN(INPUT => SNOWFLAKE.CORTEX.SPLIT_TEXT_RECURSIVE_CHARACTER(TO_VARIANT(p.DATA):content, 'MARKDOWN', %s, %s)) c
+            WHERE TO_VARIANT(p.DATA):content IS NOT NULL""",
+            batch + [CHUNK_SIZE, CHUNK_OVERLAP],
+        )
+        cursor.execute("BEGIN")
+        cursor.execute(
+            """MERGE INTO PARSED_PDFS t USING PDF_BATCH_CHUNKS s
+            ON t.RELATIVE_PATH = s.RELATIVE_PATH AND t.CHUNK_INDEX = s.CHUNK_INDEX
+            WHEN MATCHED AND t.PAGE_CONTENT IS DISTINCT FROM s.PAGE_CONTENT THEN
+                UPDATE SET PAGE_CONTENT = s.PAGE_CONTENT, TITLE = s.TITLE, INPUT_STAGE = s.INPUT_STAGE
+            WHEN NOT MATCHED THEN
+                INSERT (PAGE_CONTENT, TITLE, INPUT_STAGE, RELATIVE_PATH, CHUNK_INDEX)
+                VALUES (s.PAGE_CONTENT, s.TITLE, s.INPUT_STAGE, s.RELATIVE_PATH, s.CHUNK_INDEX)"""
+        )
+        # A changed file may now have fewer chunks (or none, if it failed to parse)
+        cursor.execute(
+            f"""DELETE FROM PARSED_PDFS t WHERE t.RELATIVE_PATH IN ({_placeholders(batch)})
+            AND NOT EXISTS (SELECT 1 FROM PDF_BATCH_CHUNKS s WHERE s.RELATIVE_PATH = t.RELATIVE_PATH AND s.CHUNK_INDEX = t.CHUNK_INDEX)""",
+            batch,
+        )
+        rows = [(path, stage_files[path][0], stage_files[path][1]) for path in batch]
+        cursor.execute(
+            f"""MERGE INTO PDF_MANIFEST t USING (
+                SELECT v.RELATIVE_PATH, v.SIZE, v.ETAG, COUNT(c.CHUNK_INDEX) AS CHUNKS
+                FROM (VALUES {", ".join(["(%s, %s, %s)"] * len(rows))}) AS v (RELATIVE_PATH, SIZE, ETAG)
+                LEFT JOIN PDF_BATCH_CHUNKS c ON c.RELATIVE_PATH = v.RELATIVE_PATH
+                GROUP BY v.RELATIVE_PATH, v.SIZE, v.ETAG
+            ) s ON t.RELATIVE_PATH = s.RELATIVE_PATH
+            WHEN MATCHED THEN UPDATE SET SIZE = s.SIZE, ETAG = s.ETAG, CHUNKS = s.CHUNKS, PROCESSED_AT = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT (RELATIVE_PATH, SIZE, ETAG, CHUNKS, PROCESSED_AT)
+                VALUES (s.RELATIVE_PATH, s.SIZE, s.ETAG, s.CHUNKS, CURRENT_TIMESTAMP())""",
+            [value for row in rows for value in row],
+        )
+        cursor.execute("COMMIT")
+        cursor.execute("SELECT COUNT(*) FROM PDF_BATCH_CHUNKS")
+        return cursor.fetchone()[0]
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.close()
+
+
+def run(stage: str = PDF_STAGE, batch_size: int = INGEST_BATCH_SIZE, parallelism: int = INGEST_PARALLELISM,
+        full: bool = False, dry_run: bool = False) -> dict:
+    if not _IDENTIFIER.match(stage):
+        raise ValueError(f"Invalid stage name: {stage!r}")
+    started = time.perf_counter()
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        stage_files = list_stage(cursor, stage)
+        changed, removed = diff(stage_files, load_manifest(cursor), full)
+        logger.info("%d files in %s: %d new or changed, %d removed", len(stage_files), stage, len(changed), len(removed))
+        report = {"files": len(stage_files), "changed": len(changed), "removed": len(removed), "ingested": 0,
+                  "failed": 0, "chunks": 0, "bytes": 0}
+        if dry_run:
+            for path in changed:
+                logger.info("would ingest %s", path)
+            for path in removed:
+                logger.info("would remove %s", path)
+            return report
+        delete_removed(cursor, removed)
+        cursor.close()
+    finally:
+        conn.close()
+
+    batches = [changed[i:i + batch_size] for i in range(0, len(changed), batch_size)]
+    # One connection (so one session and one transaction) per batch worker
+    connections = [connect() for _ in range(min(parallelism, len(batches)))]
+    free = list(connections)
+    try:
+        with ThreadPoolExecutor(max_workers=len(connections) or 1) as pool:
+            def work(batch):
+                conn = free.pop()
+                try:
+                    return ingest_batch(conn, stage, batch, stage_files)
+                finally:
+                    free.append(conn)
+
+            futures = {pool.submit(work, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    report["chunks"] += future.result()
+                    report["ingested"] += len(batch)
+                    report["bytes"] += sum(stage_files[path][0] or 0 for path in batch)
+                except Exception as e:
+                    # The batch rolled back and stays out of the manifest, so the next run retries it
+                    report["failed"] += len(batch)
+                    logger.error("Batch of %d files failed (%s...): %s", len(batch), batch[0], e)
+    finally:
+        for conn in connections:
+            conn.close()
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 1)
+    report["files_per_second"] = round(report["ingested"] / elapsed, 3) if elapsed else 0.0
+    report["mb_per_second"] = round(report["bytes"] / 1e6 / elapsed, 3) if elapsed else 0.0
+    logger.info("Ingested %d files (%d chunks, %.1f MB) in %.1fs: %.3f files/s, %.3f MB/s; %d removed, %d failed",
+                report["ingested"], report["chunks"], report["bytes"] / 1e6, elapsed, report["files_per_second"],
+                report["mb_per_second"], report["removed"], report["failed"])
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally parse and chunk new or changed PDFs for Cortex Search.")
+    parser.add_argument("--stage", default=PDF_STAGE)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--parallelism", type=int, default=INGEST_PARALLELISM)
+    parser.add_argument("--full", action="store_true", help="re-ingest every file, ignoring the manifest")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    args = parser.parse_args()
+    log_setup.configure_logging()
+    result = run(args.stage, args.batch_size, args.parallelism, args.full, args.dry_run)
+    sys.exit(1 if result["failed"] else 0)
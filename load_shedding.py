@@ -0,0 +1,116 @@
+# Degraded mode under load. Warehouse queue depth, recent query latency and the query error rate each map
+# to a level; the highest wins. Each level drops one more piece of work than the last:
+#   1 no charts, 2 no summary call (the agent's interpretation is the answer), 3 shorter table previews,
+#   4 new questions are refused with a "try again" message.
+# Levels rise as soon as pressure does, and step back down one at a time once pressure has stayed lower
+# for SHED_COOLDOWN seconds, so a brief dip doesn't flap the bot between modes.
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+
+from metrics import REGISTRY
+
+NORMAL, NO_CHARTS, NO_SUMMARY, CAP_ROWS, REFUSE = range(5)
+LEVEL_NAMES = {NORMAL: "normal", NO_CHARTS: "no_charts", NO_SUMMARY: "no_summary", CAP_ROWS: "cap_rows", REFUSE: "refuse"}
+
+
+def _thresholds(name: str, default: str) -> tuple:
+    """Four ascending values: the signal level at which levels 1-4 start."""
+    return tuple(sorted(float(v) for v in os.getenv(name, default).split(",") if v.strip()))
+
+
+# Queries waiting for a warehouse slot
+SHED_QUEUE_DEPTH = _thresholds("SHED_QUEUE_DEPTH", "8,16,24,40")
+# 90th percentile warehouse query seconds over the window
+SHED_QUERY_SECONDS = _thresholds("SHED_QUERY_SECONDS", "30,60,90,150")
+# Share of warehouse queries that failed over the window
+SHED_ERROR_RATE = _thresholds("SHED_ERROR_RATE", "0.2,0.35,0.5,0.75")
+SHED_WINDOW = float(os.getenv("SHED_WINDOW", "120"))
+# Latency and error rate need this many queries in the window to count
+SHED_MIN_SAMPLES = int(os.getenv("SHED_MIN_SAMPLES", "5"))
+SHED_COOLDOWN = float(os.getenv("SHED_COOLDOWN", "60"))
+# Table preview rows at CAP_ROWS and above
+SHED_PREVIEW_ROWS = int(os.getenv("SHED_PREVIEW_ROWS", "20"))
+# Pin the level, e.g. "2" to try out the no-summary mode; empty for automatic
+SHED_FORCE_LEVEL = os.getenv("SHED_FORCE_LEVEL", "")
+
+LEVEL = REGISTRY.gauge("gboagent_degraded_level", "Current load-shedding level (0 normal ... 4 refusing questions).")
+TRANSITIONS = REGISTRY.counter("gboagent_degraded_transitions_total", "Load-shedding level changes, by the level entered.", ("level",))
+SHED = REGISTRY.counter("gboagent_shed_total", "Work skipped by load shedding, by kind.", ("action",))
+
+REFUSAL_MESSAGE = "I'm under heavy load right now and can't take new questions. Please try again in a few minutes."
+
+
+class LoadShedder:
+    def __init__(self, scheduler=None, window: float = SHED_WINDOW, cooldown: float = SHED_COOLDOWN,
+                 min_samples: int = SHED_MIN_SAMPLES):
+        self.scheduler = scheduler
+        self.window = window
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self.forced = int(SHED_FORCE_LEVEL) if SHED_FORCE_LEVEL.strip() else None
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=1000)  # (at, seconds, ok, timed_out)
+        self._level = NORMAL
+        self._calm_since = None  # when pressure first fell below the current level
+        LEVEL.set_function(self.level)
+
+    def record(self, seconds: float, ok: bool, timed_out: bool = False):
+        """One finished warehouse query; one cut off by the question deadline counts as failed, and as at least that slow."""
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds, ok, timed_out))
+
+    def pressure(self) -> dict:
+        with self._lock:
+            cutoff = time.monotonic() - self.window
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = list(self._samples)
+        latencies = sorted(seconds for _, seconds, ok, timed_out in samples if ok or timed_out)
+        errors = sum(1 for _, _, ok, _ in samples if not ok)
+        enough = len(samples) >= self.min_samples
+        return {
+            "queue_depth": self.scheduler.queue_depth() if self.scheduler is not None else 0,
+            "p90_seconds": latencies[int(len(latencies) * 0.9)] if enough and latencies else 0.0,
+            "error_rate": errors / len(samples) if enough else 0.0,
+            "samples": len(samples),
+        }
+
+    def target(self, pressure: dict) -> int:
+        """Level the current pressure calls for, before hysteresis."""
+        return min(REFUSE, max(bisect_right(SHED_QUEUE_DEPTH, pressure["queue_depth"]),
+                               bisect_right(SHED_QUERY_SECONDS, pressure["p90_seconds"]),
+                               bisect_right(SHED_ERROR_RATE, pressure["error_rate"])))
+
+    def level(self) -> int:
+        if self.forced is not None:
+            return self.forced
+        target = self.target(self.pressure())
+        with self._lock:
+            now = time.monotonic()
+            if target >= self._level:
+                self._calm_since = None
+                if target > self._level:
+                    self._set(target)
+            elif self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.cooldown:
+                self._set(self._level - 1)
+                self._calm_since = now
+            return self._level
+
+    def _set(self, level: int):
+        self._level = level
+        TRANSITIONS.inc(level=LEVEL_NAMES[level])
+
+    def sheds(self, level: int, action: str) -> bool:
+        """True (and counted) if work of kind action is dropped at the current level."""
+        if self.level() < level:
+            return False
+        SHED.inc(action=action)
+        return True
+
+    def preview_rows(self, default: int) -> int:
+        return min(default, SHED_PREVIEW_ROWS) if self.sheds(CAP_ROWS, "preview_rows") else default
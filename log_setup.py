@@ -0,0 +1,115 @@
+# Leveled logging for the bot: records are queued by the calling thread and formatted/written
+# by a background listener, so a slow stdout pipe never blocks a Slack handler.
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+from metrics import REGISTRY
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of DEBUG/INFO records kept (warnings and errors are never sampled out)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Maximum characters of any payload() rendered into a log line
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "2000"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+DROPPED_RECORDS = REGISTRY.counter("gboagent_log_records_dropped_total", "Log records dropped because the log queue was full or sampled out.", ("reason",))
+
+_listener = None
+
+
+def _default(obj):
+    # Never stringify whole frames into a log line
+    shape = getattr(obj, "shape", None)
+    if shape is not None:
+        return f"<{type(obj).__name__} shape={shape}>"
+    return str(obj)
+
+
+class payload:
+    """
+    Lazy log argument: serialises obj as compact JSON and truncates it, but only if the record is emitted.
+    Usage: logger.debug("Tool results: %s", payload(tool_results))
+    """
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj, limit: int = None):
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self) -> str:
+        limit = self.limit if self.limit is not None else LOG_MAX_PAYLOAD
+        if isinstance(self.obj, str):
+            text = self.obj
+        else:
+            try:
+                text = json.dumps(self.obj, default=_default, separators=(",", ":"))
+            except (TypeError, ValueError):
+                text = repr(self.obj)
+        if limit and len(text) > limit:
+            return f"{text[:limit]}...<{len(text) - limit} more chars>"
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random fraction of records below WARNING; WARNING and above always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        if random.random() < self.rate:
+            return True
+        DROPPED_RECORDS.inc(reason="sampled")
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers message formatting to the listener and drops (and counts) records when full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock implementation formats the whole message here, on the caller's thread. Only payload()
+        # arguments are rendered now: they usually wrap lists and dicts the caller goes on mutating, and the
+        # log line must show them as they were. Records that are filtered out never get this far.
+        if isinstance(record.args, tuple) and any(isinstance(arg, payload) for arg in record.args):
+            record.args = tuple(str(arg) if isinstance(arg, payload) else arg for arg in record.args)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_RECORDS.inc(reason="queue_full")
+
+
+def configure_logging(level: str = None, sample_rate: float = None, stream=None):
+    """Install the queue-backed root handler once per process. Safe to call repeatedly."""
+    global _listener
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE if sample_rate is None else sample_rate))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
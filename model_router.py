@@ -0,0 +1,121 @@
+# Per-stage model routing for the agent API calls.
+# Each stage (agent_1 writes the SQL, agent_2 summarises the result) has an ordered list of models; the
+# first is preferred, the rest are failovers. Rolling latency and error rates are kept per stage and model,
+# and a model that is failing, or slower than MODEL_LATENCY_SLO, drops behind the healthy ones until its
+# window clears. A request that times out or gets a 5xx/429 is retried on the next model.
+#   MODEL=claude-3-5-sonnet MODEL_SUMMARY=llama3.1-8b,claude-3-5-sonnet MODEL_FALLBACKS=mistral-large2
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from metrics import REGISTRY
+
+# Models for the summary call, in order of preference; defaults to MODEL
+MODEL_SUMMARY = os.getenv("MODEL_SUMMARY", "")
+# Tried after a stage's own models, for every stage
+MODEL_FALLBACKS = os.getenv("MODEL_FALLBACKS", "")
+MODEL_STATS_WINDOW = float(os.getenv("MODEL_STATS_WINDOW", "300"))
+MODEL_ERROR_THRESHOLD = float(os.getenv("MODEL_ERROR_THRESHOLD", "0.5"))
+MODEL_MIN_SAMPLES = int(os.getenv("MODEL_MIN_SAMPLES", "5"))
+# Median seconds to response headers above which a model counts as degraded; 0 turns the check off
+MODEL_LATENCY_SLO = float(os.getenv("MODEL_LATENCY_SLO", "0"))
+# Wait this long for a model's response headers before failing over to the next; the stream itself, and
+# the last candidate's headers, get AGENT_READ_TIMEOUT
+MODEL_FAILOVER_TIMEOUT = float(os.getenv("MODEL_FAILOVER_TIMEOUT", "20"))
+
+ROUTED = REGISTRY.counter("gboagent_model_requests_total", "Agent API requests by stage, model and routing decision.",
+                          ("stage", "model", "route"))
+ERRORS = REGISTRY.counter("gboagent_model_errors_total", "Failed agent API requests by stage, model and kind.",
+                          ("stage", "model", "kind"))
+LATENCY = REGISTRY.histogram("gboagent_model_latency_seconds", "Seconds to agent API response headers, per model.",
+                             ("stage", "model"))
+FAILOVER_SECONDS = REGISTRY.histogram("gboagent_model_failover_seconds", "Time spent on failed models before a request succeeded.",
+                                      ("stage",))
+
+PRIMARY, FAILOVER, REROUTED = "primary", "failover", "rerouted"
+
+
+def _models(value: str) -> list:
+    return [m.strip() for m in value.split(",") if m.strip()]
+
+
+def routes_from_env(model: str) -> dict:
+    """Stage -> models from MODEL, MODEL_SUMMARY and MODEL_FALLBACKS."""
+    fallbacks = _models(MODEL_FALLBACKS)
+    def chain(models):
+        return list(dict.fromkeys(models + fallbacks))
+    return {"agent_1": chain([model]), "agent_2": chain(_models(MODEL_SUMMARY) or [model])}
+
+
+class ModelStats:
+    """Outcomes of one model on one stage over the last window seconds."""
+
+    def __init__(self, window: float = MODEL_STATS_WINDOW, max_samples: int = 1000):
+        self.window = window
+        self._samples = deque(maxlen=max_samples)  # (at, seconds, ok)
+
+    def add(self, seconds: float, ok: bool):
+        self._samples.append((time.monotonic(), seconds, ok))
+
+    def _recent(self) -> list:
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return list(self._samples)
+
+    def snapshot(self) -> dict:
+        samples = self._recent()
+        latencies = sorted(seconds for _, seconds, ok in samples if ok)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return {"samples": len(samples), "error_rate": errors / len(samples) if samples else 0.0,
+                "median_seconds": latencies[len(latencies) // 2] if latencies else None}
+
+
+class ModelRouter:
+    def __init__(self, routes: dict, window: float = MODEL_STATS_WINDOW, error_threshold: float = MODEL_ERROR_THRESHOLD,
+                 min_samples: int = MODEL_MIN_SAMPLES, latency_slo: float = MODEL_LATENCY_SLO):
+        self.routes = routes
+        self.window = window
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        self.latency_slo = latency_slo
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: ModelStats(self.window))  # (stage, model) -> ModelStats
+
+    def degraded(self, stage: str, model: str) -> bool:
+        with self._lock:
+            stats = self._stats[(stage, model)].snapshot()
+        if stats["samples"] < self.min_samples:
+            return False
+        if stats["error_rate"] > self.error_threshold:
+            return True
+        return bool(self.latency_slo and stats["median_seconds"] and stats["median_seconds"] > self.latency_slo)
+
+    def candidates(self, stage: str) -> list:
+        """Models to try for stage, in order: healthy ones in configured order, then degraded ones."""
+        models = self.routes.get(stage) or self.routes.get("agent_1")
+        healthy = [m for m in models if not self.degraded(stage, m)]
+        return healthy + [m for m in models if m not in healthy]
+
+    def routed(self, stage: str, model: str, attempt: int):
+        """Count which model served a request and why."""
+        if attempt:
+            route = FAILOVER
+        elif model != (self.routes.get(stage) or self.routes.get("agent_1"))[0]:
+            route = REROUTED
+        else:
+            route = PRIMARY
+        ROUTED.inc(stage=stage, model=model, route=route)
+
+    def record(self, stage: str, model: str, seconds: float, ok: bool, kind: str = None):
+        with self._lock:
+            self._stats[(stage, model)].add(seconds, ok)
+        if ok:
+            LATENCY.observe(seconds, stage=stage, model=model)
+        else:
+            ERRORS.inc(stage=stage, model=model, kind=kind or "error")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {f"{stage}/{model}": stats.snapshot() for (stage, model), stats in self._stats.items()}
@@ -0,0 +1,162 @@
+# Small DAG executor for the work that follows a query: table preview, chart render, export serialization
+# and their uploads. Stages whose dependencies are done run concurrently on a shared pool, so an answer's
+# tail latency is its longest chain rather than the sum of every stage. Each stage posts its own artifact
+# when it finishes; a stage that fails or overruns its timeout is recorded and its dependents skipped,
+# without holding up the others. A stage whose value holds a resource (e.g. a temp file) can name a cleanup
+# for values nothing will use: a result that arrives after its timeout, or one whose dependents were skipped.
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, NamedTuple
+
+import tracing
+from metrics import REGISTRY
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "16"))
+PIPELINE_STAGE_TIMEOUT = float(os.getenv("PIPELINE_STAGE_TIMEOUT", "60"))
+
+logger = logging.getLogger(__name__)
+
+STAGES = REGISTRY.counter("gboagent_pipeline_stages_total", "Post-query pipeline stages by outcome.", ("stage", "status"))
+
+OK, FAILED, TIMED_OUT, SKIPPED = "ok", "failed", "timeout", "skipped"
+
+
+class StageResult(NamedTuple):
+    status: str
+    value: Any = None
+    error: BaseException | None = None
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == OK
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _shared_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(PIPELINE_WORKERS, thread_name_prefix="pipeline")
+        return _executor
+
+
+class Pipeline:
+    def __init__(self, name: str = "pipeline", executor: ThreadPoolExecutor = None):
+        self.name = name
+        self.executor = executor or _shared_executor()
+        self.results = {}  # stage -> StageResult, filled in as stages finish
+        self._stages = {}  # stage -> (fn, after, timeout)
+        self._cleanups = {}  # stage -> cleanup(value)
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add(self, name: str, fn, after: tuple = (), timeout: float = PIPELINE_STAGE_TIMEOUT, cleanup=None) -> "Pipeline":
+        """
+        Add a stage; fn(inputs) gets the values of the stages named in after, by name. cleanup(value), if
+        given, disposes of a value of this stage that is discarded.
+        """
+        unknown = [dep for dep in after if dep not in self._stages]
+        if unknown:
+            raise ValueError(f"Stage {name!r} depends on unknown stages {unknown}")
+        self._stages[name] = (fn, tuple(after), timeout)
+        if cleanup is not None:
+            self._cleanups[name] = cleanup
+        return self
+
+    def start(self, deadline=None) -> "Pipeline":
+        """Run the stages in the background; returns immediately."""
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._run, deadline), name=f"{self.name}-dag", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self, deadline=None, timeout: float = None) -> dict:
+        """Run the stages and wait for all of them."""
+        return self.start(deadline).wait(timeout)
+
+    def wait(self, timeout: float = None) -> dict:
+        """Wait until every stage has a result (or timeout passes) and return the results so far."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.results) == len(self._stages), timeout)
+            return dict(self.results)
+
+    def result(self, name: str, timeout: float = None) -> StageResult | None:
+        """Wait for one stage; None if it hasn't finished within timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: name in self.results, timeout)
+            return self.results.get(name)
+
+    def _finish(self, name: str, result: StageResult):
+        STAGES.inc(stage=name, status=result.status)
+        if result.status in (FAILED, TIMED_OUT):
+            logger.warning("%s stage %s %s after %.2fs: %s", self.name, name, result.status, result.seconds, result.error)
+        with self._cond:
+            self.results[name] = result
+            self._cond.notify_all()
+
+    def _discard(self, name: str, value):
+        try:
+            self._cleanups[name](value)
+        except Exception as e:
+            logger.warning("%s stage %s cleanup failed: %s", self.name, name, e)
+
+    def _discard_late(self, name: str, future):
+        # The stage overran its timeout; whatever it eventually returns is thrown away
+        if not future.cancelled() and future.exception() is None:
+            self._discard(name, future.result())
+
+    def _discard_unused(self):
+        # A finished value that every dependent skipped was never handed on
+        for name in self._cleanups:
+            dependents = [stage for stage, (_, after, _) in self._stages.items() if name in after]
+            if self.results[name].ok and dependents and all(self.results[stage].status == SKIPPED for stage in dependents):
+                self._discard(name, self.results[name].value)
+
+    def _call(self, name: str, fn, inputs: dict):
+        with tracing.span(f"{self.name}.{name}"):
+            return fn(inputs)
+
+    def _run(self, deadline):
+        waiting = dict(self._stages)
+        running = {}  # future -> (name, started, timeout)
+        while waiting or running:
+            for name, (fn, after, timeout) in list(waiting.items()):
+                if deadline is not None and deadline.cancelled:
+                    self._finish(name, StageResult(SKIPPED, error=RuntimeError(f"question {deadline.reason}")))
+                elif any(dep in self.results and not self.results[dep].ok for dep in after):
+                    self._finish(name, StageResult(SKIPPED, error=RuntimeError("a stage it depends on did not complete")))
+                elif all(dep in self.results for dep in after):
+                    inputs = {dep: self.results[dep].value for dep in after}
+                    future = self.executor.submit(contextvars.copy_context().run, self._call, name, fn, inputs)
+                    running[future] = (name, time.monotonic(), timeout)
+                else:
+                    continue
+                del waiting[name]
+            if not running:
+                continue
+            now = time.monotonic()
+            next_timeout = min(started + timeout for _, started, timeout in running.values()) - now
+            done, _ = wait(running, timeout=max(0.0, next_timeout), return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future, (name, started, timeout) in list(running.items()):
+                if future in done:
+                    error = future.exception()
+                    result = StageResult(FAILED, error=error) if error else StageResult(OK, value=future.result())
+                elif now - started >= timeout:
+                    # The thread can't be stopped; its eventual result is discarded
+                    if not future.cancel() and name in self._cleanups:
+                        future.add_done_callback(lambda late, name=name: self._discard_late(name, late))
+                    result = StageResult(TIMED_OUT, error=TimeoutError(f"exceeded {timeout:g}s"))
+                else:
+                    continue
+                del running[future]
+                self._finish(name, result._replace(seconds=now - started))
+        self._discard_unused()
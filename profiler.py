@@ -0,0 +1,148 @@
+# On-demand diagnostics for a running bot: a sampling CPU profile, a tracemalloc allocation diff and the
+# live thread stacks, captured over a window and returned as text files. Nothing runs until a capture is
+# triggered (admin Slack command or PROFILE_SIGNAL), and tracemalloc is switched off again afterwards, so
+# an idle bot pays nothing for it.
+#   /gboagent-profile 60   -> files posted to the channel (ADMIN_USER_IDS only)
+#   kill -USR2 <pid>       -> files written to PROFILE_DIR
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from datetime import datetime
+
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SIGNAL = os.getenv("PROFILE_SIGNAL", "SIGUSR2")
+PROFILE_COMMAND = os.getenv("PROFILE_COMMAND", "/gboagent-profile")
+# Slack user IDs allowed to run the profile command
+ADMIN_USER_IDS = {u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
+
+logger = logging.getLogger(__name__)
+
+_capture_lock = threading.Lock()
+
+
+class CaptureBusy(Exception):
+    pass
+
+
+def is_admin(user_id: str) -> bool:
+    return user_id in ADMIN_USER_IDS
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def thread_stacks() -> str:
+    """Every live thread's current stack, named."""
+    names = {t.ident: t.name for t in threading.enumerate()}
+    out = []
+    for ident, frame in sys._current_frames().items():
+        out.append(f"--- Thread {names.get(ident, '?')} ({ident}) ---\n")
+        out.extend(traceback.format_stack(frame))
+        out.append("\n")
+    return "".join(out)
+
+
+def sample_cpu(seconds: float, interval: float = PROFILE_INTERVAL) -> tuple:
+    """
+    Sample every other thread's stack each interval for seconds.
+    Returns (folded stacks for flamegraph tools, a top-functions report).
+    """
+    me = threading.get_ident()
+    stacks = collections.Counter()
+    own = collections.Counter()  # innermost frame: where time is actually spent
+    samples = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                own[labels[0]] += 1
+                stacks[";".join(reversed(labels))] += 1
+        samples += 1
+        time.sleep(interval)
+    folded = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    total = sum(own.values()) or 1
+    report = [f"{samples} samples every {interval * 1000:.0f}ms over {seconds:.0f}s (idle threads included)\n\n",
+              f"{'samples':>8} {'share':>7}  innermost frame\n"]
+    report.extend(f"{count:>8} {count / total:>7.1%}  {label}\n" for label, count in own.most_common(50))
+    return folded, "".join(report)
+
+
+def capture(seconds: float = PROFILE_SECONDS) -> dict:
+    """Run a full capture; returns {filename: text}. Raises CaptureBusy if one is already running."""
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    if not _capture_lock.acquire(blocking=False):
+        raise CaptureBusy("A profile is already being captured")
+    try:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(25)
+        try:
+            before = tracemalloc.take_snapshot()
+            folded, top = sample_cpu(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+        diff = after.compare_to(before, "lineno")
+        memory = [f"Allocation growth over {seconds:.0f}s (top 50 lines)\n\n"]
+        memory.extend(f"{stat}\n" for stat in diff[:50])
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return {
+            f"cpu-top-{stamp}.txt": top,
+            f"cpu-folded-{stamp}.txt": folded,
+            f"memory-diff-{stamp}.txt": "".join(memory),
+            f"threads-{stamp}.txt": thread_stacks(),
+        }
+    finally:
+        _capture_lock.release()
+
+
+def write_files(files: dict, directory: str = PROFILE_DIR) -> list:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, text in files.items():
+        path = os.path.join(directory, f"{os.getpid()}-{name}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        paths.append(path)
+    return paths
+
+
+def install_signal_handler(signame: str = PROFILE_SIGNAL, seconds: float = PROFILE_SECONDS):
+    """On signame, capture in the background and write the files to PROFILE_DIR. Main thread only."""
+    signum = getattr(signal, signame, None)
+    if signum is None:
+        logger.warning("Signal %s is not available here; profile signal handler not installed", signame)
+        return
+
+    def run():
+        try:
+            paths = write_files(capture(seconds))
+            logger.info("Profile written: %s", ", ".join(paths))
+        except CaptureBusy as e:
+            logger.warning("%s", e)
+        except Exception as e:
+            logger.error("Profile capture failed: %s", e, exc_info=True)
+
+    def handler(signum, frame):
+        # Signal handlers must return quickly; the capture runs on its own thread
+        threading.Thread(target=run, name="profiler", daemon=True).start()
+
+    signal.signal(signum, handler)
@@ -0,0 +1,149 @@
+# Shared status poller for asynchronously submitted warehouse queries.
+# Queries are submitted with execute_async; instead of every waiting question running its own poll loop,
+# one scheduler thread keeps a heap of next-poll times (with per-query backoff) and a few pool threads make
+# the status calls. Waiters sleep on an Event and wake only to report progress (warehouse state and
+# elapsed time) or to notice a cancelled deadline.
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY
+
+SQL_POLL_MAX_INTERVAL = float(os.getenv("SQL_POLL_MAX_INTERVAL", "2"))
+SQL_POLLER_THREADS = int(os.getenv("SQL_POLLER_THREADS", "4"))
+# How often a waiting question refreshes its progress message
+SQL_PROGRESS_INTERVAL = float(os.getenv("SQL_PROGRESS_INTERVAL", "5"))
+
+PENDING = REGISTRY.gauge("gboagent_sql_pending_queries", "Warehouse queries submitted and not yet finished.")
+POLLS = REGISTRY.counter("gboagent_sql_status_polls_total", "Query status checks made by the shared poller.")
+
+# Connector QueryStatus names, as the user should read them
+STATUS_TEXT = {
+    "QUEUED": "Queued on the warehouse",
+    "QUEUED_REPARING_WAREHOUSE": "Queued while the warehouse is repaired",
+    "RESUMING_WAREHOUSE": "Waiting for the warehouse to resume",
+    "BLOCKED": "Waiting on a lock held by another query",
+    "RUNNING": "Running on the warehouse",
+}
+
+
+def describe(status: str) -> str:
+    return STATUS_TEXT.get(status, "Running on the warehouse")
+
+
+class PendingQuery:
+    __slots__ = ("query_id", "conn", "submitted_at", "status", "error", "done", "interval", "discarded")
+
+    def __init__(self, conn, query_id: str):
+        self.query_id = query_id
+        self.conn = conn
+        self.submitted_at = time.monotonic()
+        self.status = "QUEUED"
+        self.error = None
+        self.done = threading.Event()
+        self.interval = 0.1
+        self.discarded = False
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.submitted_at
+
+    def wait(self, deadline=None, on_progress=None, progress_interval: float = SQL_PROGRESS_INTERVAL):
+        """Block until the query finishes, calling on_progress(status, elapsed) every progress_interval seconds."""
+        next_progress = time.monotonic() + progress_interval
+        try:
+            # Waking is local (no status call), so it can be frequent enough to notice a cancelled deadline promptly
+            while not self.done.wait(0.5):
+                if deadline is not None:
+                    deadline.check()
+                if on_progress and time.monotonic() >= next_progress:
+                    next_progress += progress_interval
+                    on_progress(self.status, self.elapsed())
+        finally:
+            # Stop polling a query nobody waits for any more (e.g. the question was cancelled)
+            self.discarded = True
+        if deadline is not None:
+            deadline.check()
+        if self.error is not None:
+            raise self.error
+
+
+class QueryPoller:
+    def __init__(self, threads: int = SQL_POLLER_THREADS, max_interval: float = SQL_POLL_MAX_INTERVAL):
+        self.max_interval = max_interval
+        self._threads = threads
+        self._cond = threading.Condition()
+        self._heap = []  # (next_poll_at, seq, pending)
+        self._seq = itertools.count()
+        self._pool = None
+        self._thread = None
+        self._pending = 0
+        PENDING.set_function(lambda: self._pending)
+
+    def submit(self, conn, query_id: str) -> PendingQuery:
+        pending = PendingQuery(conn, query_id)
+        with self._cond:
+            if self._thread is None:
+                self._pool = ThreadPoolExecutor(self._threads, thread_name_prefix="sql-poll")
+                self._thread = threading.Thread(target=self._run, name="sql-poller", daemon=True)
+                self._thread.start()
+            self._pending += 1
+        self._schedule(pending)
+        return pending
+
+    def _schedule(self, pending: PendingQuery):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + pending.interval, next(self._seq), pending))
+            self._cond.notify()
+
+    def _finish(self, pending: PendingQuery, error=None):
+        pending.error = error
+        with self._cond:
+            self._pending -= 1
+        pending.done.set()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due_at, _, pending = self._heap[0]
+                delay = due_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            if pending.discarded:
+                self._finish(pending)
+                continue
+            self._pool.submit(self._poll, pending)
+
+    def _poll(self, pending: PendingQuery):
+        POLLS.inc()
+        try:
+            status = pending.conn.get_query_status_throw_if_error(pending.query_id)
+            pending.status = status.name
+            if not pending.conn.is_still_running(status):
+                self._finish(pending)
+                return
+        except Exception as e:
+            self._finish(pending, e)
+            return
+        # Back off: short queries are noticed quickly, long ones cost few status calls
+        pending.interval = min(pending.interval * 2, self.max_interval)
+        self._schedule(pending)
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_poller() -> QueryPoller:
+    """The process-wide poller shared by every CortexChat."""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = QueryPoller()
+        return _poller
@@ -0,0 +1,311 @@
+# Scheduled reports: saved and frequently asked questions are answered ahead of time, off-peak, and the
+# answer (SQL, summary, table preview, chart) is kept in SQLite. A top-level question that matches a fresh
+# report is answered straight from it, marked with when it was computed, without touching the agent or
+# the warehouse.
+#   Saved reports come from REPORTS_FILE, e.g. [{"question": "Sales report for last month", "schedule": "0 6 1 * *"}]
+#   Questions asked REPORT_POPULAR_MIN_ASKS times in REPORT_POPULAR_DAYS are refreshed on REPORT_SCHEDULE.
+# Schedules are five-field cron expressions (minute hour day-of-month month day-of-week) in local time.
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+import table_render
+from metrics import REGISTRY
+
+REPORTS_DB_PATH = os.getenv("REPORTS_DB_PATH", "reports.sqlite3")
+REPORTS_FILE = os.getenv("REPORTS_FILE", "reports.json")
+# When saved reports without their own schedule, and popular questions, are refreshed
+REPORT_SCHEDULE = os.getenv("REPORT_SCHEDULE", "0 5 * * *")
+REPORT_POPULAR_LIMIT = int(os.getenv("REPORT_POPULAR_LIMIT", "20"))
+REPORT_POPULAR_MIN_ASKS = int(os.getenv("REPORT_POPULAR_MIN_ASKS", "3"))
+REPORT_POPULAR_DAYS = float(os.getenv("REPORT_POPULAR_DAYS", "7"))
+# A report is served until its schedule's next run plus this long (the run itself takes a while); after
+# that the question takes the live path instead
+REPORT_GRACE_HOURS = float(os.getenv("REPORT_GRACE_HOURS", "2"))
+
+logger = logging.getLogger(__name__)
+
+SERVED = REGISTRY.counter("gboagent_reports_served_total", "Questions looked up in the report store, by outcome.", ("result",))
+REFRESHES = REGISTRY.counter("gboagent_report_refreshes_total", "Scheduled report runs, by kind and outcome.", ("kind", "result"))
+REFRESH_SECONDS = REGISTRY.histogram("gboagent_report_refresh_seconds", "Time to compute a scheduled report.")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    key TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    sql TEXT,
+    summary TEXT NOT NULL,
+    result_handle TEXT,
+    preview TEXT NOT NULL,
+    note TEXT NOT NULL,
+    chart BLOB,
+    computed_at TEXT NOT NULL,
+    schedule TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS asks (
+    key TEXT NOT NULL,
+    question TEXT NOT NULL,
+    asked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS asks_asked_at ON asks (asked_at);
+"""
+
+_COLUMNS = ("question", "sql", "summary", "result_handle", "preview", "note", "chart", "computed_at", "schedule")
+
+
+class Report(NamedTuple):
+    question: str
+    sql: str | None
+    summary: str
+    result_handle: str | None
+    preview: list  # table preview blocks
+    note: str  # e.g. "Showing 40 of 1,234 rows", "" when the preview is complete
+    chart: bytes | None  # PNG
+    computed_at: str  # ISO timestamp
+    schedule: str  # cron expression it is refreshed on
+
+    def text(self) -> str:
+        """The summary, marked with when it was computed."""
+        computed_at = datetime.fromisoformat(self.computed_at)
+        return f"{self.summary}\n\n_Scheduled report, computed at {computed_at:%Y-%m-%d %H:%M}._"
+
+
+def report_key(question: str) -> str:
+    """Case, spacing and trailing punctuation don't make a different question."""
+    return re.sub(r"\s+", " ", question or "").strip().rstrip("?.! ").lower()
+
+
+def _cron_field(spec: str, low: int, high: int) -> set:
+    values = set()
+    for part in spec.split(","):
+        span, _, step = part.partition("/")
+        if span == "*":
+            start, end = low, high
+        elif "-" in span:
+            start, end = (int(v) for v in span.split("-", 1))
+        else:
+            start = int(span)
+            end = high if step else start
+        if start < low or end > high:
+            raise ValueError(f"{part!r} is outside {low}-{high}")
+        values.update(range(start, end + 1, int(step or 1)))
+    return values
+
+
+class Cron:
+    """A five-field cron expression; day-of-week 0 and 7 are Sunday."""
+
+    def __init__(self, spec: str):
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {spec!r}")
+        self.spec = spec
+        self.minutes = _cron_field(fields[0], 0, 59)
+        self.hours = _cron_field(fields[1], 0, 23)
+        self.days = _cron_field(fields[2], 1, 31)
+        self.months = _cron_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _cron_field(fields[4], 0, 7)}
+        self._any_day, self._any_weekday = fields[2] == "*", fields[4] == "*"
+
+    def matches(self, when: datetime) -> bool:
+        return (when.minute in self.minutes and when.hour in self.hours and when.month in self.months
+                and self._day_matches(when))
+
+    def _day_matches(self, when: datetime) -> bool:
+        day = when.day in self.days
+        weekday = (when.isoweekday() % 7) in self.weekdays
+        # As in cron: when both day fields are restricted, either one matching is enough
+        if not self._any_day and not self._any_weekday:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, when: datetime) -> datetime:
+        """The first minute after when that matches."""
+        when = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Five years covers "29 Feb" schedules; a spec that matches no date at all ("31 2") raises
+        limit = when + timedelta(days=5 * 366)
+        while when < limit:
+            if when.month not in self.months:
+                when = (when.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(when):
+                when = when.replace(hour=0, minute=0) + timedelta(days=1)
+            elif when.hour not in self.hours:
+                when = when.replace(minute=0) + timedelta(hours=1)
+            elif when.minute not in self.minutes:
+                when += timedelta(minutes=1)
+            else:
+                return when
+        raise ValueError(f"Cron expression never matches: {self.spec!r}")
+
+
+class ReportStore:
+    def __init__(self, db_path: str = REPORTS_DB_PATH, grace_hours: float = REPORT_GRACE_HOURS):
+        self.grace = timedelta(hours=grace_hours)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def get(self, question: str) -> Report | None:
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM reports WHERE key = ?", (report_key(question),)).fetchone()
+        if row is None:
+            return None
+        report = Report(**dict(zip(_COLUMNS, row)))
+        return report._replace(preview=json.loads(report.preview))
+
+    def ask(self, question: str) -> Report | None:
+        """Count an ask of question towards popularity; returns its report if there is a fresh one."""
+        with self._lock:
+            self._db.execute("INSERT INTO asks (key, question, asked_at) VALUES (?, ?, ?)", (report_key(question), question, time.time()))
+            self._db.commit()
+        report = self.get(question)
+        if report is None:
+            SERVED.inc(result="miss")
+            return None
+        if datetime.now() > self.expires(report):
+            SERVED.inc(result="stale")
+            return None
+        SERVED.inc(result="hit")
+        return report
+
+    def expires(self, report: Report) -> datetime:
+        """When report stops being served: the run after the one that computed it should have replaced it by then."""
+        return Cron(report.schedule).next_after(datetime.fromisoformat(report.computed_at)) + self.grace
+
+    def save(self, report: Report):
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO reports (key, {', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (report_key(report.question), report.question, report.sql, report.summary, report.result_handle,
+                 json.dumps(report.preview), report.note, report.chart, report.computed_at, report.schedule),
+            )
+            self._db.commit()
+
+    def popular(self, limit: int = REPORT_POPULAR_LIMIT, min_asks: int = REPORT_POPULAR_MIN_ASKS,
+                days: float = REPORT_POPULAR_DAYS) -> list:
+        """The most asked questions over the last days, most asked first, as last worded."""
+        cutoff = time.time() - days * 86400
+        with self._lock:
+            self._db.execute("DELETE FROM asks WHERE asked_at < ?", (cutoff,))
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT (SELECT question FROM asks a WHERE a.key = asks.key ORDER BY asked_at DESC LIMIT 1), COUNT(*) AS n "
+                "FROM asks GROUP BY key HAVING n >= ? ORDER BY n DESC LIMIT ?",
+                (min_asks, limit),
+            ).fetchall()
+        return [question for question, _ in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_report_store() -> ReportStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReportStore()
+        return _store
+
+
+def load_saved(path: str = REPORTS_FILE) -> list:
+    """(question, Cron) for each saved report in path; none if the file doesn't exist."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [(entry["question"], Cron(entry.get("schedule") or REPORT_SCHEDULE)) for entry in json.load(f)]
+
+
+class ReportScheduler:
+    """
+    Runs saved reports on their schedules and popular questions on REPORT_SCHEDULE, one at a time on a
+    background thread. answer(question) returns a chat result; render_chart(df) returns a PNG path or None.
+    """
+
+    def __init__(self, answer, store: ReportStore = None, saved: list = None, render_chart=None,
+                 popular_schedule: str = REPORT_SCHEDULE):
+        self.answer = answer
+        self.store = store or get_report_store()
+        self.saved = load_saved() if saved is None else saved
+        self.render_chart = render_chart
+        self.popular_schedule = Cron(popular_schedule)
+        self._thread = None
+
+    def due(self, when: datetime) -> list:
+        """(question, kind, Cron) to run for the minute when; a question that is both saved and popular runs once."""
+        due = {report_key(question): (question, "saved", cron) for question, cron in self.saved if cron.matches(when)}
+        if self.popular_schedule.matches(when):
+            for question in self.store.popular():
+                due.setdefault(report_key(question), (question, "popular", self.popular_schedule))
+        return list(due.values())
+
+    def refresh(self, question: str, kind: str = "saved", cron: Cron = None) -> Report | None:
+        """Answer question now and store the report; None (logged) if the answer isn't one to keep."""
+        started = time.perf_counter()
+        try:
+            result = self.answer(question)
+            if result.get("error") or result.get("confirm"):
+                logger.warning("Scheduled report %r not stored: %s", question, result.get("error") or "needs confirmation")
+                REFRESHES.inc(kind=kind, result="skipped")
+                return None
+            report = self._report(question, result, cron or self.popular_schedule)
+        except Exception as e:
+            logger.error("Scheduled report %r failed: %s", question, e, exc_info=True)
+            REFRESHES.inc(kind=kind, result="error")
+            return None
+        self.store.save(report)
+        REFRESHES.inc(kind=kind, result="ok")
+        REFRESH_SECONDS.observe(time.perf_counter() - started)
+        logger.info("Scheduled report %r computed in %.1fs", question, time.perf_counter() - started)
+        return report
+
+    def _report(self, question: str, result: dict, cron: Cron) -> Report:
+        df = result.get("dataframe")
+        preview, note, chart = [], "", None
+        if df is not None and not df.empty:
+            table = table_render.render_table(df, title="*Data:*")
+            preview, note = table.blocks, table.note
+            chart = self._chart(df)
+        return Report(question, result.get("sql"), result.get("text") or "", result.get("result_handle"), preview, note, chart,
+                      datetime.now().isoformat(timespec="seconds"), cron.spec)
+
+    def _chart(self, df) -> bytes | None:
+        """The chart as PNG bytes; a chart that fails is left out rather than losing the report."""
+        if self.render_chart is None or len(df.columns) < 2:
+            return None
+        try:
+            path = self.render_chart(df)
+            if not path:
+                return None
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            finally:
+                os.remove(path)
+        except Exception as e:
+            logger.warning("Chart for scheduled report failed: %s", e)
+            return None
+
+    def start(self) -> "ReportScheduler":
+        self._thread = threading.Thread(target=self._run, name="report-scheduler", daemon=True)
+        self._thread.start()
+        logger.info("Report scheduler started: %d saved reports, popular questions on %r", len(self.saved), self.popular_schedule.spec)
+        return self
+
+    def _run(self):
+        last = datetime.now().replace(second=0, microsecond=0)
+        while True:
+            time.sleep(60 - datetime.now().second)
+            now = datetime.now().replace(second=0, microsecond=0)
+            # Minutes that passed while reports were running are checked too, so none is skipped
+            while last < now:
+                last += timedelta(minutes=1)
+                for question, kind, cron in self.due(last):
+                    self.refresh(question, kind, cron)
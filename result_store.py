@@ -0,0 +1,156 @@
+# Disk-backed store for materialized query results.
+# Each result is written once as an Arrow IPC file named by the hash of its contents, so identical results
+# share a file and a handle can be passed around (history, buttons, exports) instead of a DataFrame.
+# Readers memory-map the file, so charts and exports that need a few columns or rows don't copy the rest
+# into the process. A small SQLite index tracks size and last access; the least recently used results are
+# evicted once RESULT_STORE_MAX_BYTES is exceeded, so resident memory stays flat however many answers are served.
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.ipc
+
+from metrics import REGISTRY
+
+RESULT_STORE_DIR = os.getenv("RESULT_STORE_DIR", "results")
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+RESULTS = REGISTRY.counter("gboagent_result_store_total", "Result store operations.", ("result",))
+STORED_BYTES = REGISTRY.gauge("gboagent_result_store_bytes", "Bytes of results on disk.")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    handle TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    num_rows INTEGER NOT NULL,
+    num_columns INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+"""
+
+_COLUMNS = ("handle", "bytes", "num_rows", "num_columns", "created_at", "last_access")
+
+
+class ResultStore:
+    def __init__(self, root: str = RESULT_STORE_DIR, max_bytes: int = RESULT_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        # Shared by every worker process using the same directory
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        STORED_BYTES.set_function(self.total_bytes)
+
+    def _path(self, handle: str) -> str:
+        return os.path.join(self.root, f"{handle}.arrow")
+
+    def put(self, df) -> str:
+        """Store a DataFrame (or Arrow table) and return its handle."""
+        table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        buf = sink.getvalue()
+        handle = hashlib.sha256(buf).hexdigest()[:32]
+        path = self._path(handle)
+        now = time.time()
+        if os.path.exists(path):
+            RESULTS.inc(result="deduplicated")
+        else:
+            # Write then rename, so a reader never maps a half-written file
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(buf)
+            os.replace(tmp, path)
+            RESULTS.inc(result="stored")
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO results (handle, bytes, num_rows, num_columns, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (handle) DO UPDATE SET last_access = excluded.last_access",
+                (handle, buf.size, table.num_rows, table.num_columns, now, now),
+            )
+            self._db.commit()
+        self._evict(keep=handle)
+        return handle
+
+    def get(self, handle: str) -> pa.Table | None:
+        """The stored table, memory-mapped (no copy), or None if it was never stored or has been evicted."""
+        if not handle:
+            return None
+        try:
+            table = pa.ipc.open_file(pa.memory_map(self._path(handle), "r")).read_all()
+        except FileNotFoundError:
+            RESULTS.inc(result="miss")
+            with self._lock:
+                self._db.execute("DELETE FROM results WHERE handle = ?", (handle,))
+                self._db.commit()
+            return None
+        RESULTS.inc(result="hit")
+        with self._lock:
+            self._db.execute("UPDATE results SET last_access = ? WHERE handle = ?", (time.time(), handle))
+            self._db.commit()
+        return table
+
+    def frame(self, handle: str, max_rows: int = None, columns: list = None):
+        """The stored result as a DataFrame; only the requested rows and columns are converted."""
+        table = self.get(handle)
+        if table is None:
+            return None
+        if columns is not None:
+            table = table.select(columns)
+        if max_rows is not None:
+            table = table.slice(0, max_rows)
+        return table.to_pandas()
+
+    def info(self, handle: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM results WHERE handle = ?", (handle,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+
+    def _evict(self, keep: str = None):
+        """Remove least recently used results until the store fits in max_bytes."""
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for handle, size in self._db.execute("SELECT handle, bytes FROM results ORDER BY last_access"):
+                if total <= self.max_bytes:
+                    break
+                if handle == keep:
+                    continue
+                victims.append(handle)
+                total -= size
+            self._db.executemany("DELETE FROM results WHERE handle = ?", [(h,) for h in victims])
+            self._db.commit()
+        for handle in victims:
+            # Readers that already mapped the file keep their view; the space is freed when they let go
+            try:
+                os.remove(self._path(handle))
+            except FileNotFoundError:
+                pass
+            RESULTS.inc(result="evicted")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """The process-wide result store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
@@ -0,0 +1,265 @@
+# Pluggable state shared between bot worker processes.
+# Two implementations of the same small key/value + capped-list interface:
+#   sqlite:///path/to/state.sqlite3   - one file shared by the workers on a host (WAL mode)
+#   redis://[:password@]host:port/db  - any Redis-protocol server, spoken directly over RESP
+# Select one with SHARED_STATE_URL; shared_backend() returns None when it is unset (single-process mode).
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "")
+
+
+class SQLiteStateBackend:
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS lists (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        expires_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS lists_key_id ON lists (key, id DESC);
+    CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at);
+    CREATE INDEX IF NOT EXISTS lists_expires_at ON lists (expires_at);
+    """
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self._SCHEMA)
+
+    @staticmethod
+    def _expiry(ttl):
+        return time.time() + ttl if ttl else None
+
+    def _committed(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            now = time.time()
+            self._db.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self._db.execute("DELETE FROM lists WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._db.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: float = None):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, self._expiry(ttl)))
+            self._committed()
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        """Set key only if it is absent or expired. Returns True if this call set it."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+                (key, value, self._expiry(ttl), time.time()),
+            )
+            self._committed()
+            return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM kv WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM lists WHERE key = ?", (key,))
+            self._committed()
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, NULL) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(kv.value AS INTEGER) + ?",
+                (key, str(amount), amount),
+            )
+            value = self._db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0]
+            self._committed()
+        return int(value)
+
+    def push(self, key: str, value: str, max_len: int = None, ttl: float = None):
+        """Prepend value to the list at key, keeping at most max_len newest items; ttl expires the whole list."""
+        with self._lock:
+            self._db.execute("INSERT INTO lists (key, value) VALUES (?, ?)", (key, value))
+            if ttl:
+                self._db.execute("UPDATE lists SET expires_at = ? WHERE key = ?", (self._expiry(ttl), key))
+            if max_len:
+                self._db.execute(
+                    "DELETE FROM lists WHERE key = ? AND id <= "
+                    "(SELECT id FROM lists WHERE key = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (key, key, max_len),
+                )
+            self._committed()
+
+    def range(self, key: str, count: int) -> list:
+        """Newest-first items of the list at key."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT value FROM lists WHERE key = ? AND (expires_at IS NULL OR expires_at > ?) ORDER BY id DESC LIMIT ?",
+                (key, time.time(), count),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisStateBackend:
+    """The same interface over the Redis serialisation protocol (RESP2), one socket per thread."""
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, password: str = None, timeout: float = 5.0):
+        self.host, self.port, self.db, self.password, self.timeout = host, port, db, password, timeout
+        self._local = threading.local()
+
+    # --- protocol ---
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile("rb"))
+            try:
+                if self.password:
+                    self._roundtrip(conn, ("AUTH", self.password))
+                if self.db:
+                    self._roundtrip(conn, ("SELECT", self.db))
+            except BaseException:
+                sock.close()
+                raise
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read(self, reader):
+        """One reply. Error replies are returned, not raised, so the rest of a pipeline can still be read."""
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            return RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = reader.read(length + 2)[:-2]
+            return data.decode("utf-8")
+        if kind == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read(reader) for _ in range(length)]
+        # The stream is out of step; execute() drops the connection
+        raise ConnectionError(f"Unexpected Redis reply: {line!r}")
+
+    def _roundtrip(self, conn, *commands):
+        sock, reader = conn
+        sock.sendall(b"".join(self._encode(c) for c in commands))
+        # Every reply is read before raising, so the socket is left ready for the next call
+        replies = [self._read(reader) for _ in commands]
+        error = next((r for r in replies if isinstance(r, RedisError)), None)
+        if error is not None:
+            raise error
+        return replies
+
+    def execute(self, *commands):
+        """Send one or more commands in a single round trip (pipelined); returns the last reply."""
+        try:
+            return self._roundtrip(self._connection(), *commands)[-1]
+        except (OSError, ConnectionError):
+            # Drop the broken socket; the next call reconnects
+            self.close()
+            raise
+
+    def close(self):
+        """Close this thread's connection, if it has one."""
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            conn[1].close()
+            conn[0].close()
+
+    # --- interface ---
+    def get(self, key: str):
+        return self.execute(("GET", key))
+
+    def set(self, key: str, value: str, ttl: float = None):
+        if ttl:
+            self.execute(("SET", key, value, "PX", int(ttl * 1000)))
+        else:
+            self.execute(("SET", key, value))
+
+    def add(self, key: str, value: str, ttl: float = None) -> bool:
+        args = ("SET", key, value, "NX") + (("PX", int(ttl * 1000)) if ttl else ())
+        return self.execute(args) == "OK"
+
+    def delete(self, key: str):
+        self.execute(("DEL", key))
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        return self.execute(("INCRBY", key, amount))
+
+    def push(self, key: str, value: str, max_len: int = None, ttl: float = None):
+        commands = [("LPUSH", key, value)]
+        if max_len:
+            commands.append(("LTRIM", key, 0, max_len - 1))
+        if ttl:
+            commands.append(("PEXPIRE", key, int(ttl * 1000)))
+        self.execute(*commands)
+
+    def range(self, key: str, count: int) -> list:
+        return self.execute(("LRANGE", key, 0, count - 1)) or []
+
+
+def open_backend(url: str):
+    """Build a backend from a sqlite:/// or redis:// URL."""
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.sqlite3 or sqlite:////absolute/path.sqlite3
+        return SQLiteStateBackend(parsed.path[1:])
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisStateBackend(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unsupported SHARED_STATE_URL scheme: {parsed.scheme!r}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def shared_backend():
+    """The process-wide backend configured by SHARED_STATE_URL, or None when running single-process."""
+    global _backend
+    if not SHARED_STATE_URL:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            _backend = open_backend(SHARED_STATE_URL)
+        return _backend
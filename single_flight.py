@@ -0,0 +1,136 @@
+# Single-flight deduplication: concurrent identical questions share one execution.
+# The first caller (leader) starts the work on its own thread, under a deadline of its own; every caller,
+# the leader included, attaches to it and has each progress/final callback replayed into its own Slack
+# message. A requester who cancels or times out just detaches; the execution is only cancelled once
+# nobody is waiting for it.
+import contextvars
+import hashlib
+import logging
+import re
+import threading
+
+from deadline import Deadline
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_CALLS = REGISTRY.counter("gboagent_single_flight_calls_total", "Questions seen by the single-flight layer, by role.", ("role",))
+# Each follower saves one full answer: two agent calls and a warehouse query
+SINGLE_FLIGHT_SAVED = REGISTRY.counter("gboagent_single_flight_saved_total", "Expensive operations avoided by attaching to an in-flight question.", ("operation",))
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!]+$")
+
+
+def normalize_question(question: str) -> str:
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", question.strip().lower()))
+
+
+def flight_key(question: str, context=None) -> str:
+    """Key for a question plus whatever context changes its answer (e.g. prior conversation turns)."""
+    digest = hashlib.sha256(normalize_question(question).encode('utf-8'))
+    if context:
+        digest.update(b"\0" + repr(context).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _Flight:
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.callbacks = []  # one entry (possibly None) per attached requester
+        self.joined = 0
+        self.last_call = None
+        self.lock = threading.Lock()
+
+    def attach(self, callback):
+        with self.lock:
+            self.callbacks.append(callback)
+            self.joined += 1
+            replay = self.last_call
+        # Bring a late joiner up to date with the newest progress (or final) message
+        if callback and replay is not None:
+            args, kwargs = replay
+            callback(*args, **kwargs)
+
+    def detach(self, callback):
+        """Stop sending callback updates; the execution is cancelled when the last requester detaches."""
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+            abandoned = not self.callbacks and not self.done.is_set()
+        if abandoned:
+            self.deadline.cancel("every requester cancelled")
+
+    def broadcast(self, *args, **kwargs):
+        with self.lock:
+            self.last_call = (args, kwargs)
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(*args, **kwargs)
+            except Exception as e:
+                # One requester's rendering failure must not break the others
+                logger.warning("Single-flight callback failed: %s", e, exc_info=True)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def do(self, key: str, fn, callback=None, deadline: Deadline = None):
+        """
+        Run fn(callback, deadline) once per key among concurrent callers and return its result to all of them.
+        fn receives a fan-out callback that forwards to every attached requester's callback, and the flight's
+        own deadline, sized from the first caller's. A caller's deadline only bounds its own wait: cancelling
+        it detaches that caller, and the execution is cancelled only when no requester is left.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(Deadline(deadline.remaining() if deadline is not None else None))
+        SINGLE_FLIGHT_CALLS.inc(role="leader" if leader else "follower")
+        if leader:
+            # Attach first, so the flight is never without a requester once it runs
+            flight.attach(callback)
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._run, key, flight, fn), name="single-flight", daemon=True).start()
+        else:
+            SINGLE_FLIGHT_SAVED.inc(operation="question")
+            flight.attach(callback)
+        try:
+            while not flight.done.wait(0.25):
+                if deadline is not None:
+                    deadline.check()
+        except BaseException:
+            flight.detach(callback)
+            raise
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _run(self, key: str, flight: _Flight, fn):
+        try:
+            flight.result = fn(flight.broadcast, flight.deadline)
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.deadline.close()
+            flight.done.set()
+        followers = flight.joined - 1
+        if followers > 0 and flight.result:
+            ran_sql = bool(flight.result.get('sql'))
+            SINGLE_FLIGHT_SAVED.inc(followers * (2 if ran_sql else 1), operation="agent_call")
+            if ran_sql:
+                SINGLE_FLIGHT_SAVED.inc(followers, operation="warehouse_query")
@@ -1,4 +1,12 @@
 #!/bin/sh
 
 source .venv/bin/activate
-python app.py
+# Set SLACK_HTTP to serve the Events API over HTTP (needs SLACK_SIGNING_SECRET) instead of Socket Mode;
+# set WORKERS (and SHARED_STATE_URL) to run several worker processes behind one Socket Mode connection
+if [ -n "$SLACK_HTTP" ]; then
+    gunicorn -c gunicorn.conf.py http_app:flask_app
+elif [ -n "$WORKERS" ]; then
+    python workers.py
+else
+    python app.py
+fi
@@ -0,0 +1,132 @@
+# Single gateway for Slack Web API calls.
+# Every call takes a token from its method's rate-limit tier before it is sent. Callers waiting on the same
+# tier are served by priority: final answers and errors first, then interactive replies and uploads, then
+# progress updates, then App Home views. Progress updates never wait: one that can't go out at once is
+# dropped, since the next update (or the final answer) supersedes it. A 429 pauses the whole tier for
+# Retry-After seconds, and the call is retried.
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+import tracing
+from admission import TokenBucket
+from metrics import REGISTRY
+
+# Calls per minute for each tier. chat.postMessage has its own limit ("post"): about one per second per
+# channel, with a workspace-wide ceiling of a few hundred per minute
+SLACK_TIER_RATES = {tier: float(rate) for tier, rate in (
+    item.split("=") for item in os.getenv("SLACK_TIER_RATES", "1=1,2=20,3=50,4=100,post=300").split(",") if item)}
+SLACK_TIER_BURST = float(os.getenv("SLACK_TIER_BURST", "10"))
+SLACK_MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", "3"))
+
+logger = logging.getLogger(__name__)
+
+CALLS = REGISTRY.counter("gboagent_slack_calls_total", "Slack Web API calls by method and outcome.", ("method", "result"))
+QUEUE_DEPTH = REGISTRY.gauge("gboagent_slack_queue_depth", "Slack calls waiting for their rate-limit tier.", ("tier",))
+THROTTLE_SECONDS = REGISTRY.histogram("gboagent_slack_throttle_seconds", "Time a Slack call waited for its rate-limit tier.",
+                                      ("tier", "priority"))
+
+FINAL, INTERACTIVE, PROGRESS, HOME = 0, 1, 2, 3
+_PRIORITY_NAMES = {FINAL: "final", INTERACTIVE: "interactive", PROGRESS: "progress", HOME: "home"}
+
+# Web API method (slack_sdk name) -> rate-limit tier
+METHOD_TIERS = {
+    "chat_postMessage": "post",
+    "chat_update": "3",
+    "chat_delete": "3",
+    "chat_postEphemeral": "4",
+    "conversations_open": "3",
+    "files_upload_v2": "4",
+    "views_publish": "4",
+}
+
+
+class SlackGateway:
+    def __init__(self, rates: dict = None, burst: float = SLACK_TIER_BURST, max_retries: int = SLACK_MAX_RETRIES):
+        self.rates = rates or SLACK_TIER_RATES
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._buckets = {tier: TokenBucket(rate / 60.0, burst) for tier, rate in self.rates.items()}
+        self._queues = {tier: [] for tier in self.rates}  # tier -> heap of (priority, seq), one per waiting caller
+        self._paused_until = {tier: 0.0 for tier in self.rates}
+        self._seq = itertools.count()
+        for tier in self.rates:
+            QUEUE_DEPTH.set_function(lambda tier=tier: len(self._queues[tier]), tier=tier)
+
+    def _acquire(self, tier: str, priority: int, block: bool = True) -> bool:
+        """Wait for a token on tier, behind higher-priority callers. With block=False, False unless one is free now."""
+        queue = self._queues[tier]
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(queue, entry)
+            try:
+                while True:
+                    wait = None  # not at the head: sleep until the queue changes
+                    if queue[0] is entry:
+                        wait = self._paused_until[tier] - time.monotonic()
+                        if wait <= 0:
+                            wait = self._buckets[tier].take()
+                        if wait <= 0:
+                            return True
+                    if not block:
+                        return False
+                    self._cond.wait(wait)
+            finally:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+
+    def _pause(self, tier: str, seconds: float):
+        with self._cond:
+            self._paused_until[tier] = max(self._paused_until[tier], time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def call(self, client, method: str, priority: int = INTERACTIVE, **kwargs):
+        """
+        Call client.<method>(**kwargs) once its tier allows. Returns the response, or None for a progress
+        update dropped because the tier was busy.
+        """
+        tier = METHOD_TIERS.get(method, "3")
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            granted = self._acquire(tier, priority, block=priority != PROGRESS)
+            THROTTLE_SECONDS.observe(time.monotonic() - started, tier=tier, priority=_PRIORITY_NAMES.get(priority, str(priority)))
+            if not granted:
+                CALLS.inc(method=method, result="dropped")
+                return None
+            try:
+                with tracing.span(f"slack.{method}"):
+                    response = getattr(client, method)(**kwargs)
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt == self.max_retries:
+                    CALLS.inc(method=method, result="error")
+                    raise
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+                logger.warning("Slack rate limited %s; pausing tier %s for %gs", method, tier, retry_after)
+                CALLS.inc(method=method, result="rate_limited")
+                self._pause(tier, retry_after)
+                continue
+            CALLS.inc(method=method, result="ok")
+            return response
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> SlackGateway:
+    """The process-wide gateway; Slack's limits are per app and workspace, not per caller."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = SlackGateway()
+        return _gateway
+
+
+def call(client, method: str, priority: int = INTERACTIVE, **kwargs):
+    return get_gateway().call(client, method, priority, **kwargs)
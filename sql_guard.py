@@ -0,0 +1,240 @@
+# Pre-execution cost guard for agent-generated SQL.
+# EXPLAIN compiles the query without running it (no warehouse time) and reports how many micro-partitions
+# and bytes it would scan. Queries over the confirm budgets wait for the user to approve them, queries
+# over the reject budgets are refused, and queries that don't aggregate get a row cap so a
+# "show me everything" can't pull millions of rows into the bot. Every decision is logged and counted.
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import tracing
+from metrics import REGISTRY
+
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+SQL_CONFIRM_BYTES = float(os.getenv("SQL_CONFIRM_BYTES", str(10 * 1024 ** 3)))
+SQL_REJECT_BYTES = float(os.getenv("SQL_REJECT_BYTES", str(500 * 1024 ** 3)))
+SQL_CONFIRM_PARTITIONS = int(os.getenv("SQL_CONFIRM_PARTITIONS", "20000"))
+SQL_REJECT_PARTITIONS = int(os.getenv("SQL_REJECT_PARTITIONS", "1000000"))
+# Most rows a non-aggregating query may return
+SQL_ROW_CAP = int(os.getenv("SQL_ROW_CAP", "10000"))
+# How long an expensive query waits for the user to confirm it
+SQL_CONFIRM_TTL = float(os.getenv("SQL_CONFIRM_TTL", "900"))
+
+logger = logging.getLogger(__name__)
+
+DECISIONS = REGISTRY.counter("gboagent_sql_guard_decisions_total", "SQL cost guard decisions.", ("action",))
+ESTIMATED_BYTES = REGISTRY.histogram("gboagent_sql_guard_estimated_bytes", "Bytes EXPLAIN estimates a query will scan.",
+                                     buckets=(1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12, 1e13))
+
+ALLOW, CONFIRM, REJECT = "allow", "confirm", "reject"
+
+# Plan operations that reduce rows to groups; their output is small enough to need no cap
+_AGGREGATING = {"Aggregate", "GroupingSets"}
+# Operations between the root Result and an aggregate that don't add rows (ORDER BY, LIMIT, HAVING)
+_PASS_THROUGH = {"Sort", "SortWithLimit", "Limit", "Filter", "Projection"}
+_TRAILING = re.compile(r"[\s;]+$")
+# Quoted literals and identifiers, comments, and single characters, for finding where the last clause ends
+_TOKEN = re.compile(r"'(?:[^'\\]|\\.|'')*'?|\"(?:[^\"]|\"\")*\"?|\$\$.*?(?:\$\$|\Z)|(?:--|//)[^\n]*|/\*.*?(?:\*/|\Z)|.", re.S)
+# A LIMIT or FETCH that closes the statement (inside parentheses it would be followed by ")")
+_OUTER_LIMIT = re.compile(r"\b(LIMIT\s+)(\d+)(\s+OFFSET\s+\d+)?\Z|\b(FETCH\s+(?:FIRST|NEXT)\s+)(\d+)(\s+ROWS?\s+ONLY)\Z", re.I)
+
+
+class Estimate(NamedTuple):
+    partitions_total: int
+    partitions_assigned: int
+    bytes_assigned: int
+    aggregating: bool
+
+
+class Decision(NamedTuple):
+    action: str
+    sql: str  # what to run: the original, or the original with the row cap applied
+    reason: str
+    estimate: Estimate | None
+    row_cap: int | None
+
+    @property
+    def message(self) -> str:
+        if self.estimate is None:
+            return self.reason
+        return f"{self.reason} (about {format_bytes(self.estimate.bytes_assigned)} across {self.estimate.partitions_assigned:,} partitions)"
+
+
+def format_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return f"{n:,.0f} {unit}" if unit == "B" else f"{n:,.1f} {unit}"
+        n /= 1024
+
+
+def _result_aggregates(operations: list) -> bool:
+    """
+    Whether the rows the root Result returns come straight from an aggregate. An aggregate elsewhere in the
+    plan (a subquery, a CTE, a scalar filter) says nothing about how many rows the query returns.
+    """
+    # The last step of a multi-step plan produces the result
+    for ops in reversed(operations):
+        children, root = {}, None
+        for op in ops:
+            parents = op.get("parentOperators") or []
+            if not parents and op.get("operation") == "Result":
+                root = op
+            for parent in parents:
+                children.setdefault(parent, []).append(op)
+        if root is None:
+            continue
+        node = root
+        while len(children.get(node.get("id"), [])) == 1:
+            node = children[node.get("id")][0]
+            if node.get("operation") in _AGGREGATING:
+                return True
+            if node.get("operation") not in _PASS_THROUGH:
+                break
+        return False
+    return False
+
+
+def parse_plan(plan: dict) -> Estimate:
+    """Estimate from EXPLAIN USING JSON output: GlobalStats plus whether the result comes from an aggregate."""
+    stats = plan.get("GlobalStats", {})
+    return Estimate(int(stats.get("partitionsTotal", 0)), int(stats.get("partitionsAssigned", 0)),
+                    int(stats.get("bytesAssigned", 0)), _result_aggregates(plan.get("Operations", [])))
+
+
+def strip_tail(sql: str) -> str:
+    """sql without the whitespace, semicolons and comments after its last clause; quoted text is left alone."""
+    end = 0
+    for token in _TOKEN.finditer(sql):
+        text = token.group()
+        if not (text.isspace() or text == ";" or text.startswith(("--", "//", "/*"))):
+            end = token.end()
+    return sql[:end]
+
+
+def cap_rows(sql: str, row_cap: int) -> str:
+    """
+    sql returning at most row_cap + 1 rows; the extra row shows that the cap cut it short. The limit goes on
+    the statement itself rather than around it, so its ORDER BY still decides which rows are kept: an
+    outer SELECT over an ordered subquery need not preserve the order. A smaller LIMIT of its own is kept.
+    """
+    sql = strip_tail(sql)
+    limit = row_cap + 1
+    match = _OUTER_LIMIT.search(sql)
+    if match is None:
+        return f"{sql}\nLIMIT {limit}"
+    prefix, number, suffix = (match.group(1, 2, 3) if match.group(2) else match.group(4, 5, 6))
+    return f"{sql[:match.start()]}{prefix}{min(int(number), limit)}{suffix or ''}"
+
+
+class SqlGuard:
+    def __init__(self, confirm_bytes: float = SQL_CONFIRM_BYTES, reject_bytes: float = SQL_REJECT_BYTES,
+                 confirm_partitions: int = SQL_CONFIRM_PARTITIONS, reject_partitions: int = SQL_REJECT_PARTITIONS,
+                 row_cap: int = SQL_ROW_CAP, enabled: bool = SQL_GUARD_ENABLED, recorder=None):
+        self.confirm_bytes, self.reject_bytes = confirm_bytes, reject_bytes
+        self.confirm_partitions, self.reject_partitions = confirm_partitions, reject_partitions
+        self.row_cap = row_cap
+        self.enabled = enabled
+        # Called as recorder(decision, sql) for every decision, e.g. to keep them in telemetry for tuning
+        self.recorder = recorder
+
+    def explain(self, sql: str, conn) -> Estimate:
+        cursor = conn.cursor()
+        try:
+            with tracing.span("sql.explain"):
+                cursor.execute(f"EXPLAIN USING JSON {_TRAILING.sub('', sql)}")
+                return parse_plan(json.loads(cursor.fetchone()[0]))
+        finally:
+            cursor.close()
+
+    def check(self, sql: str, conn, confirmed: bool = False) -> Decision:
+        """Decide whether sql may run. confirmed skips the confirm budgets (the user already approved)."""
+        if not self.enabled:
+            return Decision(ALLOW, sql, "guard disabled", None, None)
+        try:
+            estimate = self.explain(sql, conn)
+        except Exception as e:
+            # A query EXPLAIN can't compile fails the same way when executed, with a better message
+            decision = Decision(ALLOW, sql, f"EXPLAIN failed: {e}", None, None)
+            return self._record(decision, sql)
+        ESTIMATED_BYTES.observe(estimate.bytes_assigned)
+        if estimate.bytes_assigned > self.reject_bytes or estimate.partitions_assigned > self.reject_partitions:
+            decision = Decision(REJECT, sql, "This query would scan too much data to run from Slack", estimate, None)
+        elif not confirmed and (estimate.bytes_assigned > self.confirm_bytes or estimate.partitions_assigned > self.confirm_partitions):
+            decision = Decision(CONFIRM, sql, "This query is expensive", estimate, None)
+        elif not estimate.aggregating and self.row_cap:
+            decision = Decision(ALLOW, cap_rows(sql, self.row_cap), "row cap applied", estimate, self.row_cap)
+        else:
+            decision = Decision(ALLOW, sql, "within budget", estimate, None)
+        return self._record(decision, sql)
+
+    def _record(self, decision: Decision, sql: str) -> Decision:
+        DECISIONS.inc(action=decision.action)
+        estimate = decision.estimate._asdict() if decision.estimate else {}
+        logger.info("SQL guard: %s", json.dumps({"action": decision.action, "reason": decision.reason, "row_cap": decision.row_cap,
+                                                  "correlation_id": tracing.get_correlation_id(), **estimate}))
+        if self.recorder:
+            try:
+                self.recorder(decision, sql)
+            except Exception as e:
+                logger.warning("Failed to record SQL guard decision: %s", e)
+        return decision
+
+
+class PendingConfirmations:
+    """
+    Queries held for confirmation, by token. With a shared_state backend they are kept there, so the
+    Run anyway click can land on any worker; items then need to_json() and item_type.from_json().
+    """
+
+    def __init__(self, ttl: float = SQL_CONFIRM_TTL, max_pending: int = 1000, backend=None, item_type=None):
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.backend = backend
+        self.item_type = item_type
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # token -> (created_at, user_id, item)
+
+    def add(self, item, user_id: str = None) -> str:
+        """Hold item; user_id, when given, is the only user allowed to approve it."""
+        token = secrets.token_urlsafe(12)
+        if self.backend is not None:
+            self.backend.set(f"sql_confirm:{token}", json.dumps({"user_id": user_id, "item": item.to_json()}), self.ttl)
+            return token
+        with self._lock:
+            self._pending[token] = (time.monotonic(), user_id, item)
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+        return token
+
+    def pop(self, token: str, user_id: str = None):
+        """The item for token if it is still pending and user_id may approve it, else None."""
+        if self.backend is not None:
+            return self._pop_shared(token, user_id)
+        with self._lock:
+            entry = self._pending.get(token)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._pending.pop(token, None)
+                return None
+            if entry[1] and user_id and entry[1] != user_id:
+                return None
+            del self._pending[token]
+        return entry[2]
+
+    def _pop_shared(self, token: str, user_id: str = None):
+        stored = self.backend.get(f"sql_confirm:{token}")
+        if stored is None:
+            return None
+        entry = json.loads(stored)
+        if entry["user_id"] and user_id and entry["user_id"] != user_id:
+            return None
+        # Two clicks on different workers: only the first to claim the token runs the query
+        if not self.backend.add(f"sql_confirm:{token}:taken", "1", self.ttl):
+            return None
+        self.backend.delete(f"sql_confirm:{token}")
+        return self.item_type.from_json(entry["item"])
@@ -0,0 +1,132 @@
+# Result previews sized for Slack.
+# Only the rows that can fit are formatted: cells are truncated to a column width, numbers get thousands
+# separators, and rows are packed into code-block sections under Slack's 3000-character section limit,
+# within however many of the message's 50 blocks the caller can spare. One pass yields the blocks and
+# whether anything (rows or columns) was left out.
+import math
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from numbers import Number
+from typing import NamedTuple
+
+import pandas as pd
+
+SECTION_TEXT_LIMIT = 3000
+MESSAGE_BLOCK_LIMIT = 50
+TABLE_MAX_COL_WIDTH = int(os.getenv("TABLE_MAX_COL_WIDTH", "30"))
+# Widest a table line may get before trailing columns are dropped
+TABLE_MAX_LINE_WIDTH = int(os.getenv("TABLE_MAX_LINE_WIDTH", "120"))
+TABLE_MAX_ROWS = int(os.getenv("TABLE_MAX_ROWS", "200"))
+# Section blocks a preview may use; more blocks show more rows but make a longer message
+TABLE_PREVIEW_BLOCKS = int(os.getenv("TABLE_PREVIEW_BLOCKS", "1"))
+
+_FENCE = "```"
+_GAP = "  "
+
+
+class TablePreview(NamedTuple):
+    blocks: list
+    rows_shown: int
+    total_rows: int
+    columns_shown: int
+    total_columns: int
+
+    @property
+    def overflow(self) -> bool:
+        return self.rows_shown < self.total_rows or self.columns_shown < self.total_columns
+
+    @property
+    def note(self) -> str:
+        """e.g. "Showing 40 of 1,234 rows and 6 of 9 columns", or "" when everything fits."""
+        parts = []
+        if self.rows_shown < self.total_rows:
+            parts.append(f"{self.rows_shown:,} of {self.total_rows:,} rows")
+        if self.columns_shown < self.total_columns:
+            parts.append(f"{self.columns_shown} of {self.total_columns} columns")
+        return f"Showing {' and '.join(parts)}" if parts else ""
+
+
+def format_value(value) -> str:
+    if value is None or value is pd.NA or value is pd.NaT:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        if value and (abs(value) >= 1e15 or abs(value) < 1e-4):
+            return f"{value:.4g}"
+        return f"{value:,.2f}" if value != int(value) else f"{int(value):,}"
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            return str(value)
+        return f"{int(value):,}" if value == value.to_integral_value() else f"{value:,.2f}"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+    return str(value).replace("\n", " ").replace(_FENCE, "'''")
+
+
+def _clip(text: str, width: int) -> str:
+    return text if len(text) <= width else text[:width - 1] + "…"
+
+
+def render_table(df: pd.DataFrame, title: str = "", max_blocks: int = TABLE_PREVIEW_BLOCKS,
+                 max_rows: int = TABLE_MAX_ROWS, max_col_width: int = TABLE_MAX_COL_WIDTH,
+                 max_line_width: int = TABLE_MAX_LINE_WIDTH) -> TablePreview:
+    """Section blocks previewing df. The first block starts with title; each repeats the header row."""
+    total_rows, total_columns = len(df), len(df.columns)
+    max_blocks = max(1, min(max_blocks, MESSAGE_BLOCK_LIMIT))
+    # A line takes at least 3 characters per shown column (cell + gap), so only this many rows could fit
+    shown_bound = max(1, min(total_columns, (max_line_width + len(_GAP)) // 3))
+    row_bound = max_blocks * SECTION_TEXT_LIMIT // (3 * shown_bound - 1)
+    head = df.iloc[:min(total_rows, max_rows, row_bound)]
+
+    columns, headers, cells, widths, numeric = [], [], [], [], []
+    line_width = 0
+    for position, name in enumerate(df.columns):
+        raw = head.iloc[:, position].tolist()
+        header = _clip(str(name), max_col_width)
+        values = [_clip(format_value(v), max_col_width) for v in raw]
+        width = max([len(header)] + [len(v) for v in values])
+        added = width + (len(_GAP) if columns else 0)
+        if columns and line_width + added > max_line_width:
+            break
+        line_width += added
+        columns.append(name)
+        headers.append(header)
+        cells.append(values)
+        widths.append(width)
+        # Right-align numbers; Snowflake NUMBER columns arrive as object dtype holding Decimals
+        numeric.append(all(isinstance(v, Number) and not isinstance(v, bool) for v, text in zip(raw, values) if text))
+
+    def line(row_cells) -> str:
+        return _GAP.join(c.rjust(w) if n else c.ljust(w) for c, w, n in zip(row_cells, widths, numeric)).rstrip()
+
+    header_line = line(headers)
+    blocks, rows_shown = [], 0
+    prefix = f"{title}\n" if title else ""
+    lines = [header_line]
+    size = len(prefix) + 2 * len(_FENCE) + len(header_line)
+    for row in zip(*cells) if cells else ():
+        row_line = line(row)
+        if size + 1 + len(row_line) > SECTION_TEXT_LIMIT:
+            blocks.append(_section(prefix, lines))
+            if len(blocks) == max_blocks:
+                lines = None
+                break
+            prefix, lines = "", [header_line]
+            size = 2 * len(_FENCE) + len(header_line)
+        lines.append(row_line)
+        size += 1 + len(row_line)
+        rows_shown += 1
+    if lines is not None:
+        blocks.append(_section(prefix, lines))
+    return TablePreview(blocks, rows_shown, total_rows, len(columns), total_columns)
+
+
+def _section(prefix: str, lines: list) -> dict:
+    table = "\n".join(lines)
+    return {"type": "section", "text": {"type": "mrkdwn", "text": f"{prefix}{_FENCE}{table}{_FENCE}"}}
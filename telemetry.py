@@ -0,0 +1,229 @@
+# Background telemetry sink: answers, timings, row counts, feedback and errors, bulk-loaded in batches.
+# Handlers only append to a bounded in-memory buffer; one thread writes it out when it reaches
+# TELEMETRY_BATCH_SIZE rows or every TELEMETRY_FLUSH_INTERVAL seconds. Batches that can't be written
+# (warehouse down, no connection yet) are spilled to JSONL files and replayed after the next good write.
+#   TELEMETRY_BACKEND=snowflake  - write_pandas into TELEMETRY_TABLE (created on first load)
+#   TELEMETRY_BACKEND=file       - append JSON lines to TELEMETRY_FILE_PATH (local runs and tests)
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import tracing
+from metrics import REGISTRY
+
+TELEMETRY_BACKEND = os.getenv("TELEMETRY_BACKEND", "").lower()
+TELEMETRY_TABLE = os.getenv("TELEMETRY_TABLE", "SLACK_BOT_TELEMETRY")
+TELEMETRY_FILE_PATH = os.getenv("TELEMETRY_FILE_PATH", "telemetry.jsonl")
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "500"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "60"))
+# Events held in memory; beyond this the oldest are dropped rather than slowing down handlers
+TELEMETRY_MAX_BUFFER = int(os.getenv("TELEMETRY_MAX_BUFFER", "10000"))
+TELEMETRY_SPILL_DIR = os.getenv("TELEMETRY_SPILL_DIR", "telemetry_spill")
+TELEMETRY_SPILL_MAX_FILES = int(os.getenv("TELEMETRY_SPILL_MAX_FILES", "500"))
+
+logger = logging.getLogger(__name__)
+
+EVENTS = REGISTRY.counter("gboagent_telemetry_events_total", "Telemetry events by what happened to them.", ("result",))
+BUFFERED = REGISTRY.gauge("gboagent_telemetry_buffered", "Telemetry events waiting to be written.")
+
+COLUMNS = ("EVENT_TYPE", "EVENT_TIME", "CORRELATION_ID", "USER_ID", "CHANNEL_ID", "MESSAGE_TS", "QUESTION", "SQL_TEXT",
+           "ROW_COUNT", "OUTCOME", "ERROR", "FEEDBACK", "TOTAL_SECONDS", "SQL_SECONDS", "STAGE_TIMINGS",
+           "ESTIMATED_BYTES", "ESTIMATED_PARTITIONS", "EXPORT_FORMAT", "EXPORT_BYTES", "EXPORT_SECONDS")
+
+
+class FileWriter:
+    def __init__(self, path: str = TELEMETRY_FILE_PATH):
+        self.path = path
+
+    def write(self, rows: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(row, default=str) + "\n" for row in rows)
+
+
+class SnowflakeWriter:
+    """Bulk loads with write_pandas (PUT + COPY INTO), so a batch costs one load rather than one INSERT per row."""
+
+    def __init__(self, connect, table: str = TELEMETRY_TABLE):
+        self.connect = connect  # returns the Snowflake connection to load through, or None if not ready
+        self.table = table
+
+    def write(self, rows: list):
+        import pandas as pd
+        from snowflake.connector.pandas_tools import write_pandas
+
+        conn = self.connect()
+        if conn is None:
+            raise ConnectionError("No Snowflake connection yet")
+        success, _, nrows, _ = write_pandas(conn, pd.DataFrame(rows, columns=COLUMNS), self.table, auto_create_table=True)
+        if not success:
+            raise RuntimeError(f"write_pandas loaded {nrows} of {len(rows)} telemetry rows")
+
+
+class TelemetrySink:
+    def __init__(self, writer, batch_size: int = TELEMETRY_BATCH_SIZE, flush_interval: float = TELEMETRY_FLUSH_INTERVAL,
+                 max_buffer: int = TELEMETRY_MAX_BUFFER, spill_dir: str = TELEMETRY_SPILL_DIR,
+                 spill_max_files: int = TELEMETRY_SPILL_MAX_FILES):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.spill_max_files = spill_max_files
+        self._buffer = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+        BUFFERED.set_function(lambda: len(self._buffer))
+        atexit.register(self.close)
+
+    def record(self, event_type: str, **fields):
+        """Queue one event; never blocks on I/O. Field names are the lower-case COLUMNS."""
+        fields.setdefault("correlation_id", tracing.get_correlation_id())
+        row = {column: fields.get(column.lower()) for column in COLUMNS}
+        row["EVENT_TYPE"] = event_type
+        row["EVENT_TIME"] = datetime.now(timezone.utc).isoformat()
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                EVENTS.inc(result="dropped")
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def record_answer(self, result: dict, question: str, timings: dict = None, **fields):
+        """An answered (or failed) question, from CortexChat.chat's result dict and the stage timings."""
+        result = result or {}
+        timings = timings or {}
+        df = result.get('dataframe')
+        if result.get('cancelled'):
+            outcome = "cancelled"
+        elif result.get('rate_limited'):
+            outcome = "rate_limited"
+        elif result.get('report'):
+            outcome = "report"
+        else:
+            outcome = "error" if result.get('error') else "ok"
+        self.record("answer", question=question, sql_text=result.get('sql'), row_count=len(df) if df is not None else None,
+                    outcome=outcome, error=result.get('error') or result.get('warning'),
+                    total_seconds=timings.get("answer"),
+                    sql_seconds=sum(timings.get(stage, 0.0) for stage in ("sql.queue", "sql.execute", "sql.fetch")) or None,
+                    stage_timings=json.dumps({stage: round(seconds, 4) for stage, seconds in timings.items()}), **fields)
+
+    def _take(self) -> list:
+        with self._cond:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.batch_size and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered; on failure the remainder is spilled to disk."""
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            if not self._write(batch):
+                self._spill(batch)
+                self._spill(self._take_all())
+                return
+
+    def _take_all(self) -> list:
+        with self._cond:
+            batch = list(self._buffer)
+            self._buffer.clear()
+        return batch
+
+    def _write(self, batch: list) -> bool:
+        try:
+            with tracing.span("telemetry.write", rows=len(batch)):
+                self.writer.write(batch)
+        except Exception as e:
+            logger.warning("Telemetry write of %d events failed: %s", len(batch), e)
+            return False
+        EVENTS.inc(len(batch), result="written")
+        self._replay()
+        return True
+
+    # --- spill files ---
+    def _spill(self, batch: list):
+        if not batch:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"telemetry-{time.time_ns()}-{os.getpid()}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(row, default=str) + "\n" for row in batch)
+        EVENTS.inc(len(batch), result="spilled")
+        files = sorted(glob.glob(os.path.join(self.spill_dir, "telemetry-*.jsonl")))
+        for old in files[:-self.spill_max_files]:
+            # Oldest spill files go first when the warehouse has been unreachable for a long time
+            os.remove(old)
+            EVENTS.inc(result="spill_dropped")
+
+    def _replay(self):
+        """Load spilled batches (from this or earlier runs, any worker) once writes succeed again."""
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "telemetry-*.jsonl"))):
+            # Renaming claims the file, so two workers never replay the same batch
+            claimed = f"{path}.{os.getpid()}.replay"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                batch = [json.loads(line) for line in f if line.strip()]
+            try:
+                self.writer.write(batch)
+            except Exception as e:
+                os.rename(claimed, path)
+                logger.warning("Telemetry replay of %s failed: %s", path, e)
+                return
+            os.remove(claimed)
+            EVENTS.inc(len(batch), result="replayed")
+
+    def close(self):
+        """Stop the writer thread and spill whatever is still buffered; it is loaded on the next start."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self._spill(self._take_all())
+
+
+class NullSink:
+    """Stands in when TELEMETRY_BACKEND is unset, so handlers can record unconditionally."""
+
+    def record(self, event_type: str, **fields):
+        pass
+
+    def record_answer(self, result: dict, question: str, timings: dict = None, **fields):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_sink(connect=None):
+    """Sink for TELEMETRY_BACKEND. connect returns the Snowflake connection for the snowflake backend."""
+    if TELEMETRY_BACKEND == "snowflake":
+        return TelemetrySink(SnowflakeWriter(connect))
+    if TELEMETRY_BACKEND == "file":
+        return TelemetrySink(FileWriter())
+    if TELEMETRY_BACKEND:
+        raise ValueError(f"Unsupported TELEMETRY_BACKEND: {TELEMETRY_BACKEND!r}")
+    return NullSink()
@@ -0,0 +1,44 @@
+# Checks that in-flight questions can be cancelled from another worker through the shared backend.
+#   python -m unittest test_deadline
+import os
+import tempfile
+import unittest
+
+from deadline import InFlightRegistry
+from shared_state import SQLiteStateBackend
+
+
+class SharedInFlightRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        backend = SQLiteStateBackend(os.path.join(self.tmp.name, "state.sqlite3"))
+        # Two workers sharing one backend
+        self.running = InFlightRegistry(backend=backend, poll=0.05)
+        self.other = InFlightRegistry(backend=backend, poll=0.05)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cancel_on_another_worker(self):
+        deadline = self.running.start("U1", seconds=30)
+        self.assertTrue(self.other.cancel("U1"))
+        self.assertTrue(deadline.wait(2))
+        self.assertEqual(deadline.reason, "cancelled by user")
+
+    def test_newer_question_on_another_worker_supersedes(self):
+        deadline = self.running.start("U1", seconds=30)
+        newer = self.other.start("U1", seconds=30)
+        self.assertTrue(deadline.wait(2))
+        self.assertEqual(deadline.reason, "superseded by a newer question")
+        self.assertFalse(newer.cancelled)
+        self.other.finish("U1", newer)
+
+    def test_finished_question_is_not_cancelled(self):
+        deadline = self.running.start("U1", seconds=30)
+        self.running.finish("U1", deadline)
+        self.assertFalse(self.other.cancel("U1"))
+        self.assertFalse(deadline.cancelled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# Checks both shared_state backends against the same interface. The Redis cases run against a local server
+# (SHARED_STATE_TEST_REDIS_URL, default redis://localhost:6379/15) and are skipped when none is reachable.
+#   python -m unittest test_shared_state
+import os
+import socket
+import tempfile
+import time
+import unittest
+import uuid
+from urllib.parse import urlparse
+
+from shared_state import RedisError, SQLiteStateBackend, open_backend
+
+REDIS_URL = os.getenv("SHARED_STATE_TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+def _redis_reachable() -> bool:
+    parsed = urlparse(REDIS_URL)
+    try:
+        socket.create_connection((parsed.hostname or "localhost", parsed.port or 6379), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+class BackendContract:
+    """Cases every backend must pass; subclasses set self.backend."""
+
+    def key(self, name: str) -> str:
+        return f"test:{self.prefix}:{name}"
+
+    def setUp(self):
+        self.prefix = uuid.uuid4().hex
+
+    def test_set_get_delete(self):
+        self.assertIsNone(self.backend.get(self.key("a")))
+        self.backend.set(self.key("a"), "1")
+        self.assertEqual(self.backend.get(self.key("a")), "1")
+        self.backend.delete(self.key("a"))
+        self.assertIsNone(self.backend.get(self.key("a")))
+
+    def test_ttl_expires(self):
+        self.backend.set(self.key("t"), "1", ttl=0.2)
+        self.assertEqual(self.backend.get(self.key("t")), "1")
+        time.sleep(0.4)
+        self.assertIsNone(self.backend.get(self.key("t")))
+
+    def test_add_only_if_missing(self):
+        self.assertTrue(self.backend.add(self.key("n"), "first"))
+        self.assertFalse(self.backend.add(self.key("n"), "second"))
+        self.assertEqual(self.backend.get(self.key("n")), "first")
+
+    def test_incr(self):
+        self.assertEqual(self.backend.incr(self.key("c")), 1)
+        self.assertEqual(self.backend.incr(self.key("c"), 5), 6)
+
+    def test_push_is_capped_newest_first(self):
+        for i in range(5):
+            self.backend.push(self.key("l"), str(i), max_len=3)
+        self.assertEqual(self.backend.range(self.key("l"), 10), ["4", "3", "2"])
+        self.assertEqual(self.backend.range(self.key("l"), 2), ["4", "3"])
+
+
+class SQLiteStateBackendTest(BackendContract, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = SQLiteStateBackend(os.path.join(self.tmp.name, "state.sqlite3"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+@unittest.skipUnless(_redis_reachable(), f"no Redis server at {REDIS_URL}")
+class RedisStateBackendTest(BackendContract, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = open_backend(REDIS_URL)
+
+    def tearDown(self):
+        for name in ("a", "t", "n", "c", "l", "s"):
+            self.backend.delete(self.key(name))
+        self.backend.close()
+
+    def test_error_in_pipeline_leaves_connection_usable(self):
+        # LPUSH on a string fails with WRONGTYPE; the LTRIM/PEXPIRE replies behind it must still be consumed
+        self.backend.set(self.key("s"), "value")
+        with self.assertRaises(RedisError):
+            self.backend.push(self.key("s"), "x", max_len=3, ttl=60)
+        self.assertEqual(self.backend.get(self.key("s")), "value")
+        self.assertEqual(self.backend.incr(self.key("c")), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
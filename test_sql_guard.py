@@ -0,0 +1,66 @@
+# Checks the pure parts of the SQL cost guard: the row cap rewrite and EXPLAIN plan parsing.
+#   python -m unittest test_sql_guard
+import unittest
+
+from sql_guard import cap_rows, parse_plan
+
+
+class CapRowsTest(unittest.TestCase):
+    def test_appends_limit_after_order_by(self):
+        self.assertEqual(cap_rows("SELECT * FROM t ORDER BY x", 100), "SELECT * FROM t ORDER BY x\nLIMIT 101")
+
+    def test_strips_trailing_semicolons_and_comments(self):
+        self.assertEqual(cap_rows("SELECT * FROM t;  -- all rows\n/* done */ ;\n", 100), "SELECT * FROM t\nLIMIT 101")
+
+    def test_line_comment_ending_the_query_is_not_limited(self):
+        self.assertEqual(cap_rows("SELECT * FROM t -- LIMIT 5", 100), "SELECT * FROM t\nLIMIT 101")
+
+    def test_comment_markers_inside_literals_are_kept(self):
+        self.assertEqual(cap_rows("SELECT * FROM t WHERE note = 'a--b' ORDER BY x", 100),
+                         "SELECT * FROM t WHERE note = 'a--b' ORDER BY x\nLIMIT 101")
+        self.assertEqual(cap_rows("SELECT * FROM t WHERE note = '/* x' OR note = 'it''s'", 100),
+                         "SELECT * FROM t WHERE note = '/* x' OR note = 'it''s'\nLIMIT 101")
+        self.assertEqual(cap_rows('SELECT "a--b" FROM t', 100), 'SELECT "a--b" FROM t\nLIMIT 101')
+
+    def test_lowers_a_larger_closing_limit(self):
+        self.assertEqual(cap_rows("SELECT * FROM t ORDER BY x LIMIT 50000;", 100), "SELECT * FROM t ORDER BY x LIMIT 101")
+        self.assertEqual(cap_rows("SELECT * FROM t LIMIT 50000 OFFSET 10", 100), "SELECT * FROM t LIMIT 101 OFFSET 10")
+        self.assertEqual(cap_rows("SELECT * FROM t FETCH FIRST 50000 ROWS ONLY", 100), "SELECT * FROM t FETCH FIRST 101 ROWS ONLY")
+
+    def test_keeps_a_smaller_closing_limit(self):
+        self.assertEqual(cap_rows("SELECT * FROM t LIMIT 5", 100), "SELECT * FROM t LIMIT 5")
+
+    def test_limit_inside_a_subquery_is_not_the_statement_limit(self):
+        self.assertEqual(cap_rows("SELECT * FROM (SELECT * FROM t LIMIT 5000)", 100),
+                         "SELECT * FROM (SELECT * FROM t LIMIT 5000)\nLIMIT 101")
+
+
+def _plan(*operations):
+    """An EXPLAIN USING JSON plan from (id, operation, parent ids) triples."""
+    return {"GlobalStats": {"partitionsTotal": 10, "partitionsAssigned": 4, "bytesAssigned": 1024},
+            "Operations": [[dict(id=id, operation=operation, **({"parentOperators": parents} if parents else {}))
+                            for id, operation, parents in operations]]}
+
+
+class ParsePlanTest(unittest.TestCase):
+    def test_stats(self):
+        estimate = parse_plan(_plan((0, "Result", []), (1, "TableScan", [0])))
+        self.assertEqual((estimate.partitions_total, estimate.partitions_assigned, estimate.bytes_assigned), (10, 4, 1024))
+        self.assertFalse(estimate.aggregating)
+
+    def test_group_by_feeding_the_result_aggregates(self):
+        self.assertTrue(parse_plan(_plan((0, "Result", []), (1, "Aggregate", [0]), (2, "TableScan", [1]))).aggregating)
+
+    def test_order_by_and_having_over_an_aggregate_still_aggregate(self):
+        plan = _plan((0, "Result", []), (1, "SortWithLimit", [0]), (2, "Filter", [1]), (3, "Aggregate", [2]), (4, "TableScan", [3]))
+        self.assertTrue(parse_plan(plan).aggregating)
+
+    def test_aggregate_in_a_subquery_does_not(self):
+        # SELECT * FROM orders WHERE amount > (SELECT AVG(amount) FROM orders)
+        plan = _plan((0, "Result", []), (1, "Filter", [0]), (2, "CartesianJoin", [1]), (3, "TableScan", [2]),
+                     (4, "Aggregate", [2]), (5, "TableScan", [4]))
+        self.assertFalse(parse_plan(plan).aggregating)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+# Per-stage latency spans tagged with a per-Slack-event correlation ID.
+# Spans feed the gboagent_stage_seconds histogram and emit one structured log record each.
+# With TRACING_ENABLED unset, span() hands back a shared no-op object so the hot path pays one branch;
+# inside a collect_timings() block (telemetry) it only adds each stage's duration to the totals, with no
+# attributes, metrics or log records.
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from metrics import REGISTRY
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+logger = logging.getLogger("gboagent.trace")
+
+STAGE_SECONDS = REGISTRY.histogram("gboagent_stage_seconds", "Duration of answer pipeline stages in seconds.", ("stage", "status"))
+
+_correlation_id = ContextVar("correlation_id", default=None)
+_timings = ContextVar("timings", default=None)
+
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+@contextmanager
+def correlation(correlation_id: str = None):
+    """Bind a correlation ID (usually the Slack event_id) to everything traced inside the block."""
+    token = _correlation_id.set(correlation_id or uuid.uuid4().hex[:16])
+    try:
+        yield _correlation_id.get()
+    finally:
+        _correlation_id.reset(token)
+
+
+@contextmanager
+def collect_timings():
+    """Sum the duration of every stage traced inside the block into the yielded {stage: seconds} dict."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def current_timings() -> dict:
+    return _timings.get() or {}
+
+
+def _emit(stage: str, seconds: float, status: str, attrs: dict):
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+    if not TRACING_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage, status=status)
+    if logger.isEnabledFor(logging.INFO):
+        record = {"span": stage, "duration_ms": round(seconds * 1000, 2), "status": status, "correlation_id": _correlation_id.get()}
+        if attrs:
+            record.update(attrs)
+        logger.info("%s", json.dumps(record, default=str))
+
+
+class _Span:
+    __slots__ = ("stage", "attrs", "start", "status")
+
+    def __init__(self, stage: str, attrs: dict):
+        self.stage = stage
+        self.attrs = attrs
+        self.status = "ok"
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.status = "error"
+            self.attrs.setdefault("error", exc_type.__name__)
+        _emit(self.stage, time.perf_counter() - self.start, self.status, self.attrs)
+        return False
+
+
+class _TimingSpan:
+    """What span() returns with tracing off inside collect_timings(): a stopwatch feeding the totals."""
+    __slots__ = ("stage", "timings", "start")
+
+    def __init__(self, stage: str, timings: dict):
+        self.stage = stage
+        self.timings = timings
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings[self.stage] = self.timings.get(self.stage, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage: str, **attrs):
+    """Time a block as a pipeline stage: `with span("sql.execute") as s: ...; s.set(rows=n)`."""
+    if TRACING_ENABLED:
+        return _Span(stage, attrs)
+    timings = _timings.get()
+    return _NOOP_SPAN if timings is None else _TimingSpan(stage, timings)
+
+
+def record(stage: str, seconds: float, status: str = "ok", **attrs):
+    """Record a stage whose duration was measured by hand (e.g. time-to-first-byte)."""
+    if TRACING_ENABLED:
+        _emit(stage, seconds, status, attrs)
+        return
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
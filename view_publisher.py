@@ -0,0 +1,108 @@
+# App Home publishing that spends Slack API quota only on views that changed.
+# Each user's last published view is remembered as a content hash (in the shared state backend when
+# there is one), so re-opening Home or clicking back to an identical view skips views.publish. Publishes
+# go through one background sender that coalesces repeated updates for the same user while it waits on
+# the Slack gateway, where Home views are the lowest priority behind answers and progress updates.
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import slack_gateway
+from metrics import REGISTRY
+from shared_state import shared_backend
+
+VIEW_HASH_TTL = float(os.getenv("VIEW_HASH_TTL", "86400"))
+VIEW_HASH_USERS = int(os.getenv("VIEW_HASH_USERS", "5000"))
+
+logger = logging.getLogger(__name__)
+
+VIEWS = REGISTRY.counter("gboagent_views_publish_total", "App Home publish requests, by outcome.", ("result",))
+VIEWS_PENDING = REGISTRY.gauge("gboagent_views_publish_pending", "Users with a view waiting to be published.")
+
+
+def view_hash(view: dict) -> str:
+    return hashlib.sha256(json.dumps(view, sort_keys=True, separators=(",", ":")).encode('utf-8')).hexdigest()
+
+
+class ViewPublisher:
+    def __init__(self, ttl: float = VIEW_HASH_TTL, max_users: int = VIEW_HASH_USERS, backend=None):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.backend = backend or shared_backend()
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # user_id -> (client, view, digest), oldest request first
+        self._hashes = OrderedDict()  # user_id -> (digest, published_at), when there is no backend
+        self._thread = None
+        VIEWS_PENDING.set_function(lambda: len(self._pending))
+
+    # --- last published hash per user ---
+    def _last(self, user_id: str):
+        if self.backend is not None:
+            return self.backend.get(f"view:{user_id}")
+        with self._cond:
+            entry = self._hashes.get(user_id)
+        if entry and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def _remember(self, user_id: str, digest: str):
+        if self.backend is not None:
+            self.backend.set(f"view:{user_id}", digest, self.ttl)
+            return
+        with self._cond:
+            self._hashes[user_id] = (digest, time.time())
+            self._hashes.move_to_end(user_id)
+            while len(self._hashes) > self.max_users:
+                self._hashes.popitem(last=False)
+
+    def forget(self, user_id: str):
+        """Make the next publish for user_id go out even if the view looks unchanged."""
+        if self.backend is not None:
+            self.backend.delete(f"view:{user_id}")
+        with self._cond:
+            self._hashes.pop(user_id, None)
+
+    # --- publishing ---
+    def publish(self, client, user_id: str, view: dict) -> bool:
+        """Queue view for user_id unless it is what they already have. Returns False if skipped."""
+        digest = view_hash(view)
+        if self._last(user_id) == digest:
+            VIEWS.inc(result="unchanged")
+            return False
+        with self._cond:
+            if user_id in self._pending:
+                # Only the newest view matters; the one it replaces is never sent
+                VIEWS.inc(result="coalesced")
+            self._pending[user_id] = (client, view, digest)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="view-publisher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                user_id, (client, view, digest) = self._pending.popitem(last=False)
+            self._send(client, user_id, view, digest)
+
+    def _send(self, client, user_id: str, view: dict, digest: str):
+        if self._last(user_id) == digest:
+            VIEWS.inc(result="unchanged")
+            return
+        try:
+            # Paced (and retried on 429) by the gateway; newer views for this user coalesce meanwhile
+            slack_gateway.call(client, "views_publish", slack_gateway.HOME, user_id=user_id, view=view)
+        except Exception as e:
+            VIEWS.inc(result="error")
+            self.forget(user_id)
+            logger.error("Error publishing App Home for %s: %s", user_id, e)
+            return
+        self._remember(user_id, digest)
+        VIEWS.inc(result="published")
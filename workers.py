@@ -0,0 +1,124 @@
+# Multi-worker mode: one Socket Mode connection fans Slack events out to several worker processes.
+# The router acks every envelope immediately, then hands the payload to a worker chosen by hashing the
+# conversation's channel, so each conversation (its memory, in-flight question and Cancel button) always
+# lands on the same worker. Dedupe sets and history live behind SHARED_STATE_URL so all workers share them.
+#
+#   WORKERS=4 SHARED_STATE_URL=sqlite:///state.sqlite3 python workers.py
+import importlib
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+
+from dotenv import load_dotenv
+from slack_sdk.socket_mode import SocketModeClient
+from slack_sdk.socket_mode.request import SocketModeRequest
+from slack_sdk.socket_mode.response import SocketModeResponse
+
+import log_setup
+import metrics
+
+load_dotenv(override=True)
+
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 2)))
+# Each worker takes its share of WAREHOUSE_CONCURRENCY; spawned workers inherit the environment
+os.environ.setdefault("WAREHOUSE_PROCESSES", str(WORKERS))
+# Module that defines the Bolt `app`, `init()` and the CONN / CORTEX_APP globals its handlers use
+WORKER_APP_MODULE = os.getenv("WORKER_APP_MODULE", "app")
+SLACK_APP_TOKEN, SLACK_BOT_TOKEN = os.getenv("SLACK_APP_TOKEN"), os.getenv("SLACK_BOT_TOKEN")
+
+logger = logging.getLogger(__name__)
+
+ROUTED = metrics.REGISTRY.counter("gboagent_router_events_total", "Socket Mode envelopes routed to workers.", ("worker", "type"))
+
+
+def route_key(request_type: str, payload: dict) -> str:
+    """The conversation an envelope belongs to: its channel, or the user for channel-less App Home actions."""
+    if request_type == "events_api":
+        event = payload.get('event', {})
+        return event.get('channel') or event.get('user') or payload.get('event_id', "")
+    if request_type == "interactive":
+        channel = (payload.get('channel') or {}).get('id') or (payload.get('container') or {}).get('channel_id')
+        return channel or (payload.get('user') or {}).get('id', "")
+    if request_type == "slash_commands":
+        return payload.get('channel_id') or payload.get('user_id', "")
+    return ""
+
+
+def _worker_main(index: int, inbox, module_name: str):
+    """Worker process: initialise the bot module once, then dispatch routed payloads through its Bolt app."""
+    from slack_bolt.request import BoltRequest
+
+    log_setup.configure_logging()
+    bot = importlib.import_module(module_name)
+    bot.CONN, bot.CORTEX_APP = bot.init()
+    base_port = int(os.getenv("METRICS_PORT", "0") or 0)
+    if base_port:
+        # The router serves METRICS_PORT; worker i serves METRICS_PORT + 1 + i
+        metrics.start_http_server(base_port + 1 + index)
+    logger.info("Worker %d ready (pid %d)", index, os.getpid())
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        request_type, payload = item
+        try:
+            # Listeners run on Bolt's own thread pool, so this returns as soon as the event is handed off
+            bot.app.dispatch(BoltRequest(body=payload, mode="socket_mode"))
+        except Exception:
+            logger.exception("Worker %d failed to dispatch %s payload", index, request_type)
+
+
+class Router:
+    def __init__(self, workers: int = WORKERS, module_name: str = WORKER_APP_MODULE):
+        self.module_name = module_name
+        self._ctx = multiprocessing.get_context("spawn")
+        self.inboxes = [self._ctx.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=_worker_main, args=(index, self.inboxes[index], self.module_name),
+                                    name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def worker_for(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % len(self.inboxes)
+
+    def _on_request(self, client: SocketModeClient, req: SocketModeRequest):
+        # Ack first: Slack only needs to know the envelope arrived, the work happens on a worker
+        client.send_socket_mode_response(SocketModeResponse(envelope_id=req.envelope_id))
+        if req.type not in ("events_api", "interactive", "slash_commands"):
+            return
+        index = self.worker_for(route_key(req.type, req.payload))
+        ROUTED.inc(worker=str(index), type=req.type)
+        self.inboxes[index].put((req.type, req.payload))
+
+    def run(self):
+        from slack_sdk import WebClient
+
+        for index in range(len(self.processes)):
+            self._spawn(index)
+        client = SocketModeClient(app_token=SLACK_APP_TOKEN, web_client=WebClient(token=SLACK_BOT_TOKEN))
+        client.socket_mode_request_listeners.append(self._on_request)
+        client.connect()
+        logger.info("Router connected; dispatching to %d workers running %s", len(self.processes), self.module_name)
+        try:
+            while True:
+                # Supervise: a crashed worker is replaced and keeps its routing slot (and inbox)
+                for index, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        logger.warning("Worker %d exited with %s; restarting", index, process.exitcode)
+                        self._spawn(index)
+                time.sleep(1)
+        finally:
+            for inbox in self.inboxes:
+                inbox.put(None)
+            client.close()
+
+
+if __name__ == "__main__":
+    log_setup.configure_logging()
+    metrics.start_http_server()
+    Router().run()